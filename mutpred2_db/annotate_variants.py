@@ -0,0 +1,189 @@
+from models.sql_connection import SQL_Connection
+from models.client import MutPred2Client
+from models.variant_batch import VariantBatch, variant_hashes
+from fire import Fire
+from pathlib import Path
+from typing import Dict, Iterator
+import pandas as pd
+import numpy as np
+import tempfile
+import gzip
+import time
+import os
+
+from tqdm import tqdm
+
+ANNOTATION_COLUMNS = ["key", "substitution", "seq_hash", "variant_id", "score", "top_mechanisms", "status"]
+KEY_COLUMNS = {"transcript" : "ensembl_nuc_id",
+                "gene" : "gene_symbol"}
+# Bucket files open at once when grouping the input by key; larger inputs get buckets of more than chunk_size rows
+MAX_BUCKETS = 256
+
+def format_mechanisms(mechanisms : pd.DataFrame, top : int) -> pd.Series:
+    """
+    The top mechanisms (by posterior) of each variant, formatted as in the MutPred2 output, indexed by variant_id
+    """
+    if len(mechanisms) == 0:
+        return pd.Series(dtype=object)
+    top_mechanisms = mechanisms.sort_values(["variant_id", "score"], ascending=[True, False]).groupby("variant_id").head(top)
+    effect = top_mechanisms['mechanism_type'].map({"gain" : "Gain of ", "loss" : "Loss of ", "altered" : "Altered "})
+    text = (effect + top_mechanisms['name'] + " (Pr = " + top_mechanisms['score'].map("{:.2f}".format)
+                + " | P = " + top_mechanisms['pvalue'].map("{:.2e}".format) + ")")
+    return text.groupby(top_mechanisms['variant_id']).agg("; ".join)
+
+def read_input(input_file : str, sep : str, header : bool, chunk_size : int) -> Iterator[pd.DataFrame]:
+    try:
+        reader = pd.read_csv(input_file, sep=sep, header=0 if header else None, usecols=[0, 1], dtype=str,
+                                chunksize=chunk_size, keep_default_na=False)
+    except pd.errors.EmptyDataError:
+        return
+    for chunk in reader:
+        chunk.columns = ["key", "substitution"]
+        yield chunk
+
+def bucketed_input(input_file : str, sep : str, header : bool, chunk_size : int, bucket_dir : str|Path) -> Iterator[pd.DataFrame]:
+    """
+    The input rows grouped by key, chunk_size rows at a time: rows are hashed by key into bucket files of about
+    chunk_size rows (at most MAX_BUCKETS files) in bucket_dir, then each bucket is sorted by key, so all the rows of
+    a key are annotated in the same or consecutive chunks whatever the input order
+    """
+    n_rows = sum(len(chunk) for chunk in read_input(input_file, sep, header, chunk_size))
+    n_buckets = min(MAX_BUCKETS, max(1, -(-n_rows // chunk_size)))
+    paths = [Path(bucket_dir) / f"bucket_{bucket}.tsv" for bucket in range(n_buckets)]
+    files = [open(path, 'w', newline='') for path in paths]
+    try:
+        for chunk in read_input(input_file, sep, header, chunk_size):
+            buckets = pd.util.hash_pandas_object(chunk['key'], index=False).to_numpy() % n_buckets
+            for bucket, rows in chunk.groupby(buckets):
+                rows.to_csv(files[bucket], sep="\t", header=False, index=False)
+    finally:
+        for file in files:
+            file.close()
+    for path in paths:
+        if path.stat().st_size > 0:
+            rows = pd.read_csv(path, sep="\t", header=None, names=["key", "substitution"], dtype=str, keep_default_na=False)
+            rows = rows.sort_values("key", kind="stable", ignore_index=True)
+            for start in range(0, len(rows), chunk_size):
+                yield rows.iloc[start:start + chunk_size]
+        os.remove(path)
+
+def annotate_chunk(client : MutPred2Client, chunk : pd.DataFrame, key_type : str, option_id : int,
+                    top_mechanisms : int, max_pvalue : float) -> pd.DataFrame:
+    """
+    Annotate a chunk of (key, substitution) rows, one output row per protein the key maps to
+    """
+    column = KEY_COLUMNS[key_type]
+    parsed = VariantBatch.parse_substitutions(chunk['substitution'].to_numpy(dtype=str), strict=False)
+    chunk = chunk.assign(reference_aa=parsed['reference_aa'], position=parsed['position'],
+                            alternate_aa=parsed['alternate_aa'], valid=parsed['valid'])
+    mappings = client.sequence_mappings(column, chunk['key'].unique())[[column, "seq_hash"]].drop_duplicates()
+    annotated = chunk.merge(mappings, left_on="key", right_on=column, how="left").drop(columns=column)
+    annotated['variant_id'] = None
+    lookup = annotated['valid'] & annotated['seq_hash'].notna()
+    for seq_hash, group in annotated[lookup].groupby("seq_hash", sort=True):
+        annotated.loc[group.index, 'variant_id'] = variant_hashes(seq_hash, group['reference_aa'].tolist(), group['position'].tolist(),
+                                                                    group['alternate_aa'].tolist(), option_id)
+    variant_ids = annotated.loc[lookup, 'variant_id']
+    variants = client.protein_variants(annotated.loc[lookup, 'seq_hash'])
+    scores = variants.set_index("variant_id")['score']
+    found = variant_ids[variant_ids.isin(scores.index)]
+    mechanisms = format_mechanisms(client.mechanisms(found, max_pvalue=max_pvalue), top_mechanisms)
+    annotated['score'] = annotated['variant_id'].map(scores)
+    annotated['top_mechanisms'] = annotated['variant_id'].map(mechanisms)
+    annotated['status'] = np.select([~annotated['valid'], annotated['seq_hash'].isna(), annotated['score'].isna()],
+                                    ["invalid_substitution", "unmapped", "not_found"], "ok")
+    return annotated[ANNOTATION_COLUMNS]
+
+def annotate_variants(sql_config_name : str, sql_config_file : str, input_file : str, output_file : str,
+                        key_type : str="transcript",
+                        option_id : int=1,
+                        chunk_size : int=100000,
+                        top_mechanisms : int=3,
+                        max_pvalue : float=0.05,
+                        sep : str="\t",
+                        header : bool=False,
+                        batch_size : int=1000,
+                        cache_size : int=1024,
+                        bucket_input : bool=True):
+    """
+    Annotate a (possibly very large) list of variants with their MutPred2 score and top mechanisms
+
+    The input is read and annotated chunk by chunk, and each annotated chunk is appended to the output, so memory
+    does not grow with the input. Within a chunk, keys are resolved to proteins through SequenceMapping, variant ids
+    are computed per protein (as in Variant), and the variants of each protein are fetched once (and kept in the
+    client's LRU cache). With bucket_input, the input is first grouped by key (see bucketed_input), so each protein
+    is fetched once overall whatever the input order
+
+    Parameters
+    ----------
+    sql_config_name, sql_config_file : str
+        The entry of the yaml config file holding the database credentials
+
+    input_file : str
+        A delimited file whose first two columns are an Ensembl transcript (or gene symbol) and a protein substitution, e.g. M1A
+
+    output_file : str
+        The annotated output (key, substitution, seq_hash, variant_id, score, top_mechanisms, status),
+        gzip compressed if it ends with .gz. status is ok, not_found, unmapped or invalid_substitution
+
+    key_type : str
+        "transcript" (matched to SequenceMapping.ensembl_nuc_id as stored) or "gene" (matched to gene_symbol)
+
+    option_id : int
+        The run option of the variants
+
+    chunk_size : int
+        The number of input rows annotated at a time
+
+    top_mechanisms : int
+        The number of mechanisms (with the highest posterior) reported per variant
+
+    max_pvalue : float
+        Only report mechanisms with a p-value at or below this threshold
+
+    sep : str
+        The delimiter of the input and output files
+
+    header : bool
+        Whether the input file starts with a header line
+
+    batch_size : int
+        The number of keys per lookup query
+
+    cache_size : int
+        The number of proteins kept in the client cache
+
+    bucket_input : bool
+        Group the input rows by key before annotating them, in temporary files next to output_file; the output is then
+        grouped by key rather than in input order. Without it, the input should be sorted by key, as a protein whose
+        rows are spread across chunks is fetched again once it left the client cache
+    """
+    if key_type not in KEY_COLUMNS:
+        raise ValueError(f"key_type must be one of {list(KEY_COLUMNS)}, not {key_type}")
+    sql_connection = SQL_Connection(sql_config_name, sql_config_file)
+    client = MutPred2Client(sql_connection, batch_size=batch_size, cache_size=cache_size, option_id=option_id)
+    status_counts : Dict[str,int] = {}
+    n_rows = 0
+    start = time.time()
+    open_output = gzip.open if str(output_file).endswith(".gz") else open
+    with open_output(output_file, 'wt', newline='') as output, tqdm(desc="Annotating variants", unit="rows") as progress, \
+            tempfile.TemporaryDirectory(prefix=".annotate_", dir=Path(output_file).resolve().parent) as bucket_dir:
+        output.write(sep.join(ANNOTATION_COLUMNS) + "\n")
+        if bucket_input:
+            chunks = bucketed_input(input_file, sep, header, chunk_size, bucket_dir)
+        else:
+            chunks = read_input(input_file, sep, header, chunk_size)
+        for chunk in chunks:
+            annotated = annotate_chunk(client, chunk, key_type, option_id, top_mechanisms, max_pvalue)
+            annotated.to_csv(output, sep=sep, header=False, index=False)
+            for status, count in annotated['status'].value_counts().items():
+                status_counts[status] = status_counts.get(status, 0) + count
+            n_rows += len(chunk)
+            progress.update(len(chunk))
+    seconds = time.time() - start
+    print(f"Annotated {n_rows} variants in {seconds:.1f}s ({n_rows / max(seconds, 1e-9):.0f} rows/s)")
+    print(f"Status: {status_counts}")
+    print(f"Cache: {client.cache_stats()}")
+
+if __name__ == "__main__":
+    Fire(annotate_variants)
@@ -0,0 +1,108 @@
+from models.flat_export import export_parts, export_protein, export_job, stored_proteins
+from fire import Fire
+
+def read_list(list_file : str) -> list:
+    with open(list_file,'r') as file:
+        return [line.strip() for line in file if line.strip()]
+
+def export_database(sql_config_name : str, sql_config_file : str, output_file : str,
+                    option_id : int=1,
+                    protein_list_file : str|None=None,
+                    workers : int=1,
+                    chunk_size : int=5000,
+                    fetch_size : int=10000,
+                    max_mechanism_pvalue : float|None=None,
+                    sep : str="\t"):
+    """
+    Export stored MutPred2 results to a flat file in the classic MutPred2 layout: one row per variant with its
+    score and the position, posterior, p-value and effect of each mechanism (see models/flat_export.FLAT_COLUMNS)
+
+    Proteins are exported in parallel, each worker reading one protein at a time on its own streaming cursor and
+    pivoting chunk_size variants at a time, so memory does not grow with the number of proteins or variants
+
+    Parameters
+    ----------
+    sql_config_name, sql_config_file : str
+        The entry of the yaml config file holding the database credentials
+
+    output_file : str
+        The output, gzip compressed if it ends with .gz
+
+    option_id : int
+        The run option of the variants
+
+    protein_list_file : str|None
+        A file listing one seq_hash per line (default every protein with variants of option_id)
+
+    workers : int
+        The number of processes proteins are fanned out to, each with its own connection
+
+    chunk_size : int
+        The number of variants pivoted at a time
+
+    fetch_size : int
+        The number of rows read per fetch from the streaming cursor
+
+    max_mechanism_pvalue : float|None
+        Only report mechanisms with a p-value at or below this threshold
+
+    sep : str
+        The delimiter of the output ("," for CSV)
+    """
+    if protein_list_file is not None:
+        proteins = read_list(protein_list_file)
+    else:
+        from models.sql_connection import SQL_Connection
+        sql_connection = SQL_Connection(sql_config_name, sql_config_file, pool_name="flat_export_list", pool_size=1)
+        cursor, cnx = sql_connection.open()
+        try:
+            proteins = stored_proteins(cursor, option_id, fetch_size)
+        finally:
+            sql_connection.close(cnx, cursor)
+    report = export_parts(proteins, export_protein, output_file, sep=sep, workers=workers, desc="Exporting proteins",
+                            sql_config_name=sql_config_name, sql_config_file=sql_config_file, option_id=option_id,
+                            chunk_size=chunk_size, max_mechanism_pvalue=max_mechanism_pvalue, fetch_size=fetch_size)
+    print(f"Exported {report['rows']} variants of {report['parts']} proteins in {report['seconds']:.1f}s "
+            f"({report['rows_per_second']:.0f} rows/s)")
+
+def export_jobs(output_file : str,
+                job_list_file : str|None=None,
+                job_path : str|None=None,
+                workers : int=1,
+                chunk_size : int=5000,
+                sep : str="\t",
+                **run_option_kwargs):
+    """
+    Export MutPred2 jobs to a flat file in the classic MutPred2 layout straight from their output arrays,
+    without a database (see export_database for the layout)
+
+    Parameters
+    ----------
+    output_file : str
+        The output, gzip compressed if it ends with .gz
+
+    job_list_file : str|None
+        A file listing one job directory per line
+
+    job_path : str|None
+        A single job directory
+
+    workers : int
+        The number of processes jobs are fanned out to
+
+    run_option_kwargs
+        The run options of the jobs, and max_mechanism_pvalue, as in process_job.process_job_list
+    """
+    if job_path is not None:
+        job_list = [job_path]
+    elif job_list_file is not None:
+        job_list = read_list(job_list_file)
+    else:
+        raise ValueError("Either job_list_file or job_path must be provided")
+    report = export_parts(job_list, export_job, output_file, sep=sep, workers=workers, desc="Exporting jobs",
+                            chunk_size=chunk_size, **run_option_kwargs)
+    print(f"Exported {report['rows']} variants of {report['parts']} jobs in {report['seconds']:.1f}s "
+            f"({report['rows_per_second']:.0f} rows/s)")
+
+if __name__ == "__main__":
+    Fire({"database" : export_database, "jobs" : export_jobs})
@@ -0,0 +1,87 @@
+from models.ingest_daemon import IngestDaemon, spool_job, wait_for_status, submit
+from fire import Fire
+import json
+
+def serve(sql_config_name : str|None=None, sql_config_file : str|None=None,
+            spool_dir : str|None=None,
+            socket_path : str|None=None,
+            poll_seconds : float=1.0,
+            staging_dir : str|None=None,
+            parquet_dir : str|None=None,
+            **run_option_kwargs):
+    """
+    Run a long-lived ingest worker (see models/ingest_daemon.IngestDaemon): the ingest modules, the database connection
+    and the Mechanism table are loaded once, then the jobs sent to the spool directory or the socket are processed
+    on the warm connection, each reporting its status. Stop with Ctrl-C or a shutdown request
+
+    Parameters
+    ----------
+    sql_config_name, sql_config_file : str
+        The entry of the yaml config file holding the database credentials
+
+    spool_dir : str|None
+        Take jobs from <spool_dir>/inbox/*.job files and write their status to <spool_dir>/status/*.json
+
+    socket_path : str|None
+        Take jobs over this unix socket, one job directory (or JSON request) per line
+
+    poll_seconds : float
+        The interval between scans of the inbox
+
+    staging_dir, parquet_dir : str|None
+        As in process_job.process_job_list; staged files are loaded after each job
+
+    run_option_kwargs
+        Run options and optional arguments of Processor.process, as in process_job.process_job_list
+    """
+    daemon = IngestDaemon(sql_config_name, sql_config_file, spool_dir=spool_dir, socket_path=socket_path, poll_seconds=poll_seconds,
+                            staging_dir=staging_dir, parquet_dir=parquet_dir, **run_option_kwargs)
+    try:
+        daemon.serve()
+    except KeyboardInterrupt:
+        pass
+    print(json.dumps(daemon.stats(), indent=2))
+
+def send(*job_dirs : str, socket_path : str|None=None, spool_dir : str|None=None, job_list_file : str|None=None,
+            wait : bool=True, timeout : float|None=None):
+    """
+    Send jobs to a running daemon and print the status of each (a spooled job is only waited for with --wait)
+
+    Parameters
+    ----------
+    job_dirs : str
+        The job directories
+
+    socket_path, spool_dir : str|None
+        The socket or the spool directory of the daemon
+
+    job_list_file : str|None
+        A file listing one job directory per line, sent after job_dirs
+    """
+    job_dirs = list(job_dirs)
+    if job_list_file is not None:
+        with open(job_list_file,'r') as file:
+            job_dirs += [line.strip() for line in file if line.strip()]
+    if socket_path is not None:
+        for status in submit(socket_path, job_dirs):
+            print(json.dumps(status))
+    elif spool_dir is not None:
+        status_paths = [spool_job(spool_dir, job_dir) for job_dir in job_dirs]
+        print(f"Spooled {len(status_paths)} jobs in {spool_dir}")
+        if wait:
+            for status_path in status_paths:
+                print(json.dumps(wait_for_status(status_path, timeout=timeout)))
+    else:
+        raise ValueError("Either socket_path or spool_dir must be provided")
+
+def stats(socket_path : str):
+    """
+    Print the statistics of a running daemon: its startup time, uptime and jobs processed
+    """
+    print(json.dumps(next(submit(socket_path, [dict(command="stats")])), indent=2))
+
+def shutdown(socket_path : str):
+    print(json.dumps(next(submit(socket_path, [dict(command="shutdown")]))))
+
+if __name__ == "__main__":
+    Fire({"serve" : serve, "send" : send, "stats" : stats, "shutdown" : shutdown})
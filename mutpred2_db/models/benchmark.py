@@ -0,0 +1,196 @@
+from .job_processor import Processor
+from .feature_block import FEATURE_GROUPS
+from .feature_codec import FEATURE_VECTOR_COLUMNS
+from .feature_sites import FEATURE_SITE_COLUMNS, FEATURE_SITE_VARIANT_COLUMNS
+from .delta_sync import TABLE_KEYS
+from .memory import current_rss_mb, peak_rss_mb
+from .sqlite_connection import SQLiteConnection
+from .sql_connection import (initialize_mechanisms, write_sequence, write_variants, write_mechanisms, write_feature_sets,
+                                write_feature_vectors, feature_set_columns, SEQUENCE_COLUMNS, VARIANT_COLUMNS, MECHANISM_COLUMNS)
+
+from pathlib import Path
+from typing import Callable, Dict, List, Tuple
+import json
+import platform
+import subprocess
+import sys
+import time
+
+# Run options of the synthetic jobs (the only ones query_runoption supports)
+RUN_OPTIONS = dict(compute_homology_profile=True, use_predicted_conservation_scores=True, skip_psi_blast=False, p_value_threshold=1)
+
+# Columns of the tables of the local database stand-in, unique on delta_sync.TABLE_KEYS as in sql/building_tables.sql
+STANDIN_TABLES = {"Protein" : SEQUENCE_COLUMNS,
+                    "Mechanism" : ("mechanism_id", "name"),
+                    "Variant" : VARIANT_COLUMNS,
+                    "VariantMechanism" : MECHANISM_COLUMNS,
+                    "FeatureVector" : FEATURE_VECTOR_COLUMNS,
+                    "FeatureSite" : FEATURE_SITE_COLUMNS,
+                    "FeatureSiteVariant" : FEATURE_SITE_VARIANT_COLUMNS,
+                    **{table : feature_set_columns(feature_set_type) for table, (feature_set_type, _) in FEATURE_GROUPS.items()}}
+STANDIN_KEYS = {"Mechanism" : ("mechanism_id",), **TABLE_KEYS}
+
+# Import time budgets in seconds of the CLI modules (paid by every run and every joblib worker);
+# ingest_daemon only loads the ingest modules when serving, so sending jobs stays cheap
+STARTUP_BUDGETS = {"process_job" : 0.35, "ingest_daemon" : 0.12}
+
+def create_standin_tables(cursor, cnx) -> None:
+    """
+    Create the ingested tables in a SQLiteConnection database, so the writers of sql_connection can run without a MySQL server
+    """
+    for table, columns in STANDIN_TABLES.items():
+        cursor.execute(f"CREATE TABLE IF NOT EXISTS {table} ({', '.join(columns)}, UNIQUE ({', '.join(STANDIN_KEYS[table])}))")
+    cnx.commit()
+
+def timed(function : Callable, *args, **kwargs) -> Tuple[object,Dict[str,float]]:
+    """
+    Call function, returning its result and the wall time in seconds and the RSS (and its growth) in MB
+    """
+    rss = current_rss_mb()
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    seconds = time.perf_counter() - start
+    rss_after = current_rss_mb()
+    return result, dict(seconds=seconds, rss_mb=rss_after, rss_growth_mb=rss_after - rss)
+
+def add_measurement(results : Dict[str,Dict], name : str, measurement : Dict[str,float], variants : int, rows : int) -> None:
+    """
+    Accumulate a measurement of a stage or writer over jobs, keeping the time, counts and the largest RSS
+    """
+    entry = results.setdefault(name, dict(seconds=0.0, variants=0, rows=0, rss_mb=0.0, rss_growth_mb=0.0))
+    entry['seconds'] += measurement['seconds']
+    entry['variants'] += variants
+    entry['rows'] += rows
+    entry['rss_mb'] = max(entry['rss_mb'], measurement['rss_mb'])
+    entry['rss_growth_mb'] = max(entry['rss_growth_mb'], measurement['rss_growth_mb'])
+
+def benchmark_stages(job_dir : str, results : Dict[str,Dict], **kwargs) -> Dict:
+    """
+    Time each parsing stage of Processor on a job, adding the measurements to results
+
+    Returns
+    -------
+    Dict
+        The parsed job, as returned by Processor.parse (with feature_vectors as well as the features_* blocks)
+    """
+    processor = Processor(None, None, **kwargs)
+    option_id = processor.run_option_id(**RUN_OPTIONS)
+    sequence, measurement = timed(processor.make_sequence, job_dir)
+    add_measurement(results, "stage.make_sequence", measurement, 0, 1)
+    variants, measurement = timed(processor.make_variants, job_dir, sequence, option_id)
+    add_measurement(results, "stage.make_variants", measurement, len(variants), len(variants))
+    mechanisms, measurement = timed(processor.make_mechanisms, job_dir, variants, max_pvalue=kwargs.get('max_mechanism_pvalue'))
+    add_measurement(results, "stage.make_mechanisms", measurement, len(variants), len(mechanisms))
+    features, measurement = timed(processor.make_features, job_dir, variants, option_id)
+    add_measurement(results, "stage.make_features", measurement, len(variants), sum(map(len, features)))
+    feature_vectors, measurement = timed(processor.make_feature_vectors, job_dir, variants, option_id)
+    add_measurement(results, "stage.make_feature_vectors", measurement, len(variants), len(feature_vectors))
+    parsed = dict(sequence=sequence, variants=variants, mechanisms=mechanisms, feature_vectors=feature_vectors)
+    parsed.update({table : block for table, block in zip(FEATURE_GROUPS, features)})
+    return parsed
+
+def benchmark_writers(parsed : Dict, cursor, cnx, results : Dict[str,Dict], batch_size : int|None=None) -> None:
+    """
+    Time each writer of sql_connection on a parsed job, each committing once, adding the measurements to results
+    """
+    n_variants = len(parsed['variants'])
+    _, measurement = timed(write_sequence, cursor, cnx, parsed['sequence'])
+    add_measurement(results, "writer.write_sequence", measurement, 0, 1)
+    n_rows, measurement = timed(write_variants, cursor, cnx, parsed['variants'], batch_size=batch_size)
+    add_measurement(results, "writer.write_variants", measurement, n_variants, n_rows)
+    n_rows, measurement = timed(write_mechanisms, cursor, cnx, parsed['mechanisms'], batch_size=batch_size)
+    add_measurement(results, "writer.write_mechanisms", measurement, n_variants, n_rows)
+    for table in FEATURE_GROUPS:
+        n_rows, measurement = timed(write_feature_sets, cursor, cnx, parsed[table], table, batch_size=batch_size)
+        add_measurement(results, f"writer.write_feature_sets.{table}", measurement, n_variants, n_rows)
+    n_rows, measurement = timed(write_feature_vectors, cursor, cnx, parsed['feature_vectors'], batch_size=batch_size)
+    add_measurement(results, "writer.write_feature_vectors", measurement, n_variants, n_rows)
+
+def run_benchmarks(job_dirs : List[str], database : str|Path, batch_size : int|None=None, **kwargs) -> Dict:
+    """
+    Benchmark the Processor stages and the sql_connection writers on jobs, writing to a SQLite stand-in database
+
+    Parameters
+    ----------
+    job_dirs : List[str]
+        The (usually synthetic, see synthetic_job) job directories
+
+    database : str|Path
+        The SQLite database file of the stand-in; it should be empty, as rows already stored are ignored
+
+    batch_size : int|None
+        The number of rows per INSERT statement (default sql_connection.DEFAULT_BATCH_SIZE)
+
+    kwargs
+        Optional arguments of Processor (load_threads, hash_workers, feature_dtype, ...)
+
+    Returns
+    -------
+    Dict
+        The environment, and for each stage and writer its time, variant and row counts, rates (variants_per_s,
+        rows_per_s) and RSS; the peak RSS of the run is in peak_rss_mb
+    """
+    connection = SQLiteConnection(database)
+    cursor, cnx = connection.open()
+    try:
+        create_standin_tables(cursor, cnx)
+        initialize_mechanisms(cursor, cnx)
+        results = {}
+        for job_dir in job_dirs:
+            parsed = benchmark_stages(job_dir, results, **kwargs)
+            benchmark_writers(parsed, cursor, cnx, results, batch_size=batch_size)
+            del parsed
+    finally:
+        connection.close(cnx, cursor)
+    for entry in results.values():
+        entry['variants_per_s'] = entry['variants'] / entry['seconds'] if entry['seconds'] > 0 else 0.0
+        entry['rows_per_s'] = entry['rows'] / entry['seconds'] if entry['seconds'] > 0 else 0.0
+    return dict(environment=dict(python=platform.python_version(), machine=platform.machine(), jobs=len(job_dirs), batch_size=batch_size),
+                results=results,
+                peak_rss_mb=peak_rss_mb())
+
+def import_seconds(module : str, cwd : str|Path|None=None, repeats : int=3) -> float:
+    """
+    The time to import module in a fresh interpreter beyond the interpreter's own startup (the best of repeats runs)
+    """
+    def best(code : str) -> float:
+        seconds = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            subprocess.run([sys.executable, "-c", code], cwd=cwd, check=True)
+            seconds.append(time.perf_counter() - start)
+        return min(seconds)
+    return max(best(f"import {module}") - best("pass"), 0.0)
+
+def startup_report(cwd : str|Path, budgets : Dict[str,float]=STARTUP_BUDGETS, repeats : int=3) -> Dict[str,Dict[str,float]]:
+    """
+    The import time of each module of budgets (run from cwd), its budget and whether it is over budget
+    """
+    report = {}
+    for module, budget in budgets.items():
+        seconds = import_seconds(module, cwd, repeats)
+        report[module] = dict(seconds=seconds, budget_seconds=budget, over_budget=seconds > budget)
+    return report
+
+def save_baseline(report : Dict, path : str|Path) -> None:
+    with open(path, 'w') as file:
+        json.dump(report, file, indent=2, sort_keys=True)
+
+def load_baseline(path : str|Path) -> Dict:
+    with open(path, 'r') as file:
+        return json.load(file)
+
+def compare_to_baseline(report : Dict, baseline : Dict, tolerance : float=0.2) -> Dict[str,Dict[str,float]]:
+    """
+    The stages and writers whose rows_per_s dropped by more than tolerance (a fraction) from the baseline,
+    with both rates and their ratio
+    """
+    regressions = {}
+    for name, entry in report['results'].items():
+        reference = baseline.get('results', {}).get(name)
+        if reference is None or reference['rows_per_s'] <= 0:
+            continue
+        ratio = entry['rows_per_s'] / reference['rows_per_s']
+        if ratio < 1 - tolerance:
+            regressions[name] = dict(rows_per_s=entry['rows_per_s'], baseline_rows_per_s=reference['rows_per_s'], ratio=ratio)
+    return regressions
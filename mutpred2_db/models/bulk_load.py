@@ -0,0 +1,161 @@
+from .sql_connection import iter_rows
+from typing import Dict, Iterable, List, Sequence as SequenceType
+from pathlib import Path
+import os
+
+import numpy as np
+from tqdm import tqdm
+
+# Tables are loaded parents first so the foreign keys of each table already resolve
+LOAD_ORDER = ["Protein", "Variant", "VariantMechanism",
+                "features_sequence", "features_substitution", "features_pssm",
+                "features_conservation", "features_homology", "features_structure",
+                "features_function", "FeatureVector", "FeatureSite", "FeatureSiteVariant"]
+
+# Binary columns, staged as hex and decoded with UNHEX when loaded
+BINARY_COLUMNS = {"features", "site_mask"}
+
+NULL = "\\N"
+_ESCAPES = str.maketrans({"\\" : "\\\\",
+                            "\t" : "\\t",
+                            "\n" : "\\n",
+                            "\r" : "\\r",
+                            "\0" : "\\0"})
+
+def format_value(value) -> str:
+    """
+    Format a value for a LOAD DATA staging file (default ESCAPED BY '\\\\' conventions)
+    NULL and NaN are written as \\N, bytes as hex (see BINARY_COLUMNS)
+    """
+    if value is None:
+        return NULL
+    if isinstance(value, (bytes, bytearray)):
+        return value.hex()
+    if isinstance(value, str):
+        return value.translate(_ESCAPES)
+    if isinstance(value, (bool, np.bool_)):
+        return "1" if value else "0"
+    if isinstance(value, (float, np.floating)):
+        if value != value:
+            return NULL
+        return repr(float(value))
+    return str(value)
+
+class TSVStager:
+    def __init__(self, staging_dir : str|Path):
+        """
+        Stream table rows into per-table TSV staging files that can be loaded with LOAD DATA LOCAL INFILE
+
+        Each file starts with a header line holding the column names, so staging files produced on a node
+        without database access can be loaded later with load_staged_files
+
+        Parameters
+        ----------
+        staging_dir : str|Path
+            The directory in which to write <table>.tsv files
+        """
+        self.staging_dir = Path(staging_dir)
+        self.staging_dir.mkdir(parents=True, exist_ok=True)
+        self.files = {}
+        self.job_offsets = {}
+
+    def path(self, table : str) -> Path:
+        return self.staging_dir / f"{table}.tsv"
+
+    def _open(self, table : str, columns : SequenceType[str]):
+        if table not in self.files:
+            path = self.path(table)
+            exists = path.exists() and path.stat().st_size > 0
+            file = open(path, 'a', encoding='utf-8', newline='\n')
+            if exists:
+                with open(path, 'r', encoding='utf-8') as f:
+                    header = f.readline().rstrip("\n").split("\t")
+                if header != list(columns):
+                    file.close()
+                    raise ValueError(f"Staging file {path} has columns {header[:3]}..., expected {list(columns)[:3]}...")
+            else:
+                file.write("\t".join(columns) + "\n")
+            self.files[table] = file
+        return self.files[table]
+
+    def begin_job(self) -> None:
+        self.job_offsets = {table : file.tell() for table, file in self.files.items()}
+
+    def write_rows(self, table : str, columns : SequenceType[str], rows : Iterable[tuple], **kwargs) -> int:
+        file = self._open(table, columns)
+        self.job_offsets.setdefault(table, file.tell())
+        n_written = 0
+        for row in iter_rows(rows):
+            file.write("\t".join(map(format_value, row)))
+            file.write("\n")
+            n_written += 1
+        return n_written
+
+    def end_job(self) -> None:
+        for file in self.files.values():
+            file.flush()
+        self.job_offsets = {}
+
+    def abort_job(self) -> None:
+        """
+        Drop the rows written since begin_job so a failed job leaves no partial rows behind
+        """
+        for table, offset in self.job_offsets.items():
+            file = self.files[table]
+            file.flush()
+            file.truncate(offset)
+            file.seek(offset)
+        self.job_offsets = {}
+
+    def close(self) -> None:
+        for file in self.files.values():
+            file.close()
+        self.files = {}
+
+    def load(self, cursor, cnx, truncate : bool=True) -> Dict[str,int]:
+        """
+        Load the staged rows into the database and optionally empty the staging files
+
+        Returns
+        -------
+        Dict[str,int]
+            The number of rows reported by the server for each table
+        """
+        self.close()
+        loaded = load_staged_files(cursor, cnx, self.staging_dir)
+        if truncate:
+            for table in loaded:
+                os.remove(self.path(table))
+        return loaded
+
+def load_statement(table : str, columns : SequenceType[str]) -> str:
+    binary = [column for column in columns if column in BINARY_COLUMNS]
+    return (f"LOAD DATA LOCAL INFILE %s IGNORE INTO TABLE {table} "
+            "CHARACTER SET utf8mb4 "
+            "FIELDS TERMINATED BY '\\t' ESCAPED BY '\\\\' "
+            "LINES TERMINATED BY '\\n' "
+            "IGNORE 1 LINES "
+            f"({', '.join('@' + column if column in BINARY_COLUMNS else column for column in columns)})"
+            + (" SET " + ", ".join(f"{column} = UNHEX(@{column})" for column in binary) if binary else "")
+            + ";")
+
+def load_staged_files(cursor, cnx, staging_dir : str|Path) -> Dict[str,int]:
+    """
+    Load every <table>.tsv staging file in staging_dir, in foreign key order, in a single transaction
+    The connection must have been opened with allow_local_infile=True
+    """
+    staging_dir = Path(staging_dir)
+    tables = [table for table in LOAD_ORDER if (staging_dir / f"{table}.tsv").exists()]
+    loaded = {}
+    try:
+        for table in tqdm(tables, desc="Loading staged tables", leave=False):
+            path = staging_dir / f"{table}.tsv"
+            with open(path, 'r', encoding='utf-8') as f:
+                columns = f.readline().rstrip("\n").split("\t")
+            cursor.execute(load_statement(table, columns), (str(path.resolve()),))
+            loaded[table] = cursor.rowcount
+    except Exception as e:
+        cnx.rollback()
+        raise e
+    cnx.commit()
+    return loaded
@@ -0,0 +1,230 @@
+from .sql_connection import SQL_Connection, iter_batches, query_feature_vectors, DEFAULT_BATCH_SIZE, VARIANT_COLUMNS, MECHANISM_COLUMNS
+from .mechanism import Mechanism
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Hashable, Iterable, List, Sequence as SequenceType
+import numpy as np
+import pandas as pd
+
+MAPPING_COLUMNS = ("seq_hash", "ensembl_prot_id", "ensembl_gene_id", "ensembl_nuc_id", "gene_symbol", "MANE_select")
+
+class LRUCache:
+    def __init__(self, max_size : int):
+        """
+        A least recently used cache holding at most max_size entries
+        """
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key : Hashable):
+        if key not in self.entries:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return self.entries[key]
+
+    def put(self, key : Hashable, value) -> None:
+        if self.max_size <= 0:
+            return
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def clear(self) -> None:
+        self.entries.clear()
+
+    def stats(self) -> Dict[str,int]:
+        return dict(entries=len(self.entries), hits=self.hits, misses=self.misses)
+
+class MutPred2Client:
+    def __init__(self, sql_connection : SQL_Connection, batch_size : int=DEFAULT_BATCH_SIZE, threads : int=4,
+                    cache_size : int=1024, option_id : int|None=None):
+        """
+        Batched read access to a MutPred2 database
+
+        Key lists are split into chunks of batch_size keys, each read with one IN (...) query; chunks are queried
+        concurrently on pooled connections. The variants of recently used proteins and the protein mappings of
+        recently used transcripts and genes are kept in in-process LRU caches, so repeated point lookups on hot
+        proteins need no round-trip
+
+        Parameters
+        ----------
+        sql_connection : SQL_Connection
+            The connection pool queries are run on
+
+        batch_size : int
+            The number of keys per query
+
+        threads : int
+            The number of chunks queried concurrently, at most the pool size
+
+        cache_size : int
+            The number of proteins (and of transcripts or genes) kept in the caches; 0 disables caching
+
+        option_id : int|None
+            If given, only return variants computed with this run option
+        """
+        self.sql_connection = sql_connection
+        self.batch_size = batch_size
+        self.threads = threads
+        self.option_id = option_id
+        self.protein_cache = LRUCache(cache_size)
+        self.mapping_cache = LRUCache(cache_size)
+
+    @staticmethod
+    def from_config(config_name : str, config_file : str, **kwargs) -> "MutPred2Client":
+        return MutPred2Client(SQL_Connection(config_name, config_file), **kwargs)
+
+    def query(self, query : str, keys : Iterable, params : SequenceType=()) -> List[tuple]:
+        """
+        Run query once per chunk of keys and return all rows
+
+        query must hold a {keys} placeholder, replaced by the %s placeholders of a chunk; params are passed before the keys
+        """
+        chunks = list(iter_batches(dict.fromkeys(keys), self.batch_size))
+        def run(chunk : List) -> List[tuple]:
+            cursor, cnx = self.sql_connection.open()
+            try:
+                cursor.execute(query.format(keys=", ".join(["%s"] * len(chunk))), (*params, *chunk))
+                return cursor.fetchall()
+            finally:
+                self.sql_connection.close(cnx, cursor)
+        if len(chunks) <= 1 or self.threads <= 1:
+            results = list(map(run, chunks))
+        else:
+            with ThreadPoolExecutor(max_workers=min(self.threads, len(chunks))) as executor:
+                results = list(executor.map(run, chunks))
+        return [row for rows in results for row in rows]
+
+    @staticmethod
+    def variant_frame(rows : List[tuple]) -> pd.DataFrame:
+        frame = pd.DataFrame.from_records(rows, columns=VARIANT_COLUMNS)
+        return frame.astype(dict(position=np.int64, score=float, option_id=np.int64))
+
+    def filter_option(self, frame : pd.DataFrame) -> pd.DataFrame:
+        if self.option_id is None:
+            return frame
+        return frame[frame['option_id'] == self.option_id]
+
+    def variants(self, variant_ids : Iterable[str]) -> pd.DataFrame:
+        """
+        The Variant rows of variant_ids (in VARIANT_COLUMNS); unknown ids are left out
+        """
+        rows = self.query(f"SELECT {', '.join(VARIANT_COLUMNS)} FROM Variant WHERE variant_id IN ({{keys}})", variant_ids)
+        return self.filter_option(MutPred2Client.variant_frame(rows))
+
+    def protein_variants(self, seq_hashes : Iterable[str]) -> pd.DataFrame:
+        """
+        Every variant of the proteins, read from the protein cache when possible
+        """
+        seq_hashes = list(dict.fromkeys(seq_hashes))
+        frames = {seq_hash : self.protein_cache.get(seq_hash) for seq_hash in seq_hashes}
+        missing = [seq_hash for seq_hash, frame in frames.items() if frame is None]
+        if len(missing) > 0:
+            rows = self.query(f"SELECT {', '.join(VARIANT_COLUMNS)} FROM Variant WHERE seq_hash IN ({{keys}})", missing)
+            fetched = MutPred2Client.variant_frame(rows)
+            for seq_hash, frame in fetched.groupby('seq_hash', sort=False):
+                frames[seq_hash] = frame.reset_index(drop=True)
+            for seq_hash in missing:
+                if frames[seq_hash] is None:
+                    frames[seq_hash] = fetched.iloc[:0]
+                self.protein_cache.put(seq_hash, frames[seq_hash])
+        if len(frames) == 0:
+            return MutPred2Client.variant_frame([])
+        return self.filter_option(pd.concat(frames.values(), ignore_index=True))
+
+    def lookup(self, seq_hashes : SequenceType[str], positions : SequenceType[int], alternate_aas : SequenceType[str]) -> pd.DataFrame:
+        """
+        The variants at (seq_hash, position, alternate_aa), one row per query in query order
+        (with missing values where no variant matches, and one row per run option unless the client has an option_id)
+        """
+        queries = pd.DataFrame(dict(seq_hash=np.asarray(seq_hashes, dtype=object),
+                                    position=np.asarray(positions, dtype=np.int64),
+                                    alternate_aa=np.asarray(alternate_aas, dtype=object)))
+        variants = self.protein_variants(queries['seq_hash'])
+        return queries.merge(variants, on=["seq_hash", "position", "alternate_aa"], how="left")[list(VARIANT_COLUMNS)]
+
+    def sequence_mappings(self, column : str, keys : Iterable[str]) -> pd.DataFrame:
+        """
+        The SequenceMapping rows whose column (ensembl_nuc_id, gene_symbol, ...) is one of keys, read from the mapping cache when possible
+        """
+        if column not in MAPPING_COLUMNS:
+            raise ValueError(f"column must be one of {MAPPING_COLUMNS}, not {column}")
+        keys = list(dict.fromkeys(keys))
+        frames = {key : self.mapping_cache.get((column, key)) for key in keys}
+        missing = [key for key, frame in frames.items() if frame is None]
+        if len(missing) > 0:
+            rows = self.query(f"SELECT {', '.join(MAPPING_COLUMNS)} FROM SequenceMapping WHERE {column} IN ({{keys}})", missing)
+            fetched = pd.DataFrame.from_records(rows, columns=MAPPING_COLUMNS)
+            for key in missing:
+                frames[key] = fetched[fetched[column] == key].reset_index(drop=True)
+                self.mapping_cache.put((column, key), frames[key])
+        if len(frames) == 0:
+            return pd.DataFrame(columns=MAPPING_COLUMNS)
+        return pd.concat(frames.values(), ignore_index=True)
+
+    def mapped_variants(self, column : str, keys : Iterable[str]) -> pd.DataFrame:
+        mappings = self.sequence_mappings(column, keys)[[column, "seq_hash"]].drop_duplicates()
+        return mappings.merge(self.protein_variants(mappings['seq_hash']), on="seq_hash")
+
+    def transcript_variants(self, ensembl_nuc_ids : Iterable[str]) -> pd.DataFrame:
+        """
+        Every variant of the proteins of Ensembl transcripts (looked up through ensembl_transcript_idx), with an ensembl_nuc_id column
+        """
+        return self.mapped_variants("ensembl_nuc_id", ensembl_nuc_ids)
+
+    def gene_variants(self, gene_symbols : Iterable[str]) -> pd.DataFrame:
+        """
+        Every variant of the proteins of genes, with a gene_symbol column
+        """
+        return self.mapped_variants("gene_symbol", gene_symbols)
+
+    def mechanisms(self, variant_ids : Iterable[str], max_pvalue : float|None=None) -> pd.DataFrame:
+        """
+        The VariantMechanism rows of variant_ids (in MECHANISM_COLUMNS, plus the mechanism name),
+        optionally only those with a p-value at or below max_pvalue
+        """
+        condition, params = ("", ()) if max_pvalue is None else ("pvalue <= %s AND ", (max_pvalue,))
+        rows = self.query(f"SELECT {', '.join(MECHANISM_COLUMNS)} FROM VariantMechanism WHERE {condition}variant_id IN ({{keys}})",
+                            variant_ids, params)
+        frame = pd.DataFrame.from_records(rows, columns=MECHANISM_COLUMNS).astype(dict(score=float, pvalue=float))
+        frame['name'] = np.asarray(Mechanism.mechanism_order, dtype=object)[frame['mechanism_id'].to_numpy(dtype=np.int64)]
+        return frame
+
+    def features(self, variant_ids : Iterable[str], table : str) -> pd.DataFrame:
+        """
+        The rows of a features_* table for variant_ids, indexed by variant_id
+        """
+        if not table.startswith("features_"):
+            raise ValueError(f"{table} is not a features table")
+        cursor, cnx = self.sql_connection.open()
+        try:
+            cursor.execute(f"SELECT * FROM {table} LIMIT 0")
+            cursor.fetchall()
+            columns = [description[0] for description in cursor.description]
+        finally:
+            self.sql_connection.close(cnx, cursor)
+        rows = self.query(f"SELECT * FROM {table} WHERE variant_id IN ({{keys}})", variant_ids)
+        return pd.DataFrame.from_records(rows, columns=columns).set_index("variant_id")
+
+    def feature_vectors(self, variant_ids : Iterable[str], runoption_id : int, tables : List[str]|None=None) -> pd.DataFrame:
+        """
+        The packed feature vectors of variant_ids (see sql_connection.query_feature_vectors)
+        """
+        cursor, cnx = self.sql_connection.open()
+        try:
+            return query_feature_vectors(cursor, cnx, variant_ids, runoption_id, tables=tables, batch_size=self.batch_size)
+        finally:
+            self.sql_connection.close(cnx, cursor)
+
+    def cache_stats(self) -> Dict[str,Dict[str,int]]:
+        return dict(proteins=self.protein_cache.stats(), mappings=self.mapping_cache.stats())
+
+    def clear_cache(self) -> None:
+        self.protein_cache.clear()
+        self.mapping_cache.clear()
@@ -0,0 +1,187 @@
+from .sequence import Sequence
+from .sql_connection import iter_batches, iter_rows, write_rows, write_sequence, DEFAULT_BATCH_SIZE
+from .schema import FEATURE_TABLES
+
+from typing import Dict, Iterable, List, Sequence as SequenceType, Set
+import numpy as np
+from tqdm import tqdm
+
+# The unique key of each ingested table, on which existing rows are looked up
+TABLE_KEYS = {"Protein" : ("seq_hash",),
+                "Variant" : ("variant_id",),
+                "VariantMechanism" : ("variant_id", "mechanism_id"),
+                "FeatureVector" : ("variant_id", "runoption_id"),
+                "FeatureSite" : ("seq_hash", "position", "runoption_id"),
+                "FeatureSiteVariant" : ("variant_id", "runoption_id"),
+                **{table : ("variant_id", "runoption_id") for table in FEATURE_TABLES}}
+
+SYNC_MODES = ("keys", "content")
+
+# Stored values within these tolerances of the new values are unchanged: scores are DECIMAL(4,3) and features FLOAT
+CONTENT_ATOL = 5e-4
+CONTENT_RTOL = 1e-6
+
+# seq_hash of the proteins known to be stored in each database (see known_sequences), filled once the job writing
+# (or finding) them commits
+KNOWN_SEQUENCES : Dict[tuple,Set[str]] = {}
+
+def database_key(sql_connection) -> tuple:
+    """
+    The database a SQL_Connection (host, port, database) or SQLiteConnection (path) connects to
+    """
+    return tuple(getattr(sql_connection, name, None) for name in ("host", "port", "database", "path"))
+
+def known_sequences(sql_connection=None) -> Set[str]:
+    """
+    The seq_hash of the proteins known to be stored in the database of sql_connection, shared by the Processors
+    of the process writing to that database. Without sql_connection, a new set for the caller to keep with its connection
+    """
+    if sql_connection is None:
+        return set()
+    return KNOWN_SEQUENCES.setdefault(database_key(sql_connection), set())
+
+def forget_sequences(sql_connection=None) -> None:
+    """
+    Forget the proteins known to be stored in the database of sql_connection (default every database), e.g. after
+    proteins were deleted
+    """
+    if sql_connection is None:
+        KNOWN_SEQUENCES.clear()
+    else:
+        KNOWN_SEQUENCES.pop(database_key(sql_connection), None)
+
+def existing_rows(cursor, table : str, keys : Iterable[tuple], columns : SequenceType[str]=(), batch_size : int=DEFAULT_BATCH_SIZE) -> Dict[tuple,tuple]:
+    """
+    The stored rows among keys (tuples of TABLE_KEYS[table] values), read with one query per batch_size keys
+    restricting every key column to its values in the batch (keys are sorted, so a batch spans few values of the
+    leading columns and the query reads little beyond the batch, e.g. the sites of one protein and run option)
+
+    Returns
+    -------
+    Dict[tuple,tuple]
+        The values of columns (empty tuples if no columns are given) of each stored key
+    """
+    key_columns = TABLE_KEYS[table]
+    keys = set(keys)
+    found = {}
+    for batch in iter_batches(sorted(keys), batch_size):
+        values = [list(dict.fromkeys(column_values)) for column_values in zip(*batch)]
+        conditions = " AND ".join(f"{column} IN ({', '.join(['%s'] * len(column_values))})"
+                                    for column, column_values in zip(key_columns, values))
+        cursor.execute(f"SELECT {', '.join([*key_columns, *columns])} FROM {table} WHERE {conditions}",
+                        [value for column_values in values for value in column_values])
+        for row in cursor.fetchall():
+            key = tuple(row[:len(key_columns)])
+            if key in keys:
+                found[key] = tuple(row[len(key_columns):])
+    return found
+
+def changed_rows(new_rows : List[tuple], stored_rows : List[tuple]) -> np.ndarray:
+    """
+    Whether each new row differs from its stored row, comparing numeric columns within CONTENT_ATOL/CONTENT_RTOL
+    (NULL and NaN compare equal) and other columns exactly
+    """
+    changed = np.zeros(len(new_rows), dtype=bool)
+    if len(new_rows) == 0:
+        return changed
+    for new_column, stored_column in zip(zip(*new_rows), zip(*stored_rows)):
+        try:
+            new_values = np.asarray(new_column, dtype=float)
+            stored_values = np.asarray(stored_column, dtype=float)
+        except (TypeError, ValueError):
+            changed |= np.array([new != stored for new, stored in zip(new_column, stored_column)], dtype=bool)
+            continue
+        changed |= ~np.isclose(new_values, stored_values, rtol=CONTENT_RTOL, atol=CONTENT_ATOL, equal_nan=True)
+    return changed
+
+def sync_rows(cursor, table : str, columns : SequenceType[str], rows : Iterable[tuple], **kwargs) -> Dict[str,int]:
+    """
+    Write only the rows missing from a table (and, comparing content, update the stored rows that changed), without committing
+
+    Rows are handled chunk_size at a time: the stored keys of a chunk are read in batches (see existing_rows), the
+    missing rows are inserted with write_rows and the changed rows are written with an updating upsert
+
+    Required Parameters
+    ----------
+    table : str
+        One of TABLE_KEYS
+
+    columns : Tuple[str]
+        The column names, in the order the row values are given (including the key columns)
+
+    rows : Iterable[tuple]|FeatureBlock|MechanismBlock|VariantBatch|FeatureVectorBlock
+        The rows to write
+
+    Optional Parameters
+    ----------
+    compare_content : bool
+        Also read the stored values of existing rows and update those that changed (default False: existing rows are kept)
+
+    known : Set[tuple]
+        Keys known to be stored, skipped without a query
+
+    batch_size : int
+        The number of keys per lookup and of rows per INSERT statement (default DEFAULT_BATCH_SIZE)
+
+    chunk_size : int
+        The number of rows compared at a time (default 10 batches)
+
+    Returns
+    -------
+    Dict[str,int]
+        The number of rows inserted, updated and unchanged
+    """
+    compare_content = kwargs.get("compare_content", False)
+    known = kwargs.get("known", set())
+    batch_size = kwargs.get("batch_size", DEFAULT_BATCH_SIZE) or DEFAULT_BATCH_SIZE
+    chunk_size = kwargs.get("chunk_size", 10 * batch_size)
+    columns = tuple(columns)
+    key_index = [columns.index(column) for column in TABLE_KEYS[table]]
+    content_index = [i for i in range(len(columns)) if i not in key_index] if compare_content else []
+    content_columns = [columns[i] for i in content_index]
+    counts = dict(inserted=0, updated=0, unchanged=0)
+    with tqdm(desc=f"Syncing {table}", leave=False, unit="rows") as progress:
+        for chunk in iter_batches(iter_rows(rows), chunk_size):
+            chunk_keys = [tuple(row[i] for i in key_index) for row in chunk]
+            stored = existing_rows(cursor, table, [key for key in chunk_keys if key not in known], content_columns, batch_size)
+            missing = [row for row, key in zip(chunk, chunk_keys) if key not in known and key not in stored]
+            existing = [(row, stored[key]) for row, key in zip(chunk, chunk_keys) if key in stored]
+            changed = []
+            if compare_content and len(existing) > 0:
+                new_content = [tuple(row[i] for i in content_index) for row, _ in existing]
+                mask = changed_rows(new_content, [stored_content for _, stored_content in existing])
+                changed = [row for (row, _), is_changed in zip(existing, mask) if is_changed]
+            if len(missing) > 0:
+                write_rows(cursor, table, columns, missing, batch_size=batch_size, total=len(missing))
+            if len(changed) > 0:
+                write_rows(cursor, table, columns, changed, batch_size=batch_size, total=len(changed), update=True)
+            counts['inserted'] += len(missing)
+            counts['updated'] += len(changed)
+            counts['unchanged'] += len(chunk) - len(missing) - len(changed)
+            progress.update(len(chunk))
+    return counts
+
+def sync_sequence(cursor, cnx, sequence : Sequence, **kwargs) -> bool:
+    """
+    write_sequence, skipped (without a query) for proteins in known or (with one query) already stored
+
+    Optional Parameters
+    ----------
+    known : Set[str]
+        The seq_hash of the proteins known to be stored, updated with the protein (see known_sequences)
+
+    Returns
+    -------
+    bool
+        Whether the protein was written
+    """
+    known = kwargs.pop("known", set())
+    if sequence.seq_hash in known:
+        return False
+    if len(existing_rows(cursor, "Protein", [(sequence.seq_hash,)])) > 0:
+        known.add(sequence.seq_hash)
+        return False
+    write_sequence(cursor, cnx, sequence, **kwargs)
+    if kwargs.get("do_commit", True):
+        known.add(sequence.seq_hash)
+    return True
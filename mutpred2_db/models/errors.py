@@ -0,0 +1,15 @@
+class JobDataError(ValueError):
+    """
+    The output of a job is incomplete or inconsistent (missing shards, substitutions not matching the sequence,
+    arrays of the wrong shape, site features not matching the stored ones): the job fails, the other jobs of the run go on
+    """
+
+class PartialCommitError(Exception):
+    """
+    The commit of a table connection failed after the job's Protein and Variant rows (and maybe other tables) were
+    committed: the job fails with the committed and rolled back tables recorded, and re-processing it completes it
+    """
+    def __init__(self, message : str, committed : list, rolled_back : list):
+        super().__init__(message)
+        self.committed = committed
+        self.rolled_back = rolled_back
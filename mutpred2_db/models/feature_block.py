@@ -0,0 +1,98 @@
+from .feature_set import Features_Set
+from .features_conservation import Features_Conservation
+from .features_function import Features_Function
+from .features_homology import Features_Homology
+from .features_pssm import Features_PSSM
+from .features_sequence import Features_Sequence
+from .features_structure import Features_Structure
+from .features_substitution import Features_Substitution
+from .errors import JobDataError
+
+from typing import TYPE_CHECKING, Dict, Iterable, Iterator, Type
+import numpy as np
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+# Table, feature set type and columns of the MutPred2 feats matrix of each feature group
+FEATURE_GROUPS = {"features_sequence" : (Features_Sequence, slice(0, 184)),
+                    "features_substitution" : (Features_Substitution, slice(184, 630)),
+                    "features_pssm" : (Features_PSSM, slice(630, 799)),
+                    "features_conservation" : (Features_Conservation, slice(799, 1036)),
+                    "features_homology" : (Features_Homology, slice(1036, 1056)),
+                    "features_structure" : (Features_Structure, slice(1056, 1135)),
+                    "features_function" : (Features_Function, slice(1135, 1345))}
+
+class FeatureBlock:
+    row_chunk_size = 1024
+
+    def __init__(self, feature_set_type : Type[Features_Set], variant_ids : Iterable[str], runoption_id : int, values : np.ndarray):
+        """
+        The feature sets of one feature group for many variants, stored as a 2D slice of the feats matrix
+
+        Parameters
+        ----------
+        feature_set_type : Type[Features_Set]
+            The feature group, whose __features_order__ names the columns of values
+
+        variant_ids : Iterable[str]
+            The variant of each row of values
+
+        runoption_id : int
+            The run option shared by all rows
+
+        values : np.ndarray
+            (n_variants, n_features) array, usually a view of the feats matrix
+        """
+        self.feature_set_type = feature_set_type
+        self.variant_ids = np.asarray(variant_ids)
+        self.runoption_id = runoption_id
+        self.values = values
+        if self.values.shape != (len(self.variant_ids), len(feature_set_type.__features_order__)):
+            raise JobDataError(f"{feature_set_type.__name__} values have shape {self.values.shape}, expected "
+                                f"({len(self.variant_ids)}, {len(feature_set_type.__features_order__)})")
+
+    @staticmethod
+    def from_feats(feats : np.ndarray, variant_ids : Iterable[str], runoption_id : int) -> Dict[str,"FeatureBlock"]:
+        """
+        Split a (n_variants, 1345) MutPred2 feats matrix into one FeatureBlock per feature table, without copying
+        """
+        variant_ids = np.asarray(variant_ids)
+        return {table : FeatureBlock(feature_set_type, variant_ids, runoption_id, feats[:, columns])
+                    for table, (feature_set_type, columns) in FEATURE_GROUPS.items()}
+
+    def __len__(self) -> int:
+        return self.values.shape[0]
+
+    def __getitem__(self, i : int) -> Features_Set:
+        return self.feature_set_type(str(self.variant_ids[i]), self.runoption_id, self.values[i])
+
+    def __iter__(self) -> Iterator[Features_Set]:
+        for i in range(len(self)):
+            yield self[i]
+
+    @property
+    def columns(self) -> tuple:
+        return ("variant_id", "runoption_id", *self.feature_set_type.__features_order__)
+
+    def rows(self) -> Iterator[tuple]:
+        """
+        Yield (variant_id, runoption_id, *features) tuples, converting the values to Python floats a chunk at a time
+        """
+        for start in range(0, len(self), self.row_chunk_size):
+            stop = start + self.row_chunk_size
+            for variant_id, values in zip(self.variant_ids[start:stop].tolist(), self.values[start:stop].tolist()):
+                yield (variant_id, self.runoption_id, *values)
+
+    def to_arrays(self) -> Dict[str,np.ndarray]:
+        arrays = {"variant_id" : self.variant_ids,
+                    "runoption_id" : np.full(len(self), self.runoption_id)}
+        arrays.update(zip(self.feature_set_type.__features_order__, self.values.T))
+        return arrays
+
+    def to_frame(self) -> "pd.DataFrame":
+        import pandas as pd
+        frame = pd.DataFrame(self.values, columns=self.feature_set_type.__features_order__)
+        frame.insert(0, "runoption_id", self.runoption_id)
+        frame.insert(0, "variant_id", self.variant_ids)
+        return frame
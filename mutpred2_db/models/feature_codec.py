@@ -0,0 +1,148 @@
+from .feature_block import FEATURE_GROUPS, FeatureBlock
+from .errors import JobDataError
+
+from typing import TYPE_CHECKING, Dict, Iterable, Iterator, List
+import numpy as np
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+# Columns of the MutPred2 feats matrix, i.e. the __features_order__ of every feature group in FEATURE_GROUPS order
+FEATURE_COLUMNS = tuple(column for feature_set_type, _ in FEATURE_GROUPS.values() for column in feature_set_type.__features_order__)
+N_FEATURES = len(FEATURE_COLUMNS)
+
+FEATURE_VECTOR_COLUMNS = ("variant_id", "runoption_id", "dtype", "features")
+
+# Storage types of packed feature vectors (little endian); float16 vectors are clipped to its finite range
+FEATURE_DTYPES = {"float32" : np.dtype('<f4'),
+                    "float16" : np.dtype('<f2')}
+
+def storage_values(values : np.ndarray, dtype : str="float32") -> np.ndarray:
+    """
+    The values as stored with dtype (float16 values are clipped to its finite range)
+    """
+    if dtype not in FEATURE_DTYPES:
+        raise ValueError(f"dtype must be one of {list(FEATURE_DTYPES)}, not {dtype}")
+    storage_type = FEATURE_DTYPES[dtype]
+    values = np.asarray(values, dtype=float)
+    if dtype == "float16":
+        limit = np.finfo(storage_type).max
+        values = np.clip(values, -limit, limit)
+    return np.ascontiguousarray(values, dtype=storage_type)
+
+def pack_rows(values : np.ndarray, dtype : str="float32") -> List[bytes]:
+    """
+    Pack each row of a 2D matrix (of any width) into a bytes blob of dtype values
+    """
+    packed = storage_values(values, dtype).tobytes()
+    width = values.shape[1] * FEATURE_DTYPES[dtype].itemsize
+    if width == 0:
+        return [b""] * values.shape[0]
+    return [packed[start:start + width] for start in range(0, len(packed), width)]
+
+def encode_features(feats : np.ndarray, dtype : str="float32") -> List[bytes]:
+    """
+    Pack each row of a (n_variants, N_FEATURES) feats matrix into a bytes blob of dtype values
+    """
+    feats = np.asarray(feats, dtype=float)
+    if feats.ndim != 2 or feats.shape[1] != N_FEATURES:
+        raise ValueError(f"feats has shape {feats.shape}, expected (n_variants, {N_FEATURES})")
+    return pack_rows(feats, dtype)
+
+def decode_features(blobs : Iterable[bytes], dtypes : Iterable[str]|str="float32") -> np.ndarray:
+    """
+    Unpack feature blobs into a (n_variants, N_FEATURES) float32 matrix
+
+    Parameters
+    ----------
+    blobs : Iterable[bytes]
+        Blobs written by encode_features
+
+    dtypes : Iterable[str]|str
+        The dtype of each blob, or of all of them
+    """
+    blobs = list(blobs)
+    dtypes = [dtypes] * len(blobs) if isinstance(dtypes, str) else list(dtypes)
+    values = np.empty((len(blobs), N_FEATURES), dtype=np.float32)
+    for dtype in set(dtypes):
+        rows = [i for i, row_dtype in enumerate(dtypes) if row_dtype == dtype]
+        packed = b"".join(blobs[i] for i in rows)
+        values[rows] = np.frombuffer(packed, dtype=FEATURE_DTYPES[dtype]).reshape(len(rows), N_FEATURES)
+    return values
+
+def features_frame(variant_ids : Iterable[str], values : np.ndarray, tables : Iterable[str]|None=None) -> "pd.DataFrame":
+    """
+    Named feature columns (see FEATURE_COLUMNS) indexed by variant_id, optionally restricted to the
+    columns of some feature tables (e.g. ['features_pssm'])
+    """
+    import pandas as pd
+    if tables is None:
+        return pd.DataFrame(values, index=pd.Index(list(variant_ids), name="variant_id"), columns=FEATURE_COLUMNS)
+    columns = np.concatenate([np.arange(N_FEATURES)[FEATURE_GROUPS[table][1]] for table in tables])
+    return pd.DataFrame(values[:, columns], index=pd.Index(list(variant_ids), name="variant_id"),
+                        columns=[FEATURE_COLUMNS[i] for i in columns])
+
+class FeatureVectorBlock:
+    row_chunk_size = 4096
+
+    def __init__(self, variant_ids : Iterable[str], runoption_id : int, values : np.ndarray, dtype : str="float32"):
+        """
+        The full feature vectors of many variants, written as one packed blob per variant to the FeatureVector table
+        instead of the seven features_* tables
+
+        Parameters
+        ----------
+        variant_ids : Iterable[str]
+            The variant of each row of values
+
+        runoption_id : int
+            The run option shared by all rows
+
+        values : np.ndarray
+            (n_variants, N_FEATURES) feats matrix
+
+        dtype : str
+            The storage type of the blobs, "float32" or "float16" (quantized, about half the size)
+        """
+        self.variant_ids = np.asarray(variant_ids)
+        self.runoption_id = runoption_id
+        self.values = values
+        self.dtype = dtype
+        if dtype not in FEATURE_DTYPES:
+            raise ValueError(f"dtype must be one of {list(FEATURE_DTYPES)}, not {dtype}")
+        if self.values.shape != (len(self.variant_ids), N_FEATURES):
+            raise JobDataError(f"Feature vectors have shape {self.values.shape}, expected ({len(self.variant_ids)}, {N_FEATURES})")
+
+    @staticmethod
+    def from_blocks(blocks : Dict[str,FeatureBlock], dtype : str="float32") -> "FeatureVectorBlock":
+        """
+        Reassemble the feature vectors from the FeatureBlock of every feature table
+        """
+        first = blocks[next(iter(FEATURE_GROUPS))]
+        return FeatureVectorBlock(first.variant_ids, first.runoption_id,
+                                    np.concatenate([blocks[table].values for table in FEATURE_GROUPS], axis=1), dtype)
+
+    def __len__(self) -> int:
+        return self.values.shape[0]
+
+    @property
+    def columns(self) -> tuple:
+        return FEATURE_VECTOR_COLUMNS
+
+    def rows(self) -> Iterator[tuple]:
+        """
+        Yield (variant_id, runoption_id, dtype, features) tuples, packing the vectors a chunk at a time
+        """
+        for start in range(0, len(self), self.row_chunk_size):
+            stop = start + self.row_chunk_size
+            for variant_id, blob in zip(self.variant_ids[start:stop].tolist(), encode_features(self.values[start:stop], self.dtype)):
+                yield (variant_id, self.runoption_id, self.dtype, blob)
+
+    def to_arrays(self) -> Dict[str,np.ndarray]:
+        return dict(variant_id=self.variant_ids,
+                    runoption_id=np.full(len(self), self.runoption_id),
+                    dtype=np.full(len(self), self.dtype, dtype=object),
+                    features=np.array(encode_features(self.values, self.dtype), dtype=object))
+
+    def to_frame(self) -> "pd.DataFrame":
+        return features_frame(self.variant_ids, self.values)
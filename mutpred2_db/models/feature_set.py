@@ -1,4 +1,3 @@
-import pandas as pd
 import abc
 
 class Features_Set(metaclass=abc.ABCMeta):
@@ -13,4 +12,5 @@ class Features_Set(metaclass=abc.ABCMeta):
         d = dict(zip(self.__features_order__, self.feature_vec))
         d["variant_id"] = self.variant_id
         d["runoption_id"] = self.runoption_id
+        import pandas as pd
         return pd.Series(d)
\ No newline at end of file
@@ -0,0 +1,165 @@
+from .feature_codec import N_FEATURES, FEATURE_DTYPES, storage_values, pack_rows
+
+from typing import Dict, Iterable, Iterator, List, Tuple
+import numpy as np
+
+FEATURE_SITE_COLUMNS = ("seq_hash", "position", "runoption_id", "dtype", "site_mask", "features")
+FEATURE_SITE_VARIANT_COLUMNS = ("variant_id", "runoption_id", "dtype", "features")
+
+# The number of feature columns compared at a time when looking for site-level columns, bounding the memory used
+SITE_COLUMN_CHUNK = 128
+
+def site_columns(values : np.ndarray, positions : np.ndarray) -> np.ndarray:
+    """
+    The columns whose (stored) values are equal for all variants at each position, NaN being equal to NaN
+
+    Parameters
+    ----------
+    values : np.ndarray
+        (n_variants, n_features) matrix, as stored (see feature_codec.storage_values)
+
+    positions : np.ndarray
+        The position of each variant
+
+    Returns
+    -------
+    np.ndarray
+        A boolean mask of the site-level columns; none if no position has more than one variant
+    """
+    positions = np.asarray(positions)
+    order = np.argsort(positions, kind='stable')
+    sorted_positions = positions[order]
+    starts = np.flatnonzero(np.r_[True, sorted_positions[1:] != sorted_positions[:-1]])
+    mask = np.zeros(values.shape[1], dtype=bool)
+    if len(starts) == len(positions):
+        return mask
+    first_rows = order[np.repeat(starts, np.diff(np.r_[starts, len(positions)]))]
+    for start in range(0, values.shape[1], SITE_COLUMN_CHUNK):
+        chunk = values[order, start:start + SITE_COLUMN_CHUNK]
+        first = values[first_rows, start:start + SITE_COLUMN_CHUNK]
+        same = (chunk == first) | (np.isnan(chunk) & np.isnan(first))
+        mask[start:start + SITE_COLUMN_CHUNK] = same.all(axis=0)
+    return mask
+
+def pack_mask(mask : np.ndarray) -> bytes:
+    return np.packbits(mask).tobytes()
+
+def unpack_mask(site_mask : bytes) -> np.ndarray:
+    return np.unpackbits(np.frombuffer(site_mask, dtype=np.uint8), count=N_FEATURES).astype(bool)
+
+class FeatureSiteBlock:
+    row_chunk_size = 4096
+
+    def __init__(self, seq_hash : str, positions : np.ndarray, runoption_id : int, mask : np.ndarray, values : np.ndarray,
+                    dtype : str="float32"):
+        """
+        The site-level feature columns of a protein, one packed blob per position for the FeatureSite table
+
+        Parameters
+        ----------
+        positions : np.ndarray
+            The positions, one per row of values
+
+        mask : np.ndarray
+            The boolean mask of the site-level columns among the N_FEATURES columns, stored with every site
+
+        values : np.ndarray
+            (n_positions, mask.sum()) matrix of the site-level columns
+        """
+        self.seq_hash = seq_hash
+        self.positions = np.asarray(positions)
+        self.runoption_id = runoption_id
+        self.mask = mask
+        self.values = values
+        self.dtype = dtype
+
+    def __len__(self) -> int:
+        return len(self.positions)
+
+    @property
+    def columns(self) -> tuple:
+        return FEATURE_SITE_COLUMNS
+
+    def rows(self) -> Iterator[tuple]:
+        site_mask = pack_mask(self.mask)
+        for start in range(0, len(self), self.row_chunk_size):
+            stop = start + self.row_chunk_size
+            for position, blob in zip(self.positions[start:stop].tolist(), pack_rows(self.values[start:stop], self.dtype)):
+                yield (self.seq_hash, position, self.runoption_id, self.dtype, site_mask, blob)
+
+    def to_arrays(self) -> Dict[str,np.ndarray]:
+        return dict(seq_hash=np.full(len(self), self.seq_hash, dtype=object),
+                    position=self.positions,
+                    runoption_id=np.full(len(self), self.runoption_id),
+                    dtype=np.full(len(self), self.dtype, dtype=object),
+                    site_mask=np.full(len(self), pack_mask(self.mask), dtype=object),
+                    features=np.array(pack_rows(self.values, self.dtype), dtype=object))
+
+class FeatureSiteVariantBlock:
+    row_chunk_size = 4096
+
+    def __init__(self, variant_ids : Iterable[str], runoption_id : int, values : np.ndarray, dtype : str="float32"):
+        """
+        The substitution-specific feature columns of variants (those outside the mask of their FeatureSiteBlock),
+        one packed blob per variant for the FeatureSiteVariant table
+        """
+        self.variant_ids = np.asarray(variant_ids)
+        self.runoption_id = runoption_id
+        self.values = values
+        self.dtype = dtype
+
+    def __len__(self) -> int:
+        return len(self.variant_ids)
+
+    @property
+    def columns(self) -> tuple:
+        return FEATURE_SITE_VARIANT_COLUMNS
+
+    def rows(self) -> Iterator[tuple]:
+        for start in range(0, len(self), self.row_chunk_size):
+            stop = start + self.row_chunk_size
+            for variant_id, blob in zip(self.variant_ids[start:stop].tolist(), pack_rows(self.values[start:stop], self.dtype)):
+                yield (variant_id, self.runoption_id, self.dtype, blob)
+
+    def to_arrays(self) -> Dict[str,np.ndarray]:
+        return dict(variant_id=self.variant_ids,
+                    runoption_id=np.full(len(self), self.runoption_id),
+                    dtype=np.full(len(self), self.dtype, dtype=object),
+                    features=np.array(pack_rows(self.values, self.dtype), dtype=object))
+
+def split_site_features(seq_hash : str, variant_ids : Iterable[str], positions : np.ndarray, runoption_id : int, feats : np.ndarray,
+                        dtype : str="float32") -> Tuple[FeatureSiteBlock,FeatureSiteVariantBlock]:
+    """
+    Split the feature vectors of a job into the columns that only depend on the position, stored once per site,
+    and the substitution-specific columns stored per variant
+
+    A column is site-level if its stored values are equal among the variants of every position of the job (see
+    site_columns). For full saturation jobs (19 variants per position) most columns are, which divides their
+    storage by 19. The job must hold every variant of the protein stored for its run option, as the site rows
+    are shared by all of them: writing a job whose mask differs from the stored one is refused
+    (see sql_connection.check_site_mask)
+    """
+    values = storage_values(feats, dtype)
+    positions = np.asarray(positions)
+    mask = site_columns(values, positions)
+    sites, first = np.unique(positions, return_index=True)
+    return (FeatureSiteBlock(seq_hash, sites, runoption_id, mask, values[first][:, mask], dtype),
+            FeatureSiteVariantBlock(variant_ids, runoption_id, values[:, ~mask], dtype))
+
+def assemble_site_features(site_masks : List[bytes], site_dtypes : List[str], site_blobs : List[bytes],
+                            variant_dtypes : List[str], variant_blobs : List[bytes]) -> np.ndarray:
+    """
+    Reassemble the full (n_variants, N_FEATURES) float32 feature vectors of variants from their FeatureSite
+    (site_mask, dtype, features) and FeatureSiteVariant (dtype, features) values, one of each per variant
+    """
+    values = np.empty((len(variant_blobs), N_FEATURES), dtype=np.float32)
+    groups = {}
+    for i, key in enumerate(zip(map(bytes, site_masks), site_dtypes, variant_dtypes)):
+        groups.setdefault(key, []).append(i)
+    for (site_mask, site_dtype, variant_dtype), rows in groups.items():
+        mask = unpack_mask(site_mask)
+        values[np.ix_(rows, np.flatnonzero(mask))] = np.frombuffer(b"".join(bytes(site_blobs[i]) for i in rows),
+                                                                    dtype=FEATURE_DTYPES[site_dtype]).reshape(len(rows), mask.sum())
+        values[np.ix_(rows, np.flatnonzero(~mask))] = np.frombuffer(b"".join(bytes(variant_blobs[i]) for i in rows),
+                                                                    dtype=FEATURE_DTYPES[variant_dtype]).reshape(len(rows), (~mask).sum())
+    return values
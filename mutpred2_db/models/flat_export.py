@@ -0,0 +1,300 @@
+from .mechanism import Mechanism
+from .mechanism_block import NO_REGION_MASK, N_MECHANISMS, MechanismBlock
+from .variant_batch import VariantBatch
+
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Iterator, List, Tuple
+import numpy as np
+import pandas as pd
+import gzip
+import shutil
+import tempfile
+import time
+import os
+
+from tqdm import tqdm
+
+# The mechanisms of the classic MutPred2 output, in Mechanism.mechanism_order (Motifs has no column)
+FLAT_MECHANISMS = [(mechanism_id, name) for mechanism_id, name in enumerate(Mechanism.mechanism_order) if name != "Motifs"]
+FLAT_KEY_COLUMNS = ["seq_hash", "variant_id", "Substitution", "MutPred2_Score"]
+FLAT_COLUMNS = FLAT_KEY_COLUMNS + [f"{name}_{field}" for mechanism_id, name in FLAT_MECHANISMS
+                                    for field in (["posterior", "pvalue", "effect"] if NO_REGION_MASK[mechanism_id]
+                                                    else ["position", "posterior", "pvalue", "effect"])]
+
+EXPORT_VARIANT_COLUMNS = ("variant_id", "reference_aa", "position", "alternate_aa", "score")
+EXPORT_MECHANISM_COLUMNS = ("variant_id", "mechanism_id", "mechanism_type", "altered_position", "score", "pvalue")
+
+# The number of variants pivoted (and mechanism rows fetched) at a time, bounding the memory used per protein
+EXPORT_CHUNK_SIZE = 5000
+# The number of rows read per fetchmany call of the streaming cursor
+FETCH_SIZE = 10000
+
+# Scores and p-values are stored as DECIMAL(4,3): they are written through a table of the strings of the 1001 values
+# in [0, 1] rather than formatted one at a time (the last entry, for missing values, is empty)
+UNIT_DECIMALS = 3
+UNIT_STRINGS = np.array([f"{i / 10 ** UNIT_DECIMALS:.{UNIT_DECIMALS}f}" for i in range(10 ** UNIT_DECIMALS + 1)] + [""], dtype=object)
+
+# Connection of the current export process, opened on its first protein and reused for the following ones
+_export_state = {}
+
+def pivot_mechanisms(n_variants : int, variant_index : np.ndarray, mechanism_id : np.ndarray, mechanism_type : np.ndarray,
+                        altered_position : np.ndarray, score : np.ndarray, pvalue : np.ndarray) -> Dict[str,np.ndarray]:
+    """
+    Pivot long VariantMechanism rows into the per-mechanism columns of the classic MutPred2 output
+
+    Each row is scattered into (n_variants, N_MECHANISMS) matrices at once; cells of mechanisms without a row
+    (e.g. filtered out by p-value at ingest) are left empty
+
+    Parameters
+    ----------
+    n_variants : int
+        The number of output rows
+
+    variant_index : np.ndarray
+        The output row of each mechanism row
+
+    mechanism_id : np.ndarray
+        The index into Mechanism.mechanism_order of each row
+
+    mechanism_type : np.ndarray
+        gain, loss or altered
+
+    altered_position : np.ndarray
+        The altered position (NaN for mechanisms in Mechanism.no_region_set)
+
+    score, pvalue : np.ndarray
+        The posterior and p-value of each row
+
+    Returns
+    -------
+    Dict[str,np.ndarray]
+        The <mechanism>_position (for mechanisms outside Mechanism.no_region_set), _posterior, _pvalue and _effect
+        columns, in FLAT_COLUMNS order
+    """
+    cell = np.asarray(variant_index, dtype=np.int64) * N_MECHANISMS + np.asarray(mechanism_id, dtype=np.int64)
+    def scatter(values : np.ndarray, fill, dtype) -> np.ndarray:
+        matrix = np.full(n_variants * N_MECHANISMS, fill, dtype=dtype)
+        matrix[cell] = values
+        return matrix.reshape(n_variants, N_MECHANISMS)
+    posterior = scatter(np.asarray(score, dtype=float), np.nan, float)
+    pvalues = scatter(np.asarray(pvalue, dtype=float), np.nan, float)
+    position = scatter(np.asarray(altered_position, dtype=float), np.nan, float)
+    effect = scatter(np.asarray(mechanism_type, dtype=object), None, object)
+    columns = {}
+    for mechanism_id, name in FLAT_MECHANISMS:
+        if not NO_REGION_MASK[mechanism_id]:
+            columns[f"{name}_position"] = pd.array(position[:, mechanism_id], dtype="Int64")
+        columns[f"{name}_posterior"] = posterior[:, mechanism_id]
+        columns[f"{name}_pvalue"] = pvalues[:, mechanism_id]
+        columns[f"{name}_effect"] = effect[:, mechanism_id]
+    return columns
+
+def wide_frame(seq_hash : str, variants : Dict[str,np.ndarray], mechanisms : Dict[str,np.ndarray]) -> pd.DataFrame:
+    """
+    The variants of a protein in the classic MutPred2 layout (FLAT_COLUMNS), one row per variant
+
+    Parameters
+    ----------
+    variants : Dict[str,np.ndarray]
+        The EXPORT_VARIANT_COLUMNS arrays of the variants
+
+    mechanisms : Dict[str,np.ndarray]
+        The EXPORT_MECHANISM_COLUMNS arrays of their VariantMechanism rows, in any order
+        (rows of other variants and of Motifs are ignored)
+    """
+    variant_ids = np.asarray(variants['variant_id'], dtype=object)
+    variant_index = pd.Index(variant_ids).get_indexer(np.asarray(mechanisms['variant_id'], dtype=object))
+    mechanism_id = np.asarray(mechanisms['mechanism_id'], dtype=np.int64)
+    keep = (variant_index >= 0) & (mechanism_id != Mechanism.motif_index)
+    columns = pivot_mechanisms(len(variant_ids), variant_index[keep], mechanism_id[keep],
+                                np.asarray(mechanisms['mechanism_type'], dtype=object)[keep],
+                                np.asarray(mechanisms['altered_position'], dtype=float)[keep],
+                                np.asarray(mechanisms['score'], dtype=float)[keep],
+                                np.asarray(mechanisms['pvalue'], dtype=float)[keep])
+    substitution = (pd.Series(variants['reference_aa'], dtype=object) + pd.Series(variants['position']).astype(str)
+                    + pd.Series(variants['alternate_aa'], dtype=object))
+    return pd.DataFrame(dict(seq_hash=np.full(len(variant_ids), seq_hash, dtype=object),
+                                variant_id=variant_ids,
+                                Substitution=substitution.to_numpy(),
+                                MutPred2_Score=np.asarray(variants['score'], dtype=float),
+                                **columns), columns=FLAT_COLUMNS)
+
+def job_frames(variants : VariantBatch, mechanisms : MechanismBlock, chunk_size : int=EXPORT_CHUNK_SIZE) -> Iterator[pd.DataFrame]:
+    """
+    The wide frames of a parsed job (the variants and mechanisms of Processor.parse), chunk_size variants at a time
+    """
+    mechanism_arrays = dict(variant_id=mechanisms.variant_ids[mechanisms.variant_index],
+                            mechanism_id=mechanisms.mechanism_id,
+                            mechanism_type=mechanisms.mechanism_type,
+                            altered_position=np.where(mechanisms.has_position, mechanisms.altered_position, np.nan),
+                            score=mechanisms.score,
+                            pvalue=mechanisms.pvalue)
+    order = np.argsort(mechanisms.variant_index, kind='stable')
+    bounds = np.searchsorted(mechanisms.variant_index[order], np.arange(0, len(variants) + chunk_size, chunk_size))
+    for number, start in enumerate(range(0, len(variants), chunk_size)):
+        rows = order[bounds[number]:bounds[number + 1]]
+        chunk = variants[start:start + chunk_size].to_arrays()
+        yield wide_frame(variants.seq_hash, chunk, {column : values[rows] for column, values in mechanism_arrays.items()})
+
+def fetch_rows(cursor, fetch_size : int=FETCH_SIZE) -> Iterator[List[tuple]]:
+    """
+    The rows of the last query, fetch_size at a time
+
+    The cursors of SQL_Connection are unbuffered, so rows are streamed from the server as they are fetched
+    rather than held in memory all at once (they must all be fetched before the next query)
+    """
+    while True:
+        rows = cursor.fetchmany(fetch_size)
+        if len(rows) == 0:
+            return
+        yield rows
+
+def fetch_arrays(cursor, columns : Tuple[str,...], fetch_size : int=FETCH_SIZE) -> Dict[str,np.ndarray]:
+    values = np.empty((0, len(columns)), dtype=object)
+    chunks = [np.array(rows, dtype=object).reshape(len(rows), len(columns)) for rows in fetch_rows(cursor, fetch_size)]
+    if len(chunks) > 0:
+        values = np.concatenate(chunks)
+    return {column : values[:, i] for i, column in enumerate(columns)}
+
+def protein_frames(cursor, seq_hash : str, option_id : int, chunk_size : int=EXPORT_CHUNK_SIZE, max_pvalue : float|None=None,
+                    fetch_size : int=FETCH_SIZE) -> Iterator[pd.DataFrame]:
+    """
+    The wide frames of a stored protein, chunk_size variants (ordered by position) at a time
+
+    The variants of the protein are read once (through variant_position_idx); the VariantMechanism rows are
+    then read for chunk_size variants at a time, so at most chunk_size * N_MECHANISMS mechanism rows are held
+    """
+    cursor.execute(f"SELECT {', '.join(EXPORT_VARIANT_COLUMNS)} FROM Variant WHERE seq_hash = %s AND option_id = %s "
+                    "ORDER BY position, alternate_aa", (seq_hash, option_id))
+    variants = fetch_arrays(cursor, EXPORT_VARIANT_COLUMNS, fetch_size)
+    condition, params = ("", ()) if max_pvalue is None else ("pvalue <= %s AND ", (max_pvalue,))
+    for start in range(0, len(variants['variant_id']), chunk_size):
+        chunk = {column : values[start:start + chunk_size] for column, values in variants.items()}
+        cursor.execute(f"SELECT {', '.join(EXPORT_MECHANISM_COLUMNS)} FROM VariantMechanism "
+                        f"WHERE {condition}variant_id IN ({', '.join(['%s'] * len(chunk['variant_id']))})",
+                        (*params, *chunk['variant_id'].tolist()))
+        mechanisms = fetch_arrays(cursor, EXPORT_MECHANISM_COLUMNS, fetch_size)
+        mechanisms['altered_position'] = np.array([np.nan if position is None else position for position in mechanisms['altered_position']],
+                                                    dtype=float)
+        yield wide_frame(seq_hash, chunk, mechanisms)
+
+def format_unit_interval(values : np.ndarray) -> np.ndarray:
+    """
+    The strings of values rounded to UNIT_DECIMALS, looked up in UNIT_STRINGS (values outside [0, 1] are formatted)
+    """
+    scaled = np.rint(np.asarray(values, dtype=float) * 10 ** UNIT_DECIMALS)
+    in_range = (scaled >= 0) & (scaled <= 10 ** UNIT_DECIMALS)
+    index = np.where(in_range, scaled, len(UNIT_STRINGS) - 1).astype(np.int64)
+    strings = UNIT_STRINGS[index]
+    outside = ~in_range & np.isfinite(scaled)
+    strings[outside] = [f"{value:.{UNIT_DECIMALS}f}" for value in np.asarray(values, dtype=float)[outside]]
+    return strings
+
+def format_frame(frame : pd.DataFrame) -> pd.DataFrame:
+    """
+    The frame with its float columns (scores, posteriors and p-values) formatted with format_unit_interval
+    """
+    return frame.assign(**{column : format_unit_interval(frame[column].to_numpy()) for column in frame.columns
+                            if frame[column].dtype == float})
+
+def open_part(path : Path, compress : bool):
+    return gzip.open(path, 'wt', newline='', compresslevel=6) if compress else open(path, 'w', newline='')
+
+def write_frames(frames : Iterable[pd.DataFrame], path : Path, sep : str, compress : bool) -> int:
+    """
+    Write frames (without header) to a part file, a single gzip member if compress; returns the number of rows
+    """
+    n_rows = 0
+    with open_part(path, compress) as part:
+        for frame in frames:
+            format_frame(frame).to_csv(part, sep=sep, header=False, index=False)
+            n_rows += len(frame)
+    return n_rows
+
+def _export_cursor(sql_config_name : str, sql_config_file : str):
+    if "connection" not in _export_state:
+        from .sql_connection import SQL_Connection
+        sql_connection = SQL_Connection(sql_config_name, sql_config_file, pool_name="flat_export", pool_size=1)
+        _export_state["connection"] = sql_connection.open()
+    return _export_state["connection"][0]
+
+def export_protein(seq_hash : str, path : Path, sql_config_name : str, sql_config_file : str, option_id : int, sep : str, compress : bool,
+                    chunk_size : int=EXPORT_CHUNK_SIZE, max_mechanism_pvalue : float|None=None, fetch_size : int=FETCH_SIZE) -> Tuple[Path,int]:
+    """
+    Write a stored protein to a part file with the connection of the current process
+    """
+    cursor = _export_cursor(sql_config_name, sql_config_file)
+    return path, write_frames(protein_frames(cursor, seq_hash, option_id, chunk_size, max_mechanism_pvalue, fetch_size), path, sep, compress)
+
+def export_job(job_dir : str, path : Path, sep : str, compress : bool, chunk_size : int=EXPORT_CHUNK_SIZE, **run_option_kwargs) -> Tuple[Path,int]:
+    """
+    Write a MutPred2 job to a part file straight from its output arrays, without a database
+    (only the sequence, substitutions, scores and mechanism arrays of the job are read)
+    """
+    from .job_processor import Processor
+    processor = Processor(None, None)
+    option_id = processor.run_option_id(**run_option_kwargs)
+    variants = processor.make_variants(job_dir, processor.make_sequence(job_dir), option_id)
+    mechanisms = processor.make_mechanisms(job_dir, variants, max_pvalue=run_option_kwargs.get('max_mechanism_pvalue'))
+    return path, write_frames(job_frames(variants, mechanisms, chunk_size), path, sep, compress)
+
+def header_bytes(sep : str, compress : bool) -> bytes:
+    header = (sep.join(FLAT_COLUMNS) + "\n").encode('utf-8')
+    return gzip.compress(header) if compress else header
+
+def export_parts(tasks : List, export : Callable, output_file : str, sep : str="\t", workers : int=1, desc : str="Exporting",
+                    **export_kwargs) -> Dict[str,float]:
+    """
+    Export tasks (proteins or jobs) in parallel into one flat file, in task order
+
+    Each worker writes a task to its own part file (a complete gzip member when compressing) next to output_file;
+    the parts are appended to the output as they complete, in order, and deleted, so neither the workers nor the
+    parent hold more than a chunk of rows. Concatenated gzip members are a valid gzip file. The output is written
+    to a temporary name and renamed once complete, so a failed export leaves no partial output_file
+
+    Parameters
+    ----------
+    tasks : List
+        The first argument of export for each part
+
+    export : Callable
+        export_protein or export_job, returning (part path, number of rows)
+
+    output_file : str
+        The output, gzip compressed if it ends with .gz
+
+    Returns
+    -------
+    Dict[str,float]
+        The number of rows and parts written, the time taken in seconds and the rows per second
+    """
+    from joblib import Parallel, delayed
+    compress = str(output_file).endswith(".gz")
+    output_file = Path(output_file)
+    parts_dir = Path(tempfile.mkdtemp(prefix=".flat_export_", dir=output_file.parent))
+    tmp_file = output_file.parent / f".{output_file.name}.{os.getpid()}.tmp"
+    n_rows = 0
+    start = time.time()
+    try:
+        with open(tmp_file, 'wb') as output, tqdm(total=len(tasks), desc=desc, unit="parts", leave=False) as progress:
+            output.write(header_bytes(sep, compress))
+            results = Parallel(n_jobs=workers, return_as="generator")(delayed(export)(task, parts_dir / f"{number:08d}.part", sep=sep,
+                                                                                        compress=compress, **export_kwargs)
+                                                                        for number, task in enumerate(tasks))
+            for path, part_rows in results:
+                with open(path, 'rb') as part:
+                    shutil.copyfileobj(part, output)
+                path.unlink()
+                n_rows += part_rows
+                progress.update(1)
+                progress.set_postfix(rows=n_rows)
+        os.replace(tmp_file, output_file)
+    finally:
+        shutil.rmtree(parts_dir, ignore_errors=True)
+        tmp_file.unlink(missing_ok=True)
+    seconds = time.time() - start
+    return dict(rows=n_rows, parts=len(tasks), seconds=seconds, rows_per_second=n_rows / max(seconds, 1e-9))
+
+def stored_proteins(cursor, option_id : int, fetch_size : int=FETCH_SIZE) -> List[str]:
+    cursor.execute("SELECT DISTINCT seq_hash FROM Variant WHERE option_id = %s ORDER BY seq_hash", (option_id,))
+    return [row[0] for rows in fetch_rows(cursor, fetch_size) for row in rows]
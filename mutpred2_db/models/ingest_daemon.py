@@ -0,0 +1,227 @@
+from pathlib import Path
+from typing import Dict, Iterable, Iterator
+import json
+import os
+import socket
+import socketserver
+import threading
+import time
+
+SPOOL_DIRS = ("inbox", "running", "status")
+
+def write_json(path : Path, record : Dict) -> None:
+    """
+    Write a JSON file atomically (readers never see a partial file)
+    """
+    tmp_file = path.with_name(f".{path.name}.tmp")
+    tmp_file.write_text(json.dumps(record))
+    os.replace(tmp_file, path)
+
+class IngestDaemon:
+    def __init__(self, sql_config_name : str|None, sql_config_file : str|None, spool_dir : str|None=None,
+                    socket_path : str|None=None, poll_seconds : float=1.0, **job_kwargs):
+        """
+        A long-lived ingest worker: the ingest modules are imported, the connection opened and the Mechanism table
+        initialized once (see start), then job directories are processed one at a time with job_runner.process_job,
+        reusing the warm connection, as they arrive
+
+        Jobs arrive in a spool directory or over a local socket (or both):
+            spool_dir: a file <name>.job holding a job directory, moved into <spool_dir>/inbox (see spool_job), is
+            claimed into running/ and its status written to status/<name>.json. Jobs left in running/ by a daemon
+            that died are returned to the inbox on start
+            socket_path: a unix socket taking one request per line, a job directory or a JSON object
+            ({"job" : <dir>}, {"command" : "stats"} or {"command" : "shutdown"}), answered with one JSON line (see submit)
+
+        Parameters
+        ----------
+        sql_config_name, sql_config_file : str|None
+            The entry of the yaml config file holding the database credentials (unused with parquet_dir)
+
+        spool_dir : str|None
+            The spool directory, holding the inbox, running and status directories
+
+        socket_path : str|None
+            The path of the unix socket
+
+        poll_seconds : float
+            The interval between scans of the inbox
+
+        job_kwargs
+            The arguments of job_runner.process_job (staging_dir, parquet_dir, run options, ...)
+        """
+        if spool_dir is None and socket_path is None:
+            raise ValueError("Either spool_dir or socket_path must be provided")
+        self.spool_dir = None if spool_dir is None else Path(spool_dir)
+        self.socket_path = socket_path
+        self.poll_seconds = poll_seconds
+        self.job_kwargs = dict(sql_config_name=sql_config_name, sql_config_file=sql_config_file, **job_kwargs)
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.server = None
+        self.startup_seconds = None
+        self.started_at = None
+        self.counts = dict(done=0, failed=0)
+        self.job_seconds = 0.0
+
+    def start(self) -> float:
+        """
+        Import the ingest modules and open the warm connection; returns the startup time in seconds
+        """
+        start = time.perf_counter()
+        from .job_runner import _worker_resources, uses_database
+        from .sql_connection import initialize_mechanisms
+        job_kwargs = self.job_kwargs
+        cursor, cnx, _ = _worker_resources(job_kwargs['sql_config_name'], job_kwargs['sql_config_file'],
+                                            job_kwargs.get('staging_dir'), job_kwargs.get('load_data', "job"), 1,
+                                            job_kwargs.get('parquet_dir'), table_writers=job_kwargs.get('table_writers', 1))
+        if uses_database(job_kwargs.get('staging_dir'), job_kwargs.get('load_data', "job"), job_kwargs.get('parquet_dir')):
+            initialize_mechanisms(cursor, cnx)
+        if self.spool_dir is not None:
+            for name in SPOOL_DIRS:
+                (self.spool_dir / name).mkdir(parents=True, exist_ok=True)
+            for path in (self.spool_dir / "running").glob("*.job"):
+                os.rename(path, self.spool_dir / "inbox" / path.name)
+        self.startup_seconds = time.perf_counter() - start
+        self.started_at = time.time()
+        return self.startup_seconds
+
+    def run_job(self, job_dir : str) -> Dict:
+        """
+        Process a job on the warm connection (one job at a time), returning its status:
+        the job, "done" or "failed", the error, the row counts, the processing time and the peak RSS in MB
+        """
+        from .job_runner import process_job, ping_worker_connection
+        with self.lock:
+            error = None
+            try:
+                ping_worker_connection()
+                _, error, stats = process_job(job_dir, **self.job_kwargs)
+            except Exception as e:
+                error, stats = repr(e), dict(rows={}, seconds=0.0, peak_rss_mb=None)
+            status = "done" if error is None else "failed"
+            self.counts[status] += 1
+            self.job_seconds += stats['seconds']
+        return dict(job=job_dir, status=status, error=error, rows=stats['rows'], seconds=stats['seconds'],
+                    peak_rss_mb=stats['peak_rss_mb'], finished_at=time.time())
+
+    def stats(self) -> Dict:
+        jobs = sum(self.counts.values())
+        return dict(startup_seconds=self.startup_seconds,
+                    uptime_seconds=time.time() - self.started_at,
+                    jobs=jobs,
+                    **self.counts,
+                    mean_job_seconds=self.job_seconds / jobs if jobs > 0 else 0.0)
+
+    def poll_spool(self) -> int:
+        """
+        Process the jobs in the inbox, oldest first, writing their status; returns the number processed
+        """
+        processed = 0
+        inbox = sorted((self.spool_dir / "inbox").glob("*.job"), key=lambda path: (path.stat().st_mtime, path.name))
+        for path in inbox:
+            if self.stopped.is_set():
+                break
+            running_file = self.spool_dir / "running" / path.name
+            try:
+                os.rename(path, running_file)
+            except FileNotFoundError:
+                continue
+            status = self.run_job(running_file.read_text().strip())
+            write_json(self.spool_dir / "status" / f"{path.stem}.json", status)
+            os.remove(running_file)
+            processed += 1
+        return processed
+
+    def handle_request(self, line : str) -> Dict:
+        request = json.loads(line) if line.startswith("{") else dict(job=line)
+        if request.get("command") == "stats":
+            return self.stats()
+        if request.get("command") == "shutdown":
+            self.stop()
+            return dict(status="stopping")
+        if "job" not in request:
+            return dict(error=f"Unknown request {line}")
+        return self.run_job(request["job"])
+
+    def serve_socket(self) -> None:
+        daemon = self
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                for line in self.rfile:
+                    line = line.decode('utf-8').strip()
+                    if not line:
+                        continue
+                    try:
+                        response = daemon.handle_request(line)
+                    except ValueError as e:
+                        response = dict(error=str(e))
+                    self.wfile.write((json.dumps(response) + "\n").encode('utf-8'))
+                    self.wfile.flush()
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+        self.server = socketserver.ThreadingUnixStreamServer(self.socket_path, Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def serve(self) -> None:
+        """
+        Start, then process jobs from the spool directory and the socket until stop (or a shutdown request)
+        """
+        print(f"Ingest daemon started in {self.start():.2f}s")
+        if self.socket_path is not None:
+            self.serve_socket()
+            print(f"Listening on {self.socket_path}")
+        if self.spool_dir is not None:
+            print(f"Watching {self.spool_dir / 'inbox'}")
+        try:
+            while not self.stopped.is_set():
+                if self.spool_dir is None or self.poll_spool() == 0:
+                    self.stopped.wait(self.poll_seconds)
+        finally:
+            self.close()
+
+    def stop(self) -> None:
+        self.stopped.set()
+
+    def close(self) -> None:
+        from .job_runner import release_worker_resources
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            os.remove(self.socket_path)
+            self.server = None
+        with self.lock:
+            release_worker_resources()
+
+def spool_job(spool_dir : str|Path, job_dir : str, name : str|None=None) -> Path:
+    """
+    Add a job to the inbox of a daemon's spool directory; returns the path its status will be written to
+    """
+    spool_dir = Path(spool_dir)
+    name = name or f"{time.time_ns()}_{os.getpid()}"
+    tmp_file = spool_dir / f".{name}.job.tmp"
+    tmp_file.write_text(str(job_dir))
+    os.rename(tmp_file, spool_dir / "inbox" / f"{name}.job")
+    return spool_dir / "status" / f"{name}.json"
+
+def wait_for_status(status_path : str|Path, timeout : float|None=None, poll_seconds : float=0.5) -> Dict|None:
+    """
+    The status of a spooled job once written (None after timeout seconds)
+    """
+    deadline = None if timeout is None else time.monotonic() + timeout
+    while not Path(status_path).exists():
+        if deadline is not None and time.monotonic() > deadline:
+            return None
+        time.sleep(poll_seconds)
+    return json.loads(Path(status_path).read_text())
+
+def submit(socket_path : str, requests : Iterable[str|Dict]) -> Iterator[Dict]:
+    """
+    Send job directories (or request objects) to a daemon's socket over one connection, yielding each response
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.connect(socket_path)
+        reader = client.makefile('r', encoding='utf-8')
+        for request in requests:
+            client.sendall(((json.dumps(request) if isinstance(request, dict) else str(request)) + "\n").encode('utf-8'))
+            yield json.loads(reader.readline())
@@ -0,0 +1,293 @@
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterator, List, Tuple
+import heapq
+import json
+import os
+import re
+import threading
+import time
+
+# Upper bounds in seconds of the database round-trip latency histogram buckets (Prometheus `le` labels)
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, float("inf"))
+
+INSERT_TABLE = re.compile(r"^\s*INSERT\s+(?:IGNORE\s+)?INTO\s+(\w+)", re.IGNORECASE)
+
+class LatencyHistogram:
+    def __init__(self, counts : List[int]|None=None, total : float=0.0):
+        """
+        The number of observations in each LATENCY_BUCKETS bucket (not cumulative) and their sum in seconds
+        """
+        self.counts = list(counts) if counts is not None else [0] * len(LATENCY_BUCKETS)
+        self.total = total
+
+    def observe(self, seconds : float) -> None:
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if seconds <= bound:
+                self.counts[i] += 1
+                break
+        self.total += seconds
+
+    def merge(self, other : "LatencyHistogram") -> None:
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.total += other.total
+
+    def count(self) -> int:
+        return sum(self.counts)
+
+    def quantile(self, q : float) -> float:
+        """
+        The upper bound of the bucket holding the q-quantile
+        """
+        rank = q * self.count()
+        seen = 0
+        for bound, count in zip(LATENCY_BUCKETS, self.counts):
+            seen += count
+            if seen >= rank and count > 0:
+                return bound
+        return 0.0
+
+class JobMetrics:
+    def __init__(self, job_dir : str):
+        """
+        The timings of one job: the seconds of each named stage (scan, read.<variable>, construct.<object>),
+        the rows, approximate bytes, statements and seconds written to each table, the commits,
+        and the latency histogram of its database round-trips
+        """
+        self.job_dir = job_dir
+        self.stages : Dict[str,float] = {}
+        self.tables : Dict[str,Dict[str,float]] = {}
+        self.commits = 0
+        self.commit_seconds = 0.0
+        self.latency = LatencyHistogram()
+        self.seconds = 0.0
+        self.error = None
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name : str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + time.perf_counter() - start
+
+    def add_table(self, table : str, **counts) -> None:
+        entry = self.tables.setdefault(table, dict(rows=0, bytes=0, statements=0, seconds=0.0))
+        for k, count in counts.items():
+            entry[k] += count
+
+    def observe_statement(self, table : str|None, seconds : float, n_bytes : int) -> None:
+        with self._lock:
+            self.latency.observe(seconds)
+            if table is not None:
+                self.add_table(table, bytes=n_bytes, statements=1)
+
+    def observe_commit(self, seconds : float) -> None:
+        with self._lock:
+            self.commits += 1
+            self.commit_seconds += seconds
+            self.latency.observe(seconds)
+
+    def to_dict(self) -> Dict:
+        """
+        The metrics as a JSON-serializable dict, with the read, construct (excluding reads), write and commit totals
+        """
+        read = sum(seconds for name, seconds in self.stages.items() if name.startswith("read."))
+        construct = sum(seconds for name, seconds in self.stages.items() if name.startswith("construct."))
+        return dict(job_dir=self.job_dir,
+                    seconds=self.seconds,
+                    error=self.error,
+                    scan_seconds=self.stages.get("scan", 0.0),
+                    read_seconds=read,
+                    construct_seconds=max(construct - read, 0.0),
+                    write_seconds=sum(entry['seconds'] for entry in self.tables.values()),
+                    commit_seconds=self.commit_seconds,
+                    commits=self.commits,
+                    stages=self.stages,
+                    tables=self.tables,
+                    latency=dict(buckets=list(LATENCY_BUCKETS[:-1]) + ["+Inf"], counts=self.latency.counts, sum=self.latency.total))
+
+    @staticmethod
+    def from_dict(record : Dict) -> "JobMetrics":
+        metrics = JobMetrics(record['job_dir'])
+        metrics.seconds = record['seconds']
+        metrics.error = record['error']
+        metrics.stages = dict(record['stages'])
+        metrics.tables = {table : dict(entry) for table, entry in record['tables'].items()}
+        metrics.commits = record['commits']
+        metrics.commit_seconds = record['commit_seconds']
+        metrics.latency = LatencyHistogram(record['latency']['counts'], record['latency']['sum'])
+        return metrics
+
+def statement_bytes(query : str, params) -> int:
+    """
+    An estimate of the size of a statement sent to the server: the query and its str/bytes parameters, 8 bytes per other value
+    """
+    if params is None:
+        return len(query)
+    return len(query) + sum(len(value) if isinstance(value, (str, bytes)) else 8 for value in params)
+
+class InstrumentedCursor:
+    def __init__(self, cursor, metrics : JobMetrics|None):
+        """
+        A cursor recording the latency of every execute, and the statements and bytes of INSERTs per table, into metrics
+        (which may be replaced between jobs); other attributes are those of cursor
+        """
+        self.cursor = cursor
+        self.metrics = metrics
+
+    def execute(self, query : str, params=None, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return self.cursor.execute(query, params, *args, **kwargs)
+        finally:
+            if self.metrics is not None:
+                table = INSERT_TABLE.match(query)
+                self.metrics.observe_statement(table.group(1) if table else None, time.perf_counter() - start,
+                                                statement_bytes(query, params) if table else 0)
+
+    def executemany(self, query : str, seq_params, *args, **kwargs):
+        seq_params = list(seq_params)
+        start = time.perf_counter()
+        try:
+            return self.cursor.executemany(query, seq_params, *args, **kwargs)
+        finally:
+            if self.metrics is not None:
+                table = INSERT_TABLE.match(query)
+                self.metrics.observe_statement(table.group(1) if table else None, time.perf_counter() - start,
+                                                sum(statement_bytes(query, params) for params in seq_params) if table else 0)
+
+    def __getattr__(self, name : str):
+        return getattr(self.cursor, name)
+
+class InstrumentedConnection:
+    def __init__(self, cnx, metrics : JobMetrics|None):
+        """
+        A connection recording the number and latency of its commits into metrics; other attributes are those of cnx
+        """
+        self.cnx = cnx
+        self.metrics = metrics
+
+    def commit(self) -> None:
+        start = time.perf_counter()
+        try:
+            self.cnx.commit()
+        finally:
+            if self.metrics is not None:
+                self.metrics.observe_commit(time.perf_counter() - start)
+
+    def __getattr__(self, name : str):
+        return getattr(self.cnx, name)
+
+def prometheus_labels(**labels) -> str:
+    escaped = {k : str(v).replace("\\", "\\\\").replace('"', '\\"') for k, v in labels.items()}
+    return "{" + ",".join(f'{k}="{v}"' for k, v in escaped.items()) + "}"
+
+class Instrumentation:
+    def __init__(self, log_file : str|Path|None=None, prometheus_file : str|Path|None=None, slowest : int=10):
+        """
+        Collect the JobMetrics records of a run: each record is appended to a JSON-lines log as it arrives, and the
+        totals (jobs, stage seconds, table rows/bytes/statements/seconds, commits, round-trip latency histogram)
+        are written to a Prometheus text-format file. The slowest jobs are kept for summary()
+
+        Parameters
+        ----------
+        log_file : str|Path|None
+            The JSON-lines log, appended to
+
+        prometheus_file : str|Path|None
+            The Prometheus text-format file, rewritten atomically by write_prometheus (e.g. for the node_exporter textfile collector)
+
+        slowest : int
+            The number of slowest jobs reported by summary
+        """
+        self.log = open(log_file, 'a') if log_file is not None else None
+        self.prometheus_file = prometheus_file
+        self.slowest = slowest
+        self.jobs = dict(done=0, failed=0)
+        self.seconds = 0.0
+        self.stages : Dict[str,float] = {}
+        self.tables : Dict[str,Dict[str,float]] = {}
+        self.commits = 0
+        self.latency = LatencyHistogram()
+        self.slowest_jobs : List[Tuple[float,str,Dict]] = []
+
+    def record(self, record : Dict) -> None:
+        """
+        Add the JobMetrics.to_dict record of a job
+        """
+        if self.log is not None:
+            self.log.write(json.dumps(dict(record, time=time.time())) + "\n")
+            self.log.flush()
+        self.jobs['done' if record['error'] is None else 'failed'] += 1
+        self.seconds += record['seconds']
+        for name, seconds in record['stages'].items():
+            self.stages[name] = self.stages.get(name, 0.0) + seconds
+        for table, counts in record['tables'].items():
+            entry = self.tables.setdefault(table, dict(rows=0, bytes=0, statements=0, seconds=0.0))
+            for k, count in counts.items():
+                entry[k] += count
+        self.commits += record['commits']
+        self.latency.merge(LatencyHistogram(record['latency']['counts'], record['latency']['sum']))
+        summary = {k : record[k] for k in ['scan_seconds', 'read_seconds', 'construct_seconds', 'write_seconds', 'commit_seconds']}
+        entry = (record['seconds'], record['job_dir'], summary)
+        if len(self.slowest_jobs) < self.slowest:
+            heapq.heappush(self.slowest_jobs, entry)
+        elif self.slowest > 0:
+            heapq.heappushpop(self.slowest_jobs, entry)
+
+    def prometheus(self) -> str:
+        lines = ["# HELP mutpred2_ingest_jobs_total Jobs processed, by status",
+                    "# TYPE mutpred2_ingest_jobs_total counter"]
+        lines += [f"mutpred2_ingest_jobs_total{prometheus_labels(status=status)} {count}" for status, count in self.jobs.items()]
+        lines += ["# HELP mutpred2_ingest_job_seconds_total Wall time of the processed jobs",
+                    "# TYPE mutpred2_ingest_job_seconds_total counter",
+                    f"mutpred2_ingest_job_seconds_total {self.seconds}",
+                    "# HELP mutpred2_ingest_stage_seconds_total Time spent in each stage (read stages are included in construct stages)",
+                    "# TYPE mutpred2_ingest_stage_seconds_total counter"]
+        lines += [f"mutpred2_ingest_stage_seconds_total{prometheus_labels(stage=name)} {seconds}" for name, seconds in sorted(self.stages.items())]
+        for field, help_text in [("rows", "Rows written"), ("bytes", "Approximate bytes sent by INSERT statements"),
+                                    ("statements", "INSERT statements executed"), ("seconds", "Time spent writing")]:
+            name = f"mutpred2_ingest_table_{field}_total"
+            lines += [f"# HELP {name} {help_text}, by table", f"# TYPE {name} counter"]
+            lines += [f"{name}{prometheus_labels(table=table)} {entry[field]}" for table, entry in sorted(self.tables.items())]
+        lines += ["# HELP mutpred2_ingest_commits_total Commits",
+                    "# TYPE mutpred2_ingest_commits_total counter",
+                    f"mutpred2_ingest_commits_total {self.commits}",
+                    "# HELP mutpred2_ingest_db_roundtrip_seconds Latency of database statements and commits",
+                    "# TYPE mutpred2_ingest_db_roundtrip_seconds histogram"]
+        cumulative = 0
+        for bound, count in zip(LATENCY_BUCKETS, self.latency.counts):
+            cumulative += count
+            le = "+Inf" if bound == float("inf") else repr(bound)
+            lines.append(f"mutpred2_ingest_db_roundtrip_seconds_bucket{prometheus_labels(le=le)} {cumulative}")
+        lines += [f"mutpred2_ingest_db_roundtrip_seconds_sum {self.latency.total}",
+                    f"mutpred2_ingest_db_roundtrip_seconds_count {self.latency.count()}"]
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self) -> None:
+        if self.prometheus_file is None:
+            return
+        tmp_file = f"{self.prometheus_file}.tmp"
+        with open(tmp_file, 'w') as file:
+            file.write(self.prometheus())
+        os.replace(tmp_file, self.prometheus_file)
+
+    def summary(self) -> str:
+        """
+        The slowest jobs with their scan, read, construct, write and commit seconds, and the round-trip latency quantiles
+        """
+        lines = [f"Slowest {len(self.slowest_jobs)} jobs (seconds: total scan read construct write commit):"]
+        for seconds, job_dir, stages in sorted(self.slowest_jobs, reverse=True):
+            lines.append(f"  {seconds:8.2f} {stages['scan_seconds']:7.2f} {stages['read_seconds']:7.2f} {stages['construct_seconds']:7.2f} "
+                            f"{stages['write_seconds']:7.2f} {stages['commit_seconds']:7.2f}  {job_dir}")
+        if self.latency.count() > 0:
+            lines.append(f"DB round-trips: {self.latency.count()}, p50 <= {self.latency.quantile(0.5) * 1000:g} ms, "
+                            f"p99 <= {self.latency.quantile(0.99) * 1000:g} ms")
+        return "\n".join(lines)
+
+    def close(self) -> None:
+        self.write_prometheus()
+        if self.log is not None:
+            self.log.close()
@@ -0,0 +1,140 @@
+from typing import Callable, Dict
+from pathlib import Path
+import io
+import os
+import struct
+import time
+
+import lmdb
+import numpy as np
+
+# Environments opened by this process, LMDB environments must only be opened once per process
+_open_caches = {}
+
+def open_job_cache(cache_dir : str|Path, max_bytes : int|None=None) -> "JobCache":
+    key = (os.getpid(), str(Path(cache_dir).resolve()))
+    if key not in _open_caches:
+        _open_caches[key] = JobCache(cache_dir, max_bytes=max_bytes or JobCache.DEFAULT_MAX_BYTES)
+    return _open_caches[key]
+
+def encode_array(array : np.ndarray) -> bytes:
+    buffer = io.BytesIO()
+    np.save(buffer, array, allow_pickle=False)
+    return buffer.getvalue()
+
+def decode_array(data : bytes) -> np.ndarray:
+    return np.load(io.BytesIO(data), allow_pickle=False)
+
+class JobCache:
+    DEFAULT_MAX_BYTES = 32 * 2**30
+    _TOTAL = b"__total__"
+    _META = struct.Struct("<qd")
+
+    def __init__(self, cache_dir : str|Path, max_bytes : int=DEFAULT_MAX_BYTES):
+        """
+        On-disk cache of the decoded, concatenated arrays of MutPred2 jobs, stored in an LMDB environment
+
+        Entries are keyed by the job fingerprint (see job_manifest.job_fingerprint) and the array name, so an entry
+        is only used while the job's files are unchanged. Numeric and string arrays are stored in .npy format, without
+        pickling; object arrays (e.g. motif_info) are not cached. Once the cached arrays exceed max_bytes, the least
+        recently used entries are evicted
+
+        Reads only take a read transaction, so they do not serialize on the LMDB write lock; the last use of the entries
+        read is recorded with the next put (before any eviction) or on close
+
+        Parameters
+        ----------
+        cache_dir : str|Path
+            The LMDB environment directory, created if needed
+
+        max_bytes : int
+            The maximum total size of the cached arrays
+        """
+        Path(cache_dir).mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.env = lmdb.open(str(cache_dir), map_size=2 * max_bytes + 2**30, max_dbs=2)
+        self.data_db = self.env.open_db(b"data")
+        self.meta_db = self.env.open_db(b"meta")
+        self.touched : Dict[bytes,float] = {}
+
+    @staticmethod
+    def key(fingerprint : str, name : str) -> bytes:
+        return f"{fingerprint}/{name}".encode('utf-8')
+
+    def get(self, fingerprint : str, name : str) -> np.ndarray|None:
+        key = JobCache.key(fingerprint, name)
+        with self.env.begin() as txn:
+            data = txn.get(key, db=self.data_db)
+            if data is None:
+                return None
+        self.touched[key] = time.time()
+        return decode_array(data)
+
+    def put(self, fingerprint : str, name : str, array : np.ndarray) -> None:
+        if array.dtype.hasobject:
+            return
+        data = encode_array(array)
+        if len(data) > self.max_bytes:
+            return
+        key = JobCache.key(fingerprint, name)
+        with self.env.begin(write=True) as txn:
+            self._record_touched(txn)
+            total = self._total(txn)
+            previous = txn.get(key, db=self.meta_db)
+            if previous is not None:
+                total -= JobCache._META.unpack(previous)[0]
+                txn.delete(key, db=self.data_db)
+                txn.delete(key, db=self.meta_db)
+            if total + len(data) > self.max_bytes:
+                total = self._evict(txn, total, total + len(data) - self.max_bytes)
+            txn.put(key, data, db=self.data_db)
+            txn.put(key, JobCache._META.pack(len(data), time.time()), db=self.meta_db)
+            txn.put(JobCache._TOTAL, struct.pack("<q", total + len(data)), db=self.meta_db)
+
+    def get_or_load(self, fingerprint : str|None, name : str, loader : Callable[[],np.ndarray]) -> np.ndarray:
+        """
+        The cached array, or the array returned by loader, which is then cached
+        """
+        if fingerprint is None:
+            return loader()
+        array = self.get(fingerprint, name)
+        if array is None:
+            array = loader()
+            self.put(fingerprint, name, array)
+        return array
+
+    def _record_touched(self, txn) -> None:
+        touched, self.touched = self.touched, {}
+        for key, last_used in touched.items():
+            meta = txn.get(key, db=self.meta_db)
+            if meta is not None:
+                txn.put(key, JobCache._META.pack(JobCache._META.unpack(meta)[0], last_used), db=self.meta_db)
+
+    def _total(self, txn) -> int:
+        total = txn.get(JobCache._TOTAL, db=self.meta_db)
+        return 0 if total is None else struct.unpack("<q", total)[0]
+
+    def _evict(self, txn, total : int, n_bytes : int) -> int:
+        entries = []
+        for key, value in txn.cursor(db=self.meta_db):
+            if key != JobCache._TOTAL:
+                size, last_used = JobCache._META.unpack(value)
+                entries.append((last_used, key, size))
+        freed = 0
+        for _, key, size in sorted(entries):
+            if freed >= n_bytes:
+                break
+            txn.delete(key, db=self.data_db)
+            txn.delete(key, db=self.meta_db)
+            freed += size
+        return total - freed
+
+    def stats(self) -> Dict[str,int]:
+        with self.env.begin() as txn:
+            return dict(entries=txn.stat(self.data_db)['entries'], bytes=self._total(txn))
+
+    def close(self) -> None:
+        if len(self.touched) > 0:
+            with self.env.begin(write=True) as txn:
+                self._record_touched(txn)
+        self.env.close()
@@ -0,0 +1,92 @@
+from typing import Dict, Iterable, Iterator, Tuple
+from pathlib import Path
+import hashlib
+import json
+import time
+import os
+
+import lmdb
+
+def fingerprint_files(files : Iterable[Tuple[str,int,int]]) -> str:
+    """
+    md5 of the sorted (name, size, mtime_ns) of a directory's files
+    """
+    return hashlib.md5(json.dumps(sorted(files)).encode('utf-8')).hexdigest()
+
+def job_fingerprint(job_dir : str|Path) -> str|None:
+    """
+    md5 of the (name, size, mtime) of every file in the job directory, or None if the directory cannot be read
+    """
+    try:
+        with os.scandir(job_dir) as entries:
+            files = [(entry.name, entry.stat().st_size, entry.stat().st_mtime_ns) for entry in entries if entry.is_file()]
+    except OSError:
+        return None
+    return fingerprint_files(files)
+
+class JobManifest:
+    DONE = "done"
+    FAILED = "failed"
+
+    def __init__(self, path : str|Path, map_size : int=2**30):
+        """
+        Persistent record of the jobs processed by process_job_list, stored in an LMDB environment
+
+        Each job directory maps to a JSON record with its fingerprint (see job_fingerprint), status
+        ("done" or "failed"), row counts, processing time, error and update time
+
+        Parameters
+        ----------
+        path : str|Path
+            The LMDB environment directory, created if needed
+
+        map_size : int
+            The maximum size of the environment in bytes
+        """
+        Path(path).mkdir(parents=True, exist_ok=True)
+        self.env = lmdb.open(str(path), map_size=map_size)
+
+    def get(self, job_dir : str) -> Dict|None:
+        with self.env.begin() as txn:
+            record = txn.get(str(job_dir).encode('utf-8'))
+        return None if record is None else json.loads(record)
+
+    def put(self, job_dir : str, record : Dict) -> None:
+        with self.env.begin(write=True) as txn:
+            txn.put(str(job_dir).encode('utf-8'), json.dumps(record).encode('utf-8'))
+
+    def should_process(self, job_dir : str, fingerprint : str|None, retry_failed_only : bool=False) -> bool:
+        """
+        Whether a job has to be (re)processed
+
+        Jobs that are done and whose fingerprint is unchanged are skipped; with retry_failed_only,
+        only jobs recorded as failed are processed
+        """
+        record = self.get(job_dir)
+        if retry_failed_only:
+            return record is not None and record['status'] == JobManifest.FAILED
+        return record is None or record['status'] != JobManifest.DONE or record['fingerprint'] != fingerprint
+
+    def record(self, job_dir : str, fingerprint : str|None, error : str|None, stats : Dict) -> None:
+        self.put(job_dir, dict(fingerprint=fingerprint,
+                                status=JobManifest.DONE if error is None else JobManifest.FAILED,
+                                rows=stats.get('rows', {}),
+                                seconds=stats.get('seconds'),
+                                peak_rss_mb=stats.get('peak_rss_mb'),
+                                partial_commit=stats.get('partial_commit'),
+                                error=error,
+                                updated=time.time()))
+
+    def records(self) -> Iterator[Tuple[str,Dict]]:
+        with self.env.begin() as txn:
+            for key, value in txn.cursor():
+                yield key.decode('utf-8'), json.loads(value)
+
+    def summary(self) -> Dict[str,int]:
+        counts = {}
+        for _, record in self.records():
+            counts[record['status']] = counts.get(record['status'], 0) + 1
+        return counts
+
+    def close(self) -> None:
+        self.env.close()
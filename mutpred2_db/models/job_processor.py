@@ -8,21 +8,99 @@ from .features_sequence import Features_Sequence
 from .features_structure import Features_Structure
 from .features_substitution import Features_Substitution
 from .mechanism import Mechanism
-from .sql_connection import write_sequence,write_variants,query_runoption,write_mechanisms,write_feature_sets
+from .feature_block import FeatureBlock
+from .mechanism_block import MechanismBlock
+from .variant_batch import VariantBatch
+from .feature_codec import FeatureVectorBlock, FEATURE_VECTOR_COLUMNS
+from .feature_sites import FeatureSiteBlock, FeatureSiteVariantBlock, split_site_features
+from .job_cache import open_job_cache
+from .shard_index import ShardIndex
+from .errors import JobDataError, PartialCommitError
+from .instrumentation import InstrumentedCursor, InstrumentedConnection
+from .memory import current_rss_mb, peak_rss_mb
+from .delta_sync import sync_rows, known_sequences, SYNC_MODES
+from .schema import set_foreign_key_checks
+from .sql_connection import (query_runoption, write_rows, iter_rows, variant_rows, feature_set_columns, check_site_mask,
+                                SEQUENCE_COLUMNS, VARIANT_COLUMNS, MECHANISM_COLUMNS, DEFAULT_BATCH_SIZE)
 
-from scipy.io import loadmat
 import numpy as np
-import pandas as pd
 from pathlib import Path
-from typing import List,Dict,Iterable
-import re
-import os
+from typing import List,Dict,Iterable,Tuple
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+import queue
+import threading
 from tqdm import tqdm
+import time
 
 class Processor:
-    def __init__(self, cursor, cnx):
+    def __init__(self, cursor, cnx, sink=None, **kwargs):
+        """
+        Parameters
+        ----------
+        cursor, cnx
+            The database cursor and connection the job is written with
+
+        sink : optional
+            An object with write_rows(table, columns, rows), begin_job(), end_job() and abort_job() methods
+            (e.g. bulk_load.TSVStager) that receives the rows of each job instead of the database
+
+        batch_size : int, optional
+            The number of rows sent per INSERT statement (default sql_connection.DEFAULT_BATCH_SIZE)
+
+        cache_dir : str, optional
+            A job_cache.JobCache directory holding decoded .mat arrays (see process)
+
+        load_threads : int, optional
+            The number of threads loading the shard files of a series concurrently (default 4)
+
+        hash_workers : int, optional
+            The number of processes computing the variant ids of very large jobs (default 1, see VariantBatch)
+
+        feature_storage : str, optional
+            "tables" (default) to write the seven features_* tables, "packed" to write one packed blob
+            per variant to the FeatureVector table (see feature_codec), or "site" to write the columns constant
+            at each position once per site to FeatureSite and the others per variant to FeatureSiteVariant (see feature_sites)
+
+        feature_dtype : str, optional
+            The storage type of packed feature vectors and site features, "float32" (default) or "float16"
+
+        delta_sync : str, optional
+            Write only new rows ("keys") or new and changed rows ("content") to the database (see set_delta_sync)
+
+        metrics : instrumentation.JobMetrics, optional
+            Record the time of each stage (scan, read.<variable>, construct.<object>) and the rows and time of each table write
+
+        sql_connection : SQL_Connection, optional
+            The pool the connections of concurrent table writes are taken from (see table_writers)
+
+        table_writers : int, optional
+            The number of connections the mechanism and feature tables of a job are written on concurrently, one table
+            per connection at a time, once the Protein and Variant rows are written on cursor (default 1: every table on
+            cursor, one after another). Requires sql_connection, whose pool must hold table_writers more connections,
+            and no sink. See write_concurrently
+        """
         self.cursor = cursor
         self.cnx = cnx
+        self.sink = sink
+        self.batch_size = kwargs.get('batch_size', DEFAULT_BATCH_SIZE)
+        self.cache = None
+        if kwargs.get('cache_dir') is not None:
+            self.cache = open_job_cache(kwargs['cache_dir'], kwargs.get('cache_max_bytes'))
+        self.job_fingerprint = None
+        self.shard_index = None
+        self.load_threads = kwargs.get('load_threads', 4)
+        self.hash_workers = kwargs.get('hash_workers', 1)
+        self.feature_storage = kwargs.get('feature_storage', "tables")
+        self.feature_dtype = kwargs.get('feature_dtype', "float32")
+        self.set_delta_sync(**kwargs)
+        self.metrics = kwargs.get('metrics')
+        self.sql_connection = kwargs.get('sql_connection')
+        self.known_sequences = known_sequences(self.sql_connection)
+        self.table_writers = kwargs.get('table_writers', 1)
+        self.table_connections = []
+        self.partial_commit = None
+        self.lock = threading.Lock()
 
     def process(self, job_dir : Path, **kwargs) -> Dict[str,Sequence|List[Variant|\
                                                                 Features_Conservation|\
@@ -48,33 +126,111 @@ class Processor:
         Optional Parameters
         ----------
         write_to_db : bool
-            Whether to write the results to a MySQL database
+            Whether to write the results to a MySQL database (or to the sink, if the Processor has one)
+
+        max_mechanism_pvalue : float
+            Only keep mechanisms with a p-value at or below this threshold (default: keep all mechanisms)
+
+        batch_size : int
+            The number of rows sent per INSERT statement (default sql_connection.DEFAULT_BATCH_SIZE)
+            All rows of the job are written in a single transaction, committed once the job is complete
+
+        cache_dir : str
+            Cache the decoded .mat arrays of the job in this LMDB directory, keyed by the fingerprint of the job's files,
+            so re-ingesting an unchanged job skips .mat decoding
+
+        cache_max_bytes : int
+            The size above which least recently used cache entries are evicted (default job_cache.JobCache.DEFAULT_MAX_BYTES)
+
+        load_threads : int
+            The number of threads loading the shard files of a series concurrently (default 4)
+
+        hash_workers : int
+            The number of processes computing the variant ids of very large jobs (default 1)
+
+        feature_storage : str
+            "tables" (default), "packed", which stores each variant's feature vector as one blob in the
+            FeatureVector table; the results then hold a feature_vectors FeatureVectorBlock instead of features_* blocks,
+            or "site", which detects the feature columns constant among the substitutions of every position of the job
+            and stores them once per position in FeatureSite, keeping only the other columns per variant in
+            FeatureSiteVariant; the results then hold feature_sites and feature_site_variants blocks
+            (see feature_sites.split_site_features; sql_connection.query_feature_vectors reassembles the vectors).
+            A job whose site mask differs from the one stored for its protein is refused (see sql_connection.check_site_mask).
+            Not combined with process_streaming
+
+        feature_dtype : str
+            The storage type of packed feature vectors and site features, "float32" (default) or "float16"
+
+        delta_sync : str
+            Idempotent writes for re-ingestion: "keys" reads the stored keys of each table in batched queries and
+            inserts only the missing rows, "content" also compares the stored values and updates the changed rows.
+            Proteins already stored are remembered per database for the life of the process (delta_sync.known_sequences).
+            The number of rows inserted, updated and unchanged per table is kept in sync_counts
 
         Returns
         -------
         Dict[str,Sequence|List[Variant|Features_Conservation|Features_Function|Features_Homology|Features_PSSM|Features_Sequence|Features_Structure|Features_Substitution|Mechanism]]
             A dictionary containing the sequence, variants, features, and mechanisms of the job
+            variants is a VariantBatch, which yields Variant objects when iterated.
+            Each features_* entry is a FeatureBlock, which yields Features_* objects when indexed or iterated,
+            and mechanisms is a MechanismBlock, which yields Mechanism objects when iterated
         """
         self.write_to_db = kwargs.get('write_to_db', True)
+        self.batch_size = kwargs.get('batch_size', self.batch_size)
+        self.set_delta_sync(**kwargs)
+        results = self.parse(job_dir, **kwargs)
+        if self.write_to_db:
+            self.write_job(results)
+        return results
+
+    def run_option_id(self, **kwargs) -> int:
         run_options = {k : kwargs.get(k) for k in ['compute_homology_profile',
                                                     'use_predicted_conservation_scores',
                                                     'skip_psi_blast',
                                                     'p_value_threshold']}
-        option_id = query_runoption(self.cursor, self.cnx,**run_options)
-        sequence = self.make_sequence(job_dir)
-        if self.write_to_db:
-            write_sequence(self.cursor, self.cnx,sequence)
-        variants = self.make_variants(job_dir, sequence, option_id)
-        if self.write_to_db:
-            _ = write_variants(self.cursor, self.cnx,variants)
-            # for i,v_id in enumerate(variant_ids):
-            #     variants[i].variant_id = v_id
-        mechanisms = self.make_mechanisms(job_dir, variants)
-        (features_sequence, features_substitution,
-                features_pssm, features_conservation,
-                features_homology, features_structure,
-                features_function) = self.make_features(job_dir, variants, option_id)
-        results = dict(sequence=sequence,
+        return query_runoption(self.cursor, self.cnx,**run_options)
+
+    def parse(self, job_dir : Path, **kwargs) -> Dict:
+        """
+        Read the output of a MutPred2 job without writing anything (see process for the parameters and return value)
+        """
+        option_id = self.run_option_id(**kwargs)
+        if kwargs.get('cache_dir') is not None:
+            self.cache = open_job_cache(kwargs['cache_dir'], kwargs.get('cache_max_bytes'))
+        self.load_threads = kwargs.get('load_threads', self.load_threads)
+        self.hash_workers = kwargs.get('hash_workers', self.hash_workers)
+        self.set_feature_storage(**kwargs)
+        with self.stage("scan"):
+            self.shard_index = ShardIndex.scan(job_dir, with_stats=self.cache is not None)
+            self.shard_index.check_complete()
+            self.job_fingerprint = self.shard_index.fingerprint() if self.cache is not None else None
+        with self.stage("construct.sequence"):
+            sequence = self.make_sequence(job_dir)
+        with self.stage("construct.variants"):
+            variants = self.make_variants(job_dir, sequence, option_id)
+        with self.stage("construct.mechanisms"):
+            mechanisms = self.make_mechanisms(job_dir, variants, max_pvalue=kwargs.get('max_mechanism_pvalue'))
+        if self.feature_storage == "packed":
+            with self.stage("construct.feature_vectors"):
+                feature_vectors = self.make_feature_vectors(job_dir, variants, option_id)
+            return dict(sequence=sequence,
+                        variants=variants,
+                        feature_vectors=feature_vectors,
+                        mechanisms=mechanisms)
+        if self.feature_storage == "site":
+            with self.stage("construct.site_features"):
+                feature_sites, feature_site_variants = self.make_site_features(job_dir, variants, option_id)
+            return dict(sequence=sequence,
+                        variants=variants,
+                        feature_sites=feature_sites,
+                        feature_site_variants=feature_site_variants,
+                        mechanisms=mechanisms)
+        with self.stage("construct.features"):
+            (features_sequence, features_substitution,
+                    features_pssm, features_conservation,
+                    features_homology, features_structure,
+                    features_function) = self.make_features(job_dir, variants, option_id)
+        return dict(sequence=sequence,
                     variants=variants,
                     features_sequence=features_sequence,
                     features_substitution=features_substitution,
@@ -85,10 +241,227 @@ class Processor:
                     features_function=features_function,
                     mechanisms=mechanisms)
 
+    def process_streaming(self, job_dir : Path, **kwargs) -> Dict:
+        """
+        Process a job one shard at a time: the i-th shard of every series is read, turned into variants, mechanisms
+        and features, written and released before the next shard, bounding memory by the shard size rather than the
+        protein size. The job is still written in a single transaction (or sink job; ParquetSink writes each shard as
+        row groups of the job's files). The decoded job cache is not used
+
+        Parameters: see process, and
+
+        max_rss_mb : float
+            Abort the job (rolling it back) with a MemoryError if the resident set size exceeds this after a shard
+
+        Returns
+        -------
+        Dict
+            The sequence, the number of rows of each table (rows), the number of shards and the peak RSS in MB
+        """
+        self.write_to_db = kwargs.get('write_to_db', True)
+        self.batch_size = kwargs.get('batch_size', self.batch_size)
+        self.load_threads = kwargs.get('load_threads', self.load_threads)
+        self.hash_workers = kwargs.get('hash_workers', self.hash_workers)
+        self.set_feature_storage(**kwargs)
+        if self.feature_storage == "site":
+            raise ValueError("feature_storage='site' needs every variant of a position at once, it is not combined with process_streaming")
+        self.set_delta_sync(**kwargs)
+        max_rss_mb = kwargs.get('max_rss_mb')
+        option_id = self.run_option_id(**kwargs)
+        with self.stage("scan"):
+            self.shard_index = ShardIndex.scan(job_dir)
+            self.shard_index.check_complete()
+        self.job_fingerprint = None
+        with self.stage("construct.sequence"):
+            sequence = self.make_sequence(job_dir)
+        substitutions = self.read_substitutions(job_dir)
+        scores = None if 'MutPred2Score' in self.shard_index.shards else self.read_mutpred2_scores(job_dir)
+        counts = {"Protein" : 1}
+        shard_numbers = self.shard_index.shard_numbers('feats')
+        if self.write_to_db and self.sink is not None:
+            self.sink.begin_job()
+        try:
+            if self.write_to_db:
+                self.write_rows("Protein", SEQUENCE_COLUMNS, [(sequence.seq_hash, sequence.seq)], total=1)
+            offset = 0
+            for number in tqdm(shard_numbers, desc="Processing shards", leave=False):
+                with self.stage("read.shard"), self.stage("construct.shard"):
+                    shard = self.shard_index.load_shard(number, threads=self.load_threads)
+                n = len(shard['feats'])
+                if scores is None:
+                    shard_scores = np.array([s.item() for s in shard['MutPred2Score'].ravel()])
+                else:
+                    shard_scores = scores[offset:offset + n]
+                with self.stage("construct.shard"):
+                    variants = VariantBatch.from_substitutions(sequence.seq_hash, substitutions[offset:offset + n], shard_scores, option_id,
+                                                                n_jobs=self.hash_workers)
+                    variants.validate(sequence)
+                    variant_ids = variants.variant_ids
+                    results = dict(sequence=sequence,
+                                    variants=variants,
+                                    mechanisms=MechanismBlock.from_mechanism_info(self.mechanism_info(shard), variant_ids,
+                                                                                    max_pvalue=kwargs.get('max_mechanism_pvalue')))
+                    if self.feature_storage == "packed":
+                        results['feature_vectors'] = FeatureVectorBlock(variant_ids, option_id, shard['feats'][:len(variant_ids)], self.feature_dtype)
+                    else:
+                        results.update(FeatureBlock.from_feats(shard['feats'][:len(variant_ids)], variant_ids, option_id))
+                if self.write_to_db:
+                    self.write_rows("Variant", VARIANT_COLUMNS, variant_rows(variants), total=len(variants))
+                    self.write({k : v for k,v in results.items() if k not in ['sequence','variants']})
+                for table, count in Processor.row_counts(results).items():
+                    if table != "Protein":
+                        counts[table] = counts.get(table, 0) + count
+                offset += n
+                del shard, variants, results
+                rss = current_rss_mb()
+                if max_rss_mb is not None and rss > max_rss_mb:
+                    raise MemoryError(f"{job_dir}: RSS {rss:.0f} MB exceeds max_rss_mb={max_rss_mb} after shard {number}")
+        except Exception as e:
+            if self.write_to_db:
+                self.abort()
+            raise e
         if self.write_to_db:
+            self.commit()
+        return dict(sequence=sequence, rows=counts, shards=len(shard_numbers), peak_rss_mb=peak_rss_mb())
+
+    @staticmethod
+    def row_counts(results : Dict) -> Dict[str,int]:
+        """
+        The number of rows of each table in the results of a job
+        """
+        counts = {"Protein" : 1,
+                    "Variant" : len(results['variants']),
+                    "VariantMechanism" : len(results['mechanisms'])}
+        counts.update({k : len(v) for k,v in results.items() if k.startswith('features_')})
+        if 'feature_vectors' in results:
+            counts["FeatureVector"] = len(results['feature_vectors'])
+        if 'feature_sites' in results:
+            counts["FeatureSite"] = len(results['feature_sites'])
+            counts["FeatureSiteVariant"] = len(results['feature_site_variants'])
+        return counts
+
+    def write_job(self, results : Dict) -> None:
+        """
+        Write the parsed results of a job in a single transaction (or sink job), rolled back if any write fails
+        """
+        if self.sink is not None:
+            self.sink.begin_job()
+        self.sync_counts = {}
+        try:
+            sequence, variants = results['sequence'], results['variants']
+            self.write_rows("Protein", SEQUENCE_COLUMNS, [(sequence.seq_hash, sequence.seq)], total=1)
+            self.write_rows("Variant", VARIANT_COLUMNS, variant_rows(variants), total=len(variants))
             self.write({k : v for k,v in results.items() if k not in ['sequence','variants']})
+        except Exception as e:
+            self.abort()
+            raise e
+        self.commit()
 
-        return results
+    def commit(self) -> None:
+        self.partial_commit = None
+        if self.sink is not None:
+            self.sink.end_job()
+        else:
+            try:
+                self.cnx.commit()
+            except Exception as e:
+                self.release_table_connections(commit=False)
+                raise e
+            self.known_sequences.update(self.pending_sequences)
+            self.commit_table_connections()
+        self.pending_sequences = set()
+
+    def abort(self) -> None:
+        self.partial_commit = None
+        if self.sink is not None:
+            self.sink.abort_job()
+        else:
+            self.release_table_connections(commit=False)
+            self.cnx.rollback()
+        self.pending_sequences = set()
+
+    def commit_table_connections(self) -> None:
+        """
+        Commit the concurrent table writes of the job, after the Protein and Variant rows they reference were committed.
+        If a commit fails, the tables not committed yet are rolled back and a PartialCommitError is raised, the committed
+        and rolled back tables being kept as partial_commit for the job statistics (re-processing the job completes it,
+        as writes are upserts)
+        """
+        committed = ["Protein", "Variant"]
+        try:
+            for cursor, cnx, tables in self.table_connections:
+                cnx.commit()
+                committed.extend(tables)
+        except Exception as e:
+            rolled_back = [table for _, _, tables in self.table_connections for table in tables if table not in committed]
+            self.release_table_connections(commit=False)
+            self.partial_commit = dict(committed=committed, rolled_back=rolled_back)
+            raise PartialCommitError(f"Partially committed job: {committed} were committed, {rolled_back} were rolled back: {e}",
+                                        committed, rolled_back) from e
+        self.release_table_connections(commit=True)
+
+    def release_table_connections(self, commit : bool) -> None:
+        """
+        Roll the table connections back (unless they were committed) and return them to the pool
+        """
+        table_connections, self.table_connections = self.table_connections, []
+        for cursor, cnx, _ in table_connections:
+            try:
+                if not commit:
+                    cnx.rollback()
+                set_foreign_key_checks(cursor, True)
+            finally:
+                self.sql_connection.close(cnx, cursor)
+
+    def set_delta_sync(self, **kwargs) -> None:
+        """
+        Set the delta sync mode (None, "keys" or "content") and reset sync_counts
+        """
+        self.delta_sync = kwargs.get('delta_sync', getattr(self, 'delta_sync', None))
+        if self.delta_sync not in (None, *SYNC_MODES):
+            raise ValueError(f"delta_sync must be one of {SYNC_MODES}, not {self.delta_sync}")
+        if self.delta_sync is not None and self.sink is not None:
+            raise ValueError("delta_sync requires writing to the database, not to a sink")
+        self.sync_counts = {}
+        self.pending_sequences = set()
+
+    def stage(self, name : str):
+        """
+        A context manager timing a stage of the job into the Processor's metrics, if it has any
+        """
+        return nullcontext() if self.metrics is None else self.metrics.stage(name)
+
+    def write_rows(self, table : str, columns : Iterable[str], rows : Iterable[tuple]|FeatureBlock|MechanismBlock|FeatureVectorBlock, total : int|None=None,
+                    cursor=None) -> int:
+        """
+        Write rows (or a columnar block) to the sink if the Processor has one, otherwise to the database
+        (with cursor, by default the Processor's)
+        """
+        if self.metrics is None:
+            return self._write_rows(table, columns, rows, total, cursor)
+        start = time.perf_counter()
+        n_written = self._write_rows(table, columns, rows, total, cursor)
+        with self.lock:
+            self.metrics.add_table(table, rows=n_written, seconds=time.perf_counter() - start)
+        return n_written
+
+    def _write_rows(self, table : str, columns : Iterable[str], rows : Iterable[tuple]|FeatureBlock|MechanismBlock|FeatureVectorBlock, total : int|None=None,
+                    cursor=None) -> int:
+        if self.sink is not None:
+            return self.sink.write_rows(table, columns, rows)
+        cursor = cursor or self.cursor
+        if self.delta_sync is not None:
+            known = {(seq_hash,) for seq_hash in self.known_sequences} if table == "Protein" else set()
+            counts = sync_rows(cursor, table, columns, rows, compare_content=self.delta_sync == "content" and table != "Protein",
+                                known=known, batch_size=self.batch_size)
+            with self.lock:
+                if table == "Protein":
+                    self.pending_sequences.update(row[0] for row in iter_rows(rows))
+                table_counts = self.sync_counts.setdefault(table, dict(inserted=0, updated=0, unchanged=0))
+                for k, count in counts.items():
+                    table_counts[k] += count
+            return counts['inserted'] + counts['updated']
+        return write_rows(cursor, table, columns, rows, total=total, batch_size=self.batch_size)
 
     def write(self, results : Dict[str,Sequence|List[Variant|\
                                                                 Features_Conservation|\
@@ -99,71 +472,162 @@ class Processor:
                                                                 Features_Structure|\
                                                                 Features_Substitution|\
                                                                 Mechanism]]) -> None:
-        write_mechanisms(self.cursor, self.cnx,results['mechanisms'])
-        for k in tqdm(['features_sequence',
+        """
+        Write the mechanisms and feature sets of a job, leaving the commit to the caller
+        (concurrently, on table_writers connections, when the Processor has them; see write_concurrently)
+        """
+        tables = [("VariantMechanism", MECHANISM_COLUMNS, results['mechanisms'])]
+        if len(results.get('feature_vectors', ())) > 0:
+            tables.append(("FeatureVector", FEATURE_VECTOR_COLUMNS, results['feature_vectors']))
+        if len(results.get('feature_sites', ())) > 0:
+            if self.sink is None:
+                check_site_mask(self.cursor, results['feature_sites'])
+            tables.append(("FeatureSite", results['feature_sites'].columns, results['feature_sites']))
+            tables.append(("FeatureSiteVariant", results['feature_site_variants'].columns, results['feature_site_variants']))
+        for k in ['features_sequence',
                     'features_substitution',
                     'features_pssm',
                     'features_conservation',
                     'features_homology',
                     'features_structure',
-                    'features_function'],desc="Writing features",leave=False):
-            write_feature_sets(self.cursor, self.cnx,results[k], k)
+                    'features_function']:
+            if len(results.get(k, ())) > 0:
+                tables.append((k, feature_set_columns(results[k]), results[k]))
+        if self.table_writers > 1 and self.sink is None and self.sql_connection is not None:
+            self.write_concurrently(tables)
+            return
+        for table, columns, rows in tqdm(tables, desc="Writing tables", leave=False):
+            self.write_rows(table, columns, rows, total=len(rows))
+
+    def write_concurrently(self, tables : List[Tuple[str,Iterable[str],Iterable[tuple]]]) -> None:
+        """
+        Write tables concurrently, each on one of table_writers pooled connections (opened on the first call of the job,
+        so a streamed job keeps them across shards), leaving the commit to the caller
+
+        The table connections have their own transactions, in which the job's Variant rows (not committed yet) are not
+        visible, so they write with foreign key checks disabled; commit commits them after the Processor's connection,
+        so the rows they reference are always committed first, and abort rolls all of them back. If any table fails,
+        the other writes still finish, every failure is reported and the first error is raised. Their statements and
+        commits are recorded in the job's metrics, if the Processor has any
+        """
+        if len(self.table_connections) == 0:
+            for _ in range(min(self.table_writers, len(tables))):
+                cursor, cnx = self.sql_connection.open()
+                if self.metrics is not None:
+                    cursor, cnx = InstrumentedCursor(cursor, self.metrics), InstrumentedConnection(cnx, self.metrics)
+                set_foreign_key_checks(cursor, False)
+                self.table_connections.append((cursor, cnx, []))
+        available = queue.Queue()
+        for table_connection in self.table_connections:
+            available.put(table_connection)
+        def write_table(table : str, columns : Iterable[str], rows : Iterable[tuple]) -> int:
+            cursor, cnx, written = available.get()
+            try:
+                n_written = self.write_rows(table, columns, rows, total=len(rows), cursor=cursor)
+                written.append(table)
+                return n_written
+            finally:
+                available.put((cursor, cnx, written))
+        with ThreadPoolExecutor(max_workers=len(self.table_connections)) as executor:
+            futures = {table : executor.submit(write_table, table, columns, rows) for table, columns, rows in tables}
+        errors = {table : future.exception() for table, future in futures.items() if future.exception() is not None}
+        for table, error in errors.items():
+            print(f"Failed writing {table}: {error}")
+        if len(errors) > 0:
+            raise next(iter(errors.values()))
+
+    def cached(self, name : str, loader) -> np.ndarray:
+        """
+        The array returned by loader, read from the job cache when the Processor has one and the job is unchanged
+        """
+        if self.cache is None:
+            return loader()
+        return self.cache.get_or_load(self.job_fingerprint, name, loader)
 
     def make_sequence(self, job_dir : Path) -> Sequence:
         # seq = self.read_mat_files(job_dir, pattern='.*.txt.sequences.mat',key_value='sequences').item().item()
-        seq = loadmat(f"{job_dir}/output.txt.sequences.mat")['sequences'].item().item()
+        from scipy.io import loadmat
+        seq = self.cached('sequences', lambda: np.array(loadmat(f"{job_dir}/output.txt.sequences.mat")['sequences'].item().item())).item()
         assert isinstance(seq,str), "Sequence must be a string, not {}".format(type(seq))
         return Sequence(seq)
 
     def read_substitutions(self, job_dir : Path) -> List[str]:
         # subs = self.read_mat_files(job_dir, pattern='.*.txt.substitutions.mat',key_value='substitutions')
-        subs = loadmat(f"{job_dir}/output.txt.substitutions.mat")['substitutions']
-        substitutions = list(map(lambda i : i.item(),subs.item().ravel()))
+        from scipy.io import loadmat
+        def load():
+            subs = loadmat(f"{job_dir}/output.txt.substitutions.mat")['substitutions']
+            return np.array(list(map(lambda i : i.item(),subs.item().ravel())))
+        substitutions = self.cached('substitutions', load).tolist()
         return substitutions
 
     def read_mutpred2_scores(self, job_dir : Path) -> Iterable[float]:
-        try:
-            scores = self.read_mat_files(job_dir, pattern='.*.txt.MutPred2Score_\d+.mat',key_value='S')
-            scores = np.array([s.item() for s in scores.ravel()])
-        except AttributeError:
+        """
+        The MutPred2 score of each variant, from the MutPred2Score_N.mat shards or, for jobs without them, from output.txt
+        """
+        if self.shard_index is None or self.shard_index.job_dir != job_dir:
+            self.shard_index = ShardIndex.scan(job_dir)
+        if len(self.shard_index.shard_numbers('MutPred2Score')) == 0:
+            import pandas as pd
             df = pd.read_csv(f"{job_dir}/output.txt")
-            scores = df.loc[:,'MutPred2 score'].values.astype(float)
-        return scores
+            return df.loc[:,'MutPred2 score'].values.astype(float)
+        scores = self.read_mat_files(job_dir, pattern='.*.txt.MutPred2Score_\d+.mat',key_value='S')
+        return np.array([s.item() for s in scores.ravel()])
 
-    def make_variants(self, job_dir : Path, sequence : Sequence, option_id : int) -> Iterable[Variant]:
+    def make_variants(self, job_dir : Path, sequence : Sequence, option_id : int) -> VariantBatch:
         substitutions = self.read_substitutions(job_dir)
         scores = self.read_mutpred2_scores(job_dir)
-        variants = [Variant(sequence.seq_hash,sub,score, option_id) for sub,score in zip(substitutions,scores)]
-        self.validate_variants(variants,sequence)
+        variants = VariantBatch.from_substitutions(sequence.seq_hash, substitutions, scores, option_id, n_jobs=self.hash_workers)
+        variants.validate(sequence)
         return variants
 
-    def validate_variants(self, variants : List[Variant], sequence : Sequence) -> None:
+    def validate_variants(self, variants : List[Variant]|VariantBatch, sequence : Sequence) -> None:
+        if isinstance(variants, VariantBatch):
+            variants.validate(sequence)
+            return
         for variant in variants:
             if sequence.seq[variant.position-1] != variant.reference_aa:
-                raise ValueError(f"Reference amino acid {variant.reference_aa} at position {variant.position} does not match sequence {sequence.seq}")
+                raise JobDataError(f"Reference amino acid {variant.reference_aa} at position {variant.position} does not match sequence {sequence.seq_hash}")
 
     def read_mat_files(self, job_dir : Path, pattern : str, key_value : str):
-        directory = os.listdir(job_dir)
-        re_pattern = re.compile(pattern)
-        files = sorted([f for f in directory if re_pattern.match(f)])
-        data = pd.DataFrame({
-            "Files": files
-        })
-        data["file_num"] = data["Files"].str.split(".").str[-2].str.split("_").str[-1].astype(int)
-        files = data.sort_values(by="file_num")["Files"]
+        with self.stage(f"read.{key_value}"):
+            return self.cached(key_value, lambda: self._read_mat_files(job_dir, pattern, key_value))
+
+    def _read_mat_files(self, job_dir : Path, pattern : str, key_value : str):
+        if self.shard_index is None or self.shard_index.job_dir != job_dir:
+            self.shard_index = ShardIndex.scan(job_dir)
+        files = self.shard_index.match(pattern)
+        shards = self.shard_index.load(files, key_value, threads=self.load_threads)
         if key_value == "motif_info" or key_value=="models":
-            data = np.concatenate([loadmat(f"{job_dir}/{f}")[key_value].ravel() for f in files])
+            data = np.concatenate([shard.ravel() for shard in shards])
 
         else:
-            data = np.concatenate([loadmat(f"{job_dir}/{f}")[key_value] for f in files])
+            data = np.concatenate(shards)
 
         return data
 
+    @staticmethod
+    def pad_positions(positions_pu : np.ndarray) -> np.ndarray:
+        """
+        Add the (position-less) Stability column to positions_pu
+        """
+        return np.concatenate((positions_pu,
+                                np.ones((positions_pu.shape[0], 1)) * -1),
+                                axis=1)
+
+    @staticmethod
+    def mechanism_info(shard : Dict[str,np.ndarray]) -> Dict[str,np.ndarray]:
+        """
+        The mechanism arrays of a shard loaded with ShardIndex.load_shard, as returned by read_mechanism_info
+        """
+        return dict(positions_pu=Processor.pad_positions(shard['positions_pu']),
+                    pvals_pu=shard['prop_pvals_pu'],
+                    scores_pu=shard['prop_scores_pu'],
+                    prop_types_pu=shard['prop_types_pu'],
+                    motif_info=shard['motif_info'].ravel())
+
     def read_mechanism_info(self, job_dir : Path) -> Dict[str,np.ndarray]:
         positions_pu = self.read_mat_files(job_dir=job_dir, pattern='.*.txt.positions_pu_\d+.mat', key_value='positions_pu')
-        positions_pu = np.concatenate((positions_pu,
-                                    np.ones((positions_pu.shape[0], 1)) * -1),
-                                    axis=1)
+        positions_pu = Processor.pad_positions(positions_pu)
         pvals_pu        = self.read_mat_files(job_dir=job_dir, pattern='.*.txt.prop_pvals_pu_\d+.mat', key_value='prop_pvals_pu')
         scores_pu       = self.read_mat_files(job_dir=job_dir, pattern='.*.txt.prop_scores_pu_\d+.mat', key_value='prop_scores_pu')
         prop_types_pu   = self.read_mat_files(job_dir=job_dir, pattern='.*.txt.prop_types_pu_\d+.mat', key_value='prop_types_pu')
@@ -174,46 +638,31 @@ class Processor:
                     prop_types_pu=prop_types_pu,
                     motif_info=motif_info)
 
-    def make_features(self, job_dir : Path, variants : List[Variant], option_id : int):
+    def make_features(self, job_dir : Path, variants : VariantBatch, option_id : int) -> Tuple[FeatureBlock,...]:
         features = self.read_mat_files(job_dir=job_dir, pattern='.*.txt.feats_\d+.mat', key_value='feats')
-        features_conservation = []
-        features_function = []
-        features_homology = []
-        features_pssm = []
-        features_sequence = []
-        features_structure = []
-        features_substitution = []
-        for i,(variant,feats) in enumerate(zip(variants, features)):
-            features_sequence.append(Features_Sequence(variant.variant_id, option_id, feats[:184]))
-            features_substitution.append(Features_Substitution(variant.variant_id, option_id, feats[184:630]))
-            features_pssm.append(Features_PSSM(variant.variant_id, option_id, feats[630:799]))
-            features_conservation.append(Features_Conservation(variant.variant_id, option_id, feats[799:1036]))
-            features_homology.append(Features_Homology(variant.variant_id, option_id, feats[1036:1056]))
-            features_structure.append(Features_Structure(variant.variant_id, option_id, feats[1056:1135]))
-            features_function.append(Features_Function(variant.variant_id, option_id, feats[1135:]))
-        return (features_sequence, features_substitution,
-                features_pssm, features_conservation,
-                features_homology, features_structure,
-                features_function)
-
-    def make_mechanisms(self,job_dir : Path, variants : List[Variant]) -> List[Mechanism]:
+        n = min(len(variants), len(features))
+        blocks = FeatureBlock.from_feats(features[:n], variants.variant_ids[:n], option_id)
+        return (blocks['features_sequence'], blocks['features_substitution'],
+                blocks['features_pssm'], blocks['features_conservation'],
+                blocks['features_homology'], blocks['features_structure'],
+                blocks['features_function'])
+
+    def make_feature_vectors(self, job_dir : Path, variants : VariantBatch, option_id : int) -> FeatureVectorBlock:
+        features = self.read_mat_files(job_dir=job_dir, pattern='.*.txt.feats_\d+.mat', key_value='feats')
+        n = min(len(variants), len(features))
+        return FeatureVectorBlock(variants.variant_ids[:n], option_id, features[:n], self.feature_dtype)
+
+    def make_site_features(self, job_dir : Path, variants : VariantBatch, option_id : int) -> Tuple[FeatureSiteBlock,FeatureSiteVariantBlock]:
+        features = self.read_mat_files(job_dir=job_dir, pattern='.*.txt.feats_\d+.mat', key_value='feats')
+        n = min(len(variants), len(features))
+        return split_site_features(variants.seq_hash, variants.variant_ids[:n], variants.position[:n], option_id, features[:n], self.feature_dtype)
+
+    def set_feature_storage(self, **kwargs) -> None:
+        self.feature_storage = kwargs.get('feature_storage', self.feature_storage)
+        self.feature_dtype = kwargs.get('feature_dtype', self.feature_dtype)
+        if self.feature_storage not in ("tables", "packed", "site"):
+            raise ValueError(f"feature_storage must be 'tables', 'packed' or 'site', not {self.feature_storage}")
 
+    def make_mechanisms(self,job_dir : Path, variants : VariantBatch, max_pvalue : float|None=None) -> MechanismBlock:
         mechanism_info = self.read_mechanism_info(job_dir)
-        mechanisms = []
-        for i,variant in enumerate(variants):
-            mechanism_info_i = {k:v[i] for k,v in mechanism_info.items()}
-            motif = mechanism_info_i.get('motif_info')
-            for mechanism_idx, (position, pvalue, score, prop_type) in enumerate(zip(*[mechanism_info_i.get(k) for k in ['positions_pu',
-                                                                                                                'pvals_pu',
-                                                                                                                'scores_pu',
-                                                                                                                'prop_types_pu']])):
-                mechanisms.append(Mechanism(mechanism_idx,
-                                            variant.variant_id,
-                                            position,
-                                            pvalue,
-                                            score,
-                                            prop_type,
-                                            motif if mechanism_idx == Mechanism.motif_index else None))
-        return mechanisms
-
-    
\ No newline at end of file
+        return MechanismBlock.from_mechanism_info(mechanism_info, variants.variant_ids, max_pvalue=max_pvalue)
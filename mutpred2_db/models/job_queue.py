@@ -0,0 +1,331 @@
+from .shard_index import ShardIndex
+from .sql_connection import iter_batches
+
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Set
+import hashlib
+import os
+import socket
+import threading
+import time
+
+QUEUE_STATUSES = ("pending", "claimed", "done", "failed")
+
+# As in sql/building_tables.sql, for databases created before the table existed
+JOB_QUEUE_TABLE = """CREATE TABLE IF NOT EXISTS JobQueue (
+        job_key CHAR(32) PRIMARY KEY NOT NULL,
+        job_dir TEXT NOT NULL,
+        size_bytes BIGINT UNSIGNED NOT NULL DEFAULT 0,
+        status ENUM('pending','claimed','done','failed') NOT NULL DEFAULT 'pending',
+        worker VARCHAR(255),
+        claimed_at DATETIME,
+        heartbeat_at DATETIME,
+        attempts int UNSIGNED NOT NULL DEFAULT 0,
+        error TEXT,
+        INDEX job_queue_claim_idx (status, size_bytes))"""
+
+def job_size(job_dir : str|Path) -> int:
+    """
+    The size in bytes of the shard files of a job, an estimate of its processing time (0 if the directory cannot be read)
+    """
+    try:
+        index = ShardIndex.scan(job_dir, with_stats=True)
+    except OSError:
+        return 0
+    shard_files = {name for files in index.shards.values() for name in files.values()}
+    return sum(size for name, size, _ in index.file_stats if name in shard_files)
+
+def job_key(job_dir : str) -> str:
+    return hashlib.md5(str(job_dir).encode('utf-8')).hexdigest()
+
+def worker_name() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+class DatabaseJobQueue:
+    def __init__(self, sql_connection):
+        """
+        A queue of jobs shared by any number of process_job_list workers, stored in the JobQueue table
+
+        Workers claim the largest pending job in a transaction with SELECT ... FOR UPDATE SKIP LOCKED (MySQL 8), so
+        concurrent claims never block on or return the same job, and update the heartbeat of their claimed jobs;
+        claims whose heartbeat is older than a timeout (dead workers) are released back to pending
+
+        Parameters
+        ----------
+        sql_connection : SQL_Connection
+            The pool queue operations take a connection from (kept apart from the connections writing jobs,
+            as heartbeats are sent from a thread)
+        """
+        self.sql_connection = sql_connection
+
+    def execute(self, query : str, params : Iterable=(), fetch : bool=False) -> List[tuple]|int:
+        cursor, cnx = self.sql_connection.open()
+        try:
+            cursor.execute(query, tuple(params))
+            result = cursor.fetchall() if fetch else cursor.rowcount
+            cnx.commit()
+            return result
+        finally:
+            self.sql_connection.close(cnx, cursor)
+
+    def seed(self, job_dirs : List[str], batch_size : int=500) -> int:
+        """
+        Add the jobs that are not queued yet as pending, with their size estimate (job_size, only computed for the
+        jobs missing from the queue, as it stats every file of the job); returns the number of jobs added.
+        Failed jobs stay failed, see requeue_failed
+        """
+        self.execute(JOB_QUEUE_TABLE)
+        added = 0
+        for batch in iter_batches(job_dirs, batch_size):
+            keys = {job_key(job_dir) : job_dir for job_dir in batch}
+            queued = {row[0] for row in self.execute(f"SELECT job_key FROM JobQueue WHERE job_key IN ({', '.join(['%s'] * len(keys))})",
+                                                        list(keys), fetch=True)}
+            rows = [(key, job_dir, job_size(job_dir)) for key, job_dir in keys.items() if key not in queued]
+            if len(rows) == 0:
+                continue
+            added += self.execute(f"INSERT IGNORE INTO JobQueue (job_key, job_dir, size_bytes) VALUES {', '.join(['(%s, %s, %s)'] * len(rows))}",
+                                    [value for row in rows for value in row])
+        return added
+
+    def claim(self, worker : str) -> str|None:
+        """
+        Claim the largest pending job, returning its directory (None once no job is pending)
+        """
+        cursor, cnx = self.sql_connection.open()
+        try:
+            cnx.start_transaction()
+            cursor.execute("SELECT job_key, job_dir FROM JobQueue WHERE status = 'pending' "
+                            "ORDER BY size_bytes DESC LIMIT 1 FOR UPDATE SKIP LOCKED")
+            row = cursor.fetchone()
+            if row is None:
+                cnx.commit()
+                return None
+            cursor.execute("UPDATE JobQueue SET status = 'claimed', worker = %s, claimed_at = NOW(), heartbeat_at = NOW(), "
+                            "attempts = attempts + 1 WHERE job_key = %s", (worker, row[0]))
+            cnx.commit()
+            return row[1]
+        except Exception as e:
+            cnx.rollback()
+            raise e
+        finally:
+            self.sql_connection.close(cnx, cursor)
+
+    def heartbeat(self, job_dirs : Iterable[str], worker : str) -> None:
+        keys = [job_key(job_dir) for job_dir in job_dirs]
+        if len(keys) > 0:
+            self.execute(f"UPDATE JobQueue SET heartbeat_at = NOW() WHERE worker = %s AND status = 'claimed' "
+                            f"AND job_key IN ({', '.join(['%s'] * len(keys))})", [worker, *keys])
+
+    def complete(self, job_dir : str, worker : str, error : str|None=None) -> None:
+        self.execute("UPDATE JobQueue SET status = %s, error = %s, heartbeat_at = NOW() WHERE job_key = %s AND worker = %s",
+                        ("done" if error is None else "failed", error, job_key(job_dir), worker))
+
+    def release_stale(self, timeout : float) -> int:
+        """
+        Return the claimed jobs whose heartbeat is older than timeout seconds to pending; returns the number released
+        """
+        return self.execute("UPDATE JobQueue SET status = 'pending', worker = NULL "
+                            "WHERE status = 'claimed' AND heartbeat_at < NOW() - INTERVAL %s SECOND", (int(timeout),))
+
+    def requeue_failed(self) -> int:
+        """
+        Return the failed jobs to pending (seed skips the jobs already queued, whatever their status); returns the
+        number requeued
+        """
+        self.execute(JOB_QUEUE_TABLE)
+        return self.execute("UPDATE JobQueue SET status = 'pending', worker = NULL, error = NULL WHERE status = 'failed'")
+
+    def counts(self) -> Dict[str,int]:
+        return dict(self.execute("SELECT status, COUNT(*) FROM JobQueue GROUP BY status", fetch=True))
+
+class LockDirJobQueue:
+    def __init__(self, directory : str|Path):
+        """
+        A job queue stored as files in a directory shared by the workers (a local stand-in for DatabaseJobQueue)
+
+        Each job is a file <size>_<key> holding its directory, moved between the pending, claimed, done and failed
+        subdirectories with os.rename, which is atomic: of concurrent claims of a job, exactly one rename succeeds.
+        Names start with the zero-padded size, so pending jobs sorted by name in reverse are largest first.
+        A claimed file is named <size>_<key>@<worker>, so only its owner can complete it, and its mtime is its heartbeat.
+        Seeding creates keys/<key> with O_EXCL first, so concurrent seeders add each job exactly once (failed jobs
+        stay failed until requeue_failed)
+        """
+        self.directory = Path(directory)
+        for status in (*QUEUE_STATUSES, "keys"):
+            (self.directory / status).mkdir(parents=True, exist_ok=True)
+        self.claims : Dict[str,str] = {}
+
+    @staticmethod
+    def file_name(job_dir : str, size : int) -> str:
+        return f"{size:016d}_{job_key(job_dir)}"
+
+    @staticmethod
+    def claimed_name(name : str, worker : str) -> str:
+        return f"{name}@{worker.replace('/', '_')}"
+
+    def add_key(self, key : str) -> bool:
+        """
+        Mark a job as queued, returning False if it already was (by this or any other seeder)
+        """
+        try:
+            os.close(os.open(self.directory / "keys" / key, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            return True
+        except FileExistsError:
+            return False
+
+    def seed(self, job_dirs : List[str]) -> int:
+        queued = set(os.listdir(self.directory / "keys"))
+        added = 0
+        for job_dir in job_dirs:
+            key = job_key(job_dir)
+            if key in queued or not self.add_key(key):
+                continue
+            name = LockDirJobQueue.file_name(job_dir, job_size(job_dir))
+            tmp_file = self.directory / f".{name}.tmp"
+            tmp_file.write_text(job_dir)
+            os.rename(tmp_file, self.directory / "pending" / name)
+            queued.add(key)
+            added += 1
+        return added
+
+    def claim(self, worker : str) -> str|None:
+        """
+        Claim the largest pending job, returning its directory (None once no job is pending). The pending file is
+        touched before it is renamed, as a rename keeps the mtime of the file: the claim starts with a fresh heartbeat,
+        so release_stale never takes it back before its first heartbeat
+        """
+        for name in sorted(os.listdir(self.directory / "pending"), reverse=True):
+            pending_file = self.directory / "pending" / name
+            claimed_file = self.directory / "claimed" / LockDirJobQueue.claimed_name(name, worker)
+            try:
+                os.utime(pending_file)
+                job_dir = pending_file.read_text()
+                os.rename(pending_file, claimed_file)
+            except FileNotFoundError:
+                continue
+            self.claims[job_dir] = name
+            return job_dir
+        return None
+
+    def heartbeat(self, job_dirs : Iterable[str], worker : str) -> None:
+        for job_dir in job_dirs:
+            try:
+                os.utime(self.directory / "claimed" / LockDirJobQueue.claimed_name(self.claims[job_dir], worker))
+            except (KeyError, FileNotFoundError):
+                pass
+
+    def complete(self, job_dir : str, worker : str, error : str|None=None) -> None:
+        """
+        Move the worker's claim of a job to done (or failed); a claim released as stale and claimed by another
+        worker since has another name and is left alone
+        """
+        name = self.claims.pop(job_dir, None)
+        if name is None:
+            return
+        try:
+            os.rename(self.directory / "claimed" / LockDirJobQueue.claimed_name(name, worker),
+                        self.directory / ("done" if error is None else "failed") / name)
+        except FileNotFoundError:
+            pass
+
+    def release_stale(self, timeout : float) -> int:
+        released = 0
+        now = time.time()
+        for claimed_name in os.listdir(self.directory / "claimed"):
+            claimed_file = self.directory / "claimed" / claimed_name
+            try:
+                if now - claimed_file.stat().st_mtime > timeout:
+                    os.rename(claimed_file, self.directory / "pending" / claimed_name.split("@", 1)[0])
+                    released += 1
+            except FileNotFoundError:
+                pass
+        return released
+
+    def requeue_failed(self) -> int:
+        """
+        Return the failed jobs to pending; returns the number requeued
+        """
+        requeued = 0
+        for name in os.listdir(self.directory / "failed"):
+            try:
+                os.rename(self.directory / "failed" / name, self.directory / "pending" / name)
+                requeued += 1
+            except FileNotFoundError:
+                pass
+        return requeued
+
+    def counts(self) -> Dict[str,int]:
+        return {status : len(os.listdir(self.directory / status)) for status in QUEUE_STATUSES}
+
+class QueueWorker:
+    def __init__(self, job_queue : DatabaseJobQueue|LockDirJobQueue, heartbeat_seconds : float=60.0, stale_seconds : float=600.0,
+                    worker : str|None=None):
+        """
+        Claim jobs from a queue one at a time (see jobs), sending the heartbeat of every claimed and unfinished job
+        from a background thread every heartbeat_seconds, and releasing the stale claims of dead workers
+        (older than stale_seconds) whenever the queue looks empty
+
+        Parameters
+        ----------
+        job_queue : DatabaseJobQueue|LockDirJobQueue
+            The queue
+
+        heartbeat_seconds : float
+            The interval between heartbeats, well below stale_seconds
+
+        stale_seconds : float
+            The heartbeat age after which a claim is considered abandoned
+
+        worker : str|None
+            The name of the worker (default <hostname>:<pid>)
+        """
+        self.job_queue = job_queue
+        self.heartbeat_seconds = heartbeat_seconds
+        self.stale_seconds = stale_seconds
+        self.worker = worker or worker_name()
+        self.active : Set[str] = set()
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._beat, daemon=True)
+
+    def _beat(self) -> None:
+        while not self.stopped.wait(self.heartbeat_seconds):
+            with self.lock:
+                active = list(self.active)
+            try:
+                self.job_queue.heartbeat(active, self.worker)
+            except Exception as e:
+                print(f"Heartbeat failed: {e}")
+
+    def jobs(self) -> Iterator[str]:
+        """
+        Yield claimed jobs until none is pending (after releasing stale claims); each must be passed to complete
+        """
+        if not self.thread.is_alive():
+            self.thread.start()
+        while True:
+            job_dir = self.job_queue.claim(self.worker)
+            if job_dir is None and self.job_queue.release_stale(self.stale_seconds) > 0:
+                job_dir = self.job_queue.claim(self.worker)
+            if job_dir is None:
+                return
+            with self.lock:
+                self.active.add(job_dir)
+            yield job_dir
+
+    def complete(self, job_dir : str, error : str|None=None) -> None:
+        self.job_queue.complete(job_dir, self.worker, error)
+        with self.lock:
+            self.active.discard(job_dir)
+
+    def stop(self) -> None:
+        self.stopped.set()
+
+def open_job_queue(job_queue : str, sql_config_name : str|None=None, sql_config_file : str|None=None) -> DatabaseJobQueue|LockDirJobQueue:
+    """
+    "database" for the JobQueue table of the database in the config entry, otherwise the directory of a LockDirJobQueue
+    """
+    if job_queue == "database":
+        from .sql_connection import SQL_Connection
+        return DatabaseJobQueue(SQL_Connection(sql_config_name, sql_config_file, pool_name="job_queue", pool_size=2))
+    return LockDirJobQueue(job_queue)
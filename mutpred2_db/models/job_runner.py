@@ -0,0 +1,166 @@
+from .job_processor import Processor
+from .sql_connection import SQL_Connection, database_errors
+from .bulk_load import TSVStager, load_staged_files
+from .schema import set_foreign_key_checks
+from .instrumentation import JobMetrics, InstrumentedCursor, InstrumentedConnection
+from .memory import peak_rss_mb
+from .errors import JobDataError, PartialCommitError
+from pathlib import Path
+from typing import Dict, Tuple
+import cProfile
+import atexit
+import time
+import os
+
+# Connection and sink of the current process, opened on its first job and reused for the following ones
+_worker_state = {}
+
+def share_worker_resources(sql_connection, cursor, cnx) -> None:
+    """
+    Process the jobs of this process (serial runs) on the caller's pool and connection instead of opening another pool;
+    the caller keeps closing them
+    """
+    _worker_state["shared"] = (sql_connection, cursor, cnx)
+
+def _worker_resources(sql_config_name : str, sql_config_file : str, staging_dir : str|None, load_data : str, workers : int,
+                        parquet_dir : str|None=None, bulk_load : bool=False, table_writers : int=1):
+    if "processor_args" not in _worker_state:
+        if workers > 1:
+            atexit.register(release_worker_resources)
+        sink = None
+        if staging_dir is not None:
+            sink = TSVStager(staging_dir if workers == 1 else Path(staging_dir) / f"worker_{os.getpid()}")
+        elif parquet_dir is not None:
+            from .parquet_sink import ParquetSink
+            sink = ParquetSink(parquet_dir)
+        cursor, cnx = None, None
+        if "shared" in _worker_state:
+            sql_connection, cursor, cnx = _worker_state["shared"]
+            _worker_state["sql_connection"] = sql_connection
+        elif uses_database(staging_dir, load_data, parquet_dir):
+            sql_connection = SQL_Connection(sql_config_name, sql_config_file, allow_local_infile=staging_dir is not None,
+                                            pool_size=table_writers + 1 if table_writers > 1 else None)
+            cursor, cnx = sql_connection.open()
+            if bulk_load:
+                set_foreign_key_checks(cursor, False)
+            _worker_state["sql_connection"] = sql_connection
+        _worker_state["processor_args"] = (cursor, cnx, sink)
+    return _worker_state["processor_args"]
+
+def uses_database(staging_dir : str|None, load_data : str, parquet_dir : str|None) -> bool:
+    if parquet_dir is not None:
+        return False
+    return staging_dir is None or load_data != "none"
+
+def release_worker_resources() -> None:
+    """
+    Close the sink and connection of the current process (registered to run at exit in parallel workers);
+    a connection shared by the caller (see share_worker_resources) is left to it
+    """
+    if "processor_args" not in _worker_state:
+        return
+    cursor, cnx, sink = _worker_state.pop("processor_args")
+    if sink is not None:
+        sink.close()
+    sql_connection = _worker_state.pop("sql_connection", None)
+    if _worker_state.pop("shared", None) is None and sql_connection is not None:
+        sql_connection.close(cnx, cursor)
+
+def ping_worker_connection() -> None:
+    """
+    Reconnect the connection of the current process if the server closed it (long-lived workers outlast wait_timeout)
+    """
+    if "sql_connection" in _worker_state:
+        _, cnx, _ = _worker_state["processor_args"]
+        cnx.ping(reconnect=True, attempts=3, delay=1)
+
+def job_errors() -> tuple:
+    """
+    The errors that fail a single job, recorded as its error, rather than the whole run: database errors, incomplete
+    or inconsistent job output (JobDataError), partially committed jobs (PartialCommitError) and jobs aborted for
+    exceeding max_rss_mb (MemoryError)
+    """
+    return (*database_errors(), JobDataError, PartialCommitError, MemoryError)
+
+def process_job(job_dir : str, sql_config_name : str, sql_config_file : str,
+                staging_dir : str|None=None, load_data : str="job", workers : int=1,
+                parquet_dir : str|None=None, bulk_load : bool=False, instrument : bool=False, profile_dir : str|None=None,
+                **run_option_kwargs) -> Tuple[str,str|None,Dict]:
+    """
+    Process a single job with the connection of the current process
+    (see process_job.process_job_list for the parameters)
+
+    Returns
+    -------
+    Tuple[str,str|None,Dict]
+        The job directory, the error that failed it (see job_errors; None if the job succeeded; other errors are
+        raised with the statistics of the job as their job_stats)
+        and the job statistics: the row counts of each table, the processing time in seconds and the peak RSS
+        of the process in MB
+        (and, with delta_sync, the rows inserted, updated and unchanged per table,
+        for a job partially committed by its table writers, the committed and rolled back tables as partial_commit,
+        and if instrument, the instrumentation.JobMetrics record of the job as metrics)
+    """
+    table_writers = run_option_kwargs.get('table_writers', 1)
+    cursor, cnx, sink = _worker_resources(sql_config_name, sql_config_file, staging_dir, load_data, workers, parquet_dir, bulk_load, table_writers)
+    metrics = None
+    if instrument:
+        metrics = JobMetrics(job_dir)
+        if cursor is not None:
+            cursor, cnx = InstrumentedCursor(cursor, metrics), InstrumentedConnection(cnx, metrics)
+    profiler = cProfile.Profile() if profile_dir is not None else None
+    start = time.perf_counter()
+    rows = {}
+    peak_rss = None
+    error = None
+    job_processor = Processor(cursor, cnx, sink=sink, metrics=metrics, sql_connection=_worker_state.get("sql_connection"), table_writers=table_writers)
+    if profiler is not None:
+        profiler.enable()
+    try:
+        if run_option_kwargs.get('streaming', False):
+            streamed = job_processor.process_streaming(job_dir, write_to_db=True,**run_option_kwargs)
+            rows, peak_rss = streamed['rows'], streamed['peak_rss_mb']
+        else:
+            results = job_processor.process(job_dir, write_to_db=True,**run_option_kwargs)
+            rows = Processor.row_counts(results)
+        if staging_dir is not None and load_data == "job":
+            sink.load(cursor, cnx)
+    except job_errors() as e:
+        error = str(e)
+    except Exception as e:
+        # The run stops on other errors: the statistics (and metrics) of the job travel with the error
+        e.job_stats = job_stats(job_processor, metrics, rows, time.perf_counter() - start, peak_rss, f"{type(e).__name__}: {e}")
+        raise e
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            Path(profile_dir).mkdir(parents=True, exist_ok=True)
+            profiler.dump_stats(Path(profile_dir) / f"{str(job_dir).strip('/').replace('/', '_')}.prof")
+    return job_dir, error, job_stats(job_processor, metrics, rows, time.perf_counter() - start, peak_rss, error)
+
+def job_stats(job_processor : Processor, metrics : JobMetrics|None, rows : Dict[str,int], seconds : float,
+                peak_rss : float|None, error : str|None) -> Dict:
+    """
+    The statistics of a processed job (see process_job), the metrics of the job recording its error
+    """
+    stats = dict(rows=rows, seconds=seconds, peak_rss_mb=peak_rss or peak_rss_mb())
+    if job_processor.delta_sync is not None and error is None:
+        stats['sync'] = job_processor.sync_counts
+    if job_processor.partial_commit is not None:
+        stats['partial_commit'] = job_processor.partial_commit
+    if metrics is not None:
+        metrics.seconds = seconds
+        metrics.error = error
+        stats['metrics'] = metrics.to_dict()
+    return stats
+
+def load_staging_dir(cursor, cnx, staging_dir : str) -> None:
+    """
+    Load the files staged in staging_dir and in the worker_* directories of parallel runs
+    """
+    staging_dirs = [Path(staging_dir), *sorted(Path(staging_dir).glob("worker_*"))]
+    for directory in staging_dirs:
+        if any(directory.glob("*.tsv")):
+            load_staged_files(cursor, cnx, directory)
+            for path in directory.glob("*.tsv"):
+                os.remove(path)
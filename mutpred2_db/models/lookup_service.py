@@ -0,0 +1,367 @@
+from .sql_connection import iter_batches, VARIANT_COLUMNS, MECHANISM_COLUMNS, DEFAULT_BATCH_SIZE
+from .client import LRUCache
+from .mechanism import Mechanism
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Tuple
+from urllib.parse import urlsplit, parse_qs, unquote
+import asyncio
+import json
+import time
+
+import numpy as np
+
+REASONS = {200 : "OK", 400 : "Bad Request", 404 : "Not Found", 405 : "Method Not Allowed", 500 : "Internal Server Error"}
+
+def json_default(value):
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, (bytes, bytearray)):
+        return value.hex()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+class AsyncPool:
+    def __init__(self, sql_connection, size : int=5):
+        """
+        Run blocking queries on pooled connections (SQL_Connection or sqlite_connection.SQLiteConnection)
+        from asyncio, at most size at a time
+        """
+        self.sql_connection = sql_connection
+        self.size = size
+        self.executor = ThreadPoolExecutor(max_workers=size)
+        self.queries = 0
+
+    def _fetchall(self, query : str, params : Tuple) -> List[tuple]:
+        cursor, cnx = self.sql_connection.open()
+        try:
+            cursor.execute(query, params)
+            return cursor.fetchall()
+        finally:
+            self.sql_connection.close(cnx, cursor)
+
+    async def fetchall(self, query : str, params : Tuple=()) -> List[tuple]:
+        self.queries += 1
+        return await asyncio.get_running_loop().run_in_executor(self.executor, self._fetchall, query, tuple(params))
+
+    def close(self) -> None:
+        self.executor.shutdown(wait=False)
+
+class TTLCache(LRUCache):
+    def __init__(self, max_size : int, ttl : float):
+        """
+        A least recently used cache whose entries also expire ttl seconds after they are stored
+        """
+        super().__init__(max_size)
+        self.ttl = ttl
+
+    def get(self, key : Hashable):
+        entry = super().get(key)
+        if entry is None:
+            return None
+        expires, value = entry
+        if expires < time.monotonic():
+            del self.entries[key]
+            self.hits -= 1
+            self.misses += 1
+            return None
+        return value
+
+    def put(self, key : Hashable, value) -> None:
+        super().put(key, (time.monotonic() + self.ttl, value))
+
+class Coalescer:
+    def __init__(self):
+        """
+        Share the result of one in-flight call among concurrent identical requests
+        """
+        self.pending = {}
+        self.coalesced = 0
+
+    async def run(self, key : Hashable, factory : Callable[[], Awaitable]):
+        if key in self.pending:
+            self.coalesced += 1
+        else:
+            future = asyncio.ensure_future(factory())
+            future.add_done_callback(lambda _ : self.pending.pop(key, None))
+            self.pending[key] = future
+        return await asyncio.shield(self.pending[key])
+
+class PointBatcher:
+    def __init__(self, fetch : Callable[[List[str]], Awaitable[Dict[str,Any]]], delay : float=0.002, max_batch : int=DEFAULT_BATCH_SIZE):
+        """
+        Gather the point lookups made within delay seconds (or until max_batch keys are waiting)
+        and resolve them with a single fetch of all their keys
+
+        Parameters
+        ----------
+        fetch : Callable[[List[str]], Awaitable[Dict[str,Any]]]
+            Returns the result of each found key; missing keys resolve to None
+        """
+        self.fetch = fetch
+        self.delay = delay
+        self.max_batch = max_batch
+        self.waiting = {}
+        self.timer = None
+        self.batches = 0
+        self.keys = 0
+
+    async def get(self, key : str):
+        if key not in self.waiting:
+            self.waiting[key] = asyncio.get_running_loop().create_future()
+        future = self.waiting[key]
+        if len(self.waiting) >= self.max_batch:
+            self.flush()
+        elif self.timer is None:
+            self.timer = asyncio.get_running_loop().call_later(self.delay, self.flush)
+        return await future
+
+    def flush(self) -> None:
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        if len(self.waiting) > 0:
+            batch, self.waiting = self.waiting, {}
+            self.batches += 1
+            self.keys += len(batch)
+            asyncio.ensure_future(self._resolve(batch))
+
+    async def _resolve(self, batch : Dict[str,asyncio.Future]) -> None:
+        try:
+            results = await self.fetch(list(batch))
+        except Exception as e:
+            for future in batch.values():
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for key, future in batch.items():
+            if not future.done():
+                future.set_result(results.get(key))
+
+class LatencyStats:
+    def __init__(self, window : int=100000):
+        """
+        The latencies of the last window requests of each route
+        """
+        self.window = window
+        self.latencies = {}
+
+    def record(self, route : str, seconds : float) -> None:
+        self.latencies.setdefault(route, deque(maxlen=self.window)).append(seconds)
+
+    def summary(self) -> Dict[str,Dict[str,float]]:
+        summary = {}
+        for route, latencies in self.latencies.items():
+            p50, p99 = np.percentile(np.asarray(latencies), [50, 99]) * 1000
+            summary[route] = dict(requests=len(latencies), p50_ms=round(float(p50), 3), p99_ms=round(float(p99), 3))
+        return summary
+
+class LookupService:
+    def __init__(self, sql_connection, pool_size : int=5, cache_size : int=10000, cache_ttl : float=300.0,
+                    batch_delay : float=0.002, max_batch : int=DEFAULT_BATCH_SIZE, option_id : int|None=None):
+        """
+        An asyncio HTTP/JSON service for variant, protein and mechanism lookups
+
+        Routes (GET):
+            /variant/<variant_id>
+            /variants?ids=<variant_id>,<variant_id>,...
+            /protein/<seq_hash>
+            /mechanisms/<variant_id>[?max_pvalue=<p>]
+            /stats
+
+        Concurrent point lookups (/variant, /mechanisms) are batched into single IN (...) queries, concurrent identical
+        requests share one in-flight lookup, and responses are kept in a TTL/LRU cache. /stats reports the p50/p99
+        latency of each route, the cache and the batching
+
+        Parameters
+        ----------
+        sql_connection
+            SQL_Connection (whose pool_size should be at least pool_size) or sqlite_connection.SQLiteConnection
+
+        pool_size : int
+            The number of queries run concurrently
+
+        cache_size, cache_ttl : int, float
+            The number of responses cached and the seconds they stay valid; cache_size=0 disables the cache
+
+        batch_delay : float
+            The seconds point lookups wait to be batched with concurrent ones
+
+        max_batch : int
+            The maximum number of keys per query
+
+        option_id : int|None
+            If given, only return variants computed with this run option
+        """
+        self.pool = AsyncPool(sql_connection, pool_size)
+        self.cache = TTLCache(cache_size, cache_ttl)
+        self.coalescer = Coalescer()
+        self.variant_batcher = PointBatcher(self.fetch_variants, batch_delay, max_batch)
+        self.mechanism_batcher = PointBatcher(self.fetch_mechanisms, batch_delay, max_batch)
+        self.latency = LatencyStats()
+        self.max_batch = max_batch
+        self.option_id = option_id
+        self.routes = {"variant" : self.variant,
+                        "variants" : self.variants,
+                        "protein" : self.protein,
+                        "mechanisms" : self.mechanisms}
+
+    def option_filter(self) -> Tuple[str,Tuple]:
+        return ("", ()) if self.option_id is None else ("option_id = %s AND ", (self.option_id,))
+
+    async def fetch_variants(self, variant_ids : List[str]) -> Dict[str,Dict]:
+        condition, params = self.option_filter()
+        chunks = list(iter_batches(variant_ids, self.max_batch))
+        results = await asyncio.gather(*(self.pool.fetchall(f"SELECT {', '.join(VARIANT_COLUMNS)} FROM Variant "
+                                                                f"WHERE {condition}variant_id IN ({', '.join(['%s'] * len(chunk))})",
+                                                            (*params, *chunk)) for chunk in chunks))
+        return {row[0] : dict(zip(VARIANT_COLUMNS, row)) for rows in results for row in rows}
+
+    async def fetch_mechanisms(self, variant_ids : List[str]) -> Dict[str,List[Dict]]:
+        rows = await self.pool.fetchall(f"SELECT {', '.join(MECHANISM_COLUMNS)} FROM VariantMechanism "
+                                        f"WHERE variant_id IN ({', '.join(['%s'] * len(variant_ids))})", variant_ids)
+        mechanisms = {}
+        for row in rows:
+            mechanism = dict(zip(MECHANISM_COLUMNS, row))
+            mechanism['name'] = Mechanism.mechanism_order[mechanism['mechanism_id']]
+            mechanisms.setdefault(row[0], []).append(mechanism)
+        return mechanisms
+
+    async def variant(self, key : str, query : Dict[str,List[str]]) -> Tuple[int,Any]:
+        variant = await self.variant_batcher.get(key)
+        return (404, dict(error=f"Unknown variant {key}")) if variant is None else (200, variant)
+
+    async def variants(self, key : str, query : Dict[str,List[str]]) -> Tuple[int,Any]:
+        ids = [variant_id for ids in query.get("ids", []) for variant_id in ids.split(",") if variant_id]
+        if len(ids) == 0:
+            return 400, dict(error="ids is required")
+        found = await self.fetch_variants(list(dict.fromkeys(ids)))
+        return 200, dict(variants=[found[variant_id] for variant_id in dict.fromkeys(ids) if variant_id in found],
+                            missing=[variant_id for variant_id in dict.fromkeys(ids) if variant_id not in found])
+
+    async def protein(self, key : str, query : Dict[str,List[str]]) -> Tuple[int,Any]:
+        condition, params = self.option_filter()
+        rows = await self.pool.fetchall(f"SELECT {', '.join(VARIANT_COLUMNS)} FROM Variant WHERE {condition}seq_hash = %s",
+                                        (*params, key))
+        if len(rows) == 0:
+            return 404, dict(error=f"No variants for protein {key}")
+        return 200, dict(seq_hash=key, variants=[dict(zip(VARIANT_COLUMNS, row)) for row in rows])
+
+    async def mechanisms(self, key : str, query : Dict[str,List[str]]) -> Tuple[int,Any]:
+        mechanisms = await self.mechanism_batcher.get(key) or []
+        if "max_pvalue" in query:
+            max_pvalue = float(query["max_pvalue"][0])
+            mechanisms = [mechanism for mechanism in mechanisms if float(mechanism['pvalue']) <= max_pvalue]
+        return 200, dict(variant_id=key, mechanisms=mechanisms)
+
+    def stats(self) -> Dict:
+        return dict(latency=self.latency.summary(),
+                    cache=self.cache.stats(),
+                    coalesced=self.coalescer.coalesced,
+                    queries=self.pool.queries,
+                    batches={name : dict(batches=batcher.batches, keys=batcher.keys)
+                                for name, batcher in (("variant", self.variant_batcher), ("mechanisms", self.mechanism_batcher))})
+
+    async def handle(self, method : str, target : str) -> Tuple[str,int,Any]:
+        """
+        The route, status and JSON body of a request
+        """
+        url = urlsplit(target)
+        parts = [unquote(part) for part in url.path.split("/") if part]
+        route = parts[0] if len(parts) > 0 else ""
+        if method != "GET":
+            return route, 405, dict(error=f"{method} is not supported")
+        if route == "stats":
+            return route, 200, self.stats()
+        if route not in self.routes or len(parts) != (1 if route == "variants" else 2):
+            return route, 404, dict(error=f"Unknown route {url.path}")
+        query = parse_qs(url.query)
+        cache_key = (url.path, tuple(sorted((k, tuple(v)) for k, v in query.items())))
+        response = self.cache.get(cache_key)
+        if response is None:
+            try:
+                response = await self.coalescer.run(cache_key, lambda: self.routes[route](parts[-1], query))
+            except ValueError as e:
+                return route, 400, dict(error=str(e))
+            if response[0] == 200:
+                self.cache.put(cache_key, response)
+        return route, *response
+
+    async def handle_connection(self, reader : asyncio.StreamReader, writer : asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, target, version = request_line.decode('latin-1').split()
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode('latin-1').partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                if int(headers.get("content-length", 0)) > 0:
+                    await reader.readexactly(int(headers["content-length"]))
+                start = time.perf_counter()
+                try:
+                    route, status, body = await self.handle(method, target)
+                except Exception as e:
+                    route, status, body = "error", 500, dict(error=repr(e))
+                payload = json.dumps(body, default=json_default).encode('utf-8')
+                keep_alive = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+                writer.write((f"HTTP/1.1 {status} {REASONS[status]}\r\n"
+                                "Content-Type: application/json\r\n"
+                                f"Content-Length: {len(payload)}\r\n"
+                                f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n").encode('latin-1') + payload)
+                await writer.drain()
+                self.latency.record(route, time.perf_counter() - start)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host : str="127.0.0.1", port : int=8080) -> None:
+        server = await asyncio.start_server(self.handle_connection, host, port)
+        print(f"Serving MutPred2 lookups on http://{host}:{port}")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            self.pool.close()
+
+async def request_latencies(host : str, port : int, paths : List[str], concurrency : int=32) -> np.ndarray:
+    """
+    GET every path from a running service over concurrency keep-alive connections and return the latency of each request
+    """
+    queue = asyncio.Queue()
+    for path in paths:
+        queue.put_nowait(path)
+    latencies = []
+    async def client() -> None:
+        reader, writer = await asyncio.open_connection(host, port)
+        try:
+            while not queue.empty():
+                path = queue.get_nowait()
+                start = time.perf_counter()
+                writer.write(f"GET {path} HTTP/1.1\r\nHost: {host}\r\n\r\n".encode('latin-1'))
+                await writer.drain()
+                length = 0
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b""):
+                        break
+                    name, _, value = line.decode('latin-1').partition(":")
+                    if name.lower() == "content-length":
+                        length = int(value)
+                await reader.readexactly(length)
+                latencies.append(time.perf_counter() - start)
+        finally:
+            writer.close()
+    await asyncio.gather(*(client() for _ in range(min(concurrency, len(paths)))))
+    return np.asarray(latencies)
@@ -1,5 +1,4 @@
 import typing
-import pandas as pd
 import numpy as np
 
 class Mechanism:
@@ -58,6 +57,8 @@ class Mechanism:
     def process_alterred_position(self, altered_position : int) -> None:
         if Mechanism.mechanism_order[self.mechanism_id] in Mechanism.no_region_set:
             self.position = None
+        elif altered_position is None or not np.isfinite(altered_position):
+            self.position = None
         else:
             self.position = int(altered_position)
 
@@ -72,4 +73,5 @@ class Mechanism:
 
     def to_series(self):
         d = self.to_dict()
+        import pandas as pd
         return pd.Series(d)
@@ -0,0 +1,174 @@
+from .mechanism import Mechanism
+
+from typing import TYPE_CHECKING, Dict, Iterable, Iterator
+import numpy as np
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+# Per mechanism slot masks, in Mechanism.mechanism_order
+ALTERED_MASK = np.array([mechanism in Mechanism.altered_set for mechanism in Mechanism.mechanism_order])
+NO_REGION_MASK = np.array([mechanism in Mechanism.no_region_set for mechanism in Mechanism.mechanism_order])
+N_MECHANISMS = len(Mechanism.mechanism_order)
+
+def motif_description(motif) -> str|None:
+    if isinstance(motif, np.ndarray):
+        return motif.item() if motif.size > 0 else None
+    return motif
+
+class MechanismBlock:
+    row_chunk_size = 4096
+    # altered_position of the rows without a position (no region mechanisms, or a non-finite MutPred2 position), stored as NULL
+    NO_POSITION = -1
+
+    def __init__(self, variant_ids : np.ndarray,
+                        variant_index : np.ndarray,
+                        mechanism_id : np.ndarray,
+                        is_loss : np.ndarray,
+                        altered_position : np.ndarray,
+                        score : np.ndarray,
+                        pvalue : np.ndarray,
+                        descriptions : np.ndarray):
+        """
+        The VariantMechanism rows of a job, stored as flat columns
+
+        Parameters
+        ----------
+        variant_ids : np.ndarray
+            The variant_id of each variant of the job
+
+        variant_index : np.ndarray
+            The index into variant_ids of each row
+
+        mechanism_id : np.ndarray
+            The index into Mechanism.mechanism_order of each row
+
+        is_loss : np.ndarray
+            Whether the mechanism is lost (otherwise gained) for mechanisms that are not altered
+
+        altered_position : np.ndarray
+            The altered position, NO_POSITION for mechanisms in Mechanism.no_region_set and missing positions
+
+        score, pvalue : np.ndarray
+            The posterior and p-value of each row
+
+        descriptions : np.ndarray
+            The motif description of each variant, used for the Motifs rows
+        """
+        self.variant_ids = variant_ids
+        self.variant_index = variant_index
+        self.mechanism_id = mechanism_id
+        self.is_loss = is_loss
+        self.altered_position = altered_position
+        self.score = score
+        self.pvalue = pvalue
+        self.descriptions = descriptions
+
+    @staticmethod
+    def from_mechanism_info(mechanism_info : Dict[str,np.ndarray], variant_ids : Iterable[str], max_pvalue : float|None=None) -> "MechanismBlock":
+        """
+        Build the mechanism rows of a job from the stacked MutPred2 mechanism arrays
+
+        Parameters
+        ----------
+        mechanism_info : Dict[str,np.ndarray]
+            positions_pu, pvals_pu, scores_pu and prop_types_pu (n_variants, n_mechanisms) arrays and the
+            motif_info (n_variants,) array, as returned by Processor.read_mechanism_info
+
+        variant_ids : Iterable[str]
+            The variant_id of each row of the arrays
+
+        max_pvalue : float|None
+            If given, only keep mechanisms with a p-value at or below it
+
+        Returns
+        -------
+        MechanismBlock
+        """
+        variant_ids = np.asarray(variant_ids)
+        n = len(variant_ids)
+        pvalue = np.asarray(mechanism_info['pvals_pu'][:n, :N_MECHANISMS], dtype=float).ravel()
+        keep = np.ones(pvalue.shape, dtype=bool) if max_pvalue is None else pvalue <= max_pvalue
+        variant_index, mechanism_id = np.divmod(np.flatnonzero(keep), N_MECHANISMS)
+        position = np.asarray(mechanism_info['positions_pu'][:n, :N_MECHANISMS], dtype=float).ravel()[keep]
+        no_position = NO_REGION_MASK[mechanism_id] | ~np.isfinite(position)
+        return MechanismBlock(variant_ids,
+                                variant_index,
+                                mechanism_id,
+                                (np.asarray(mechanism_info['prop_types_pu'][:n, :N_MECHANISMS]).ravel()[keep] == 1),
+                                np.where(no_position, MechanismBlock.NO_POSITION, position).astype(np.int64),
+                                np.asarray(mechanism_info['scores_pu'][:n, :N_MECHANISMS], dtype=float).ravel()[keep],
+                                pvalue[keep],
+                                np.array([motif_description(motif) for motif in mechanism_info['motif_info'][:n]], dtype=object))
+
+    def __len__(self) -> int:
+        return len(self.mechanism_id)
+
+    @property
+    def mechanism_type(self) -> np.ndarray:
+        return np.where(ALTERED_MASK[self.mechanism_id], 'altered', np.where(self.is_loss, 'loss', 'gain'))
+
+    @property
+    def description(self) -> np.ndarray:
+        description = np.full(len(self), None, dtype=object)
+        is_motif = self.mechanism_id == Mechanism.motif_index
+        description[is_motif] = self.descriptions[self.variant_index[is_motif]]
+        return description
+
+    @property
+    def has_position(self) -> np.ndarray:
+        return self.altered_position != MechanismBlock.NO_POSITION
+
+    @property
+    def position(self) -> np.ndarray:
+        position = self.altered_position.astype(object)
+        position[~self.has_position] = None
+        return position
+
+    def to_arrays(self) -> Dict[str,np.ndarray]:
+        return dict(variant_id=self.variant_ids[self.variant_index],
+                    mechanism_id=self.mechanism_id,
+                    mechanism_type=self.mechanism_type,
+                    altered_position=self.position,
+                    score=self.score,
+                    pvalue=self.pvalue,
+                    description=self.description)
+
+    def to_frame(self) -> "pd.DataFrame":
+        import pandas as pd
+        return pd.DataFrame(self.to_arrays())
+
+    def rows(self) -> Iterator[tuple]:
+        """
+        Yield rows in sql_connection.MECHANISM_COLUMNS order, a chunk at a time
+        """
+        for start in range(0, len(self), self.row_chunk_size):
+            chunk = slice(start, start + self.row_chunk_size)
+            arrays = self[chunk].to_arrays()
+            yield from zip(arrays['variant_id'].tolist(),
+                            arrays['mechanism_id'].tolist(),
+                            arrays['mechanism_type'].tolist(),
+                            arrays['altered_position'].tolist(),
+                            arrays['score'].tolist(),
+                            arrays['pvalue'].tolist(),
+                            arrays['description'].tolist())
+
+    def __getitem__(self, index : slice|np.ndarray) -> "MechanismBlock":
+        return MechanismBlock(self.variant_ids,
+                                self.variant_index[index],
+                                self.mechanism_id[index],
+                                self.is_loss[index],
+                                self.altered_position[index],
+                                self.score[index],
+                                self.pvalue[index],
+                                self.descriptions)
+
+    def __iter__(self) -> Iterator[Mechanism]:
+        for variant_id, mechanism_id, is_loss, position, score, pvalue, description in zip(self.variant_ids[self.variant_index].tolist(),
+                                                                                            self.mechanism_id.tolist(),
+                                                                                            self.is_loss.tolist(),
+                                                                                            self.position.tolist(),
+                                                                                            self.score.tolist(),
+                                                                                            self.pvalue.tolist(),
+                                                                                            self.description.tolist()):
+            yield Mechanism(mechanism_id, variant_id, position, pvalue, score, 1 if is_loss else 0, description)
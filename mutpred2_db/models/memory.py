@@ -0,0 +1,18 @@
+import resource
+import os
+
+def current_rss_mb() -> float:
+    """
+    The resident set size of this process in MB (the peak RSS where /proc is not available)
+    """
+    try:
+        with open("/proc/self/statm") as file:
+            return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError):
+        return peak_rss_mb()
+
+def peak_rss_mb() -> float:
+    """
+    The peak resident set size of this process in MB
+    """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2**10
@@ -0,0 +1,183 @@
+from .sql_connection import iter_rows
+from typing import Iterable, List, Sequence as SequenceType
+from pathlib import Path
+import os
+
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+# Arrow type of every non-feature column; feature columns are float64
+COLUMN_TYPES = {"seq_hash" : pa.string(),
+                "sequence" : pa.string(),
+                "variant_id" : pa.string(),
+                "reference_aa" : pa.string(),
+                "position" : pa.int64(),
+                "alternate_aa" : pa.string(),
+                "score" : pa.float64(),
+                "option_id" : pa.int64(),
+                "runoption_id" : pa.int64(),
+                "mechanism_id" : pa.int64(),
+                "mechanism_type" : pa.string(),
+                "altered_position" : pa.int64(),
+                "pvalue" : pa.float64(),
+                "description" : pa.string(),
+                "dtype" : pa.string(),
+                "site_mask" : pa.binary(),
+                "features" : pa.binary()}
+
+def table_schema(columns : SequenceType[str]) -> pa.Schema:
+    return pa.schema([(column, COLUMN_TYPES.get(column, pa.float64())) for column in columns])
+
+def to_arrow(columns : SequenceType[str], rows) -> pa.Table:
+    schema = table_schema(columns)
+    if hasattr(rows, "to_arrays"):
+        arrays = rows.to_arrays()
+        return pa.table([pa.array(arrays[column], type=schema.field(column).type) for column in columns], schema=schema)
+    values = list(zip(*iter_rows(rows)))
+    if len(values) == 0:
+        return schema.empty_table()
+    return pa.table([pa.array(column, type=field.type) for column, field in zip(values, schema)], schema=schema)
+
+class ParquetSink:
+    def __init__(self, root : str|Path, prefix_length : int=2, compression : str="zstd", row_group_size : int=65536):
+        """
+        Write the tables of each job to a Parquet dataset instead of the database
+
+        Each job is written to <root>/<table>/seq_prefix=<seq_hash[:prefix_length]>/<seq_hash>_<option_id>.parquet
+        (hive partitioned by seq_hash prefix), so the jobs of a protein run with different options are kept apart; the Protein
+        table, the same for every option, is written to <seq_hash>.parquet. Files are written to a temporary name and renamed
+        once the job ends, so a crashed job leaves no partial file and re-running a job replaces its files.
+        Rows are written as they come, in row groups of at most row_group_size rows, once the Protein and Variant rows
+        of the job named its files (rows of other tables are held until then), so a job processed one shard at a time
+        (Processor.process_streaming) is not held in memory
+
+        Parameters
+        ----------
+        root : str|Path
+            The dataset directory
+
+        prefix_length : int
+            The number of seq_hash characters used as partition key (16**prefix_length partitions)
+
+        compression : str
+            The Parquet compression codec
+
+        row_group_size : int
+            The maximum number of rows per row group
+        """
+        self.root = Path(root)
+        self.prefix_length = prefix_length
+        self.compression = compression
+        self.row_group_size = row_group_size
+        self.tables = {}
+        self.writers = {}
+        self.seq_hash = None
+        self.option_id = None
+
+    def begin_job(self) -> None:
+        self.tables = {}
+        self.writers = {}
+        self.seq_hash = None
+        self.option_id = None
+
+    def write_rows(self, table : str, columns : SequenceType[str], rows : Iterable[tuple], **kwargs) -> int:
+        arrow_table = to_arrow(columns, rows)
+        if table == "Protein" and arrow_table.num_rows > 0:
+            self.seq_hash = arrow_table.column("seq_hash")[0].as_py()
+        if table == "Variant" and arrow_table.num_rows > 0:
+            self.option_id = arrow_table.column("option_id")[0].as_py()
+        self.tables.setdefault(table, []).append(arrow_table)
+        for held_table in list(self.tables):
+            if self.seq_hash is not None and (held_table == "Protein" or self.option_id is not None):
+                self.flush(held_table)
+        return arrow_table.num_rows
+
+    def tmp_path(self, path : Path) -> Path:
+        return path.parent / f".{path.name}.{os.getpid()}.tmp"
+
+    def flush(self, table : str) -> None:
+        """
+        Write the rows held for a table to its temporary file, opening its writer on the first rows
+        """
+        parts = self.tables.pop(table, [])
+        if table not in self.writers:
+            path = self.path(table, self.seq_hash, None if table == "Protein" else self.option_id)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            self.writers[table] = (pq.ParquetWriter(self.tmp_path(path), parts[0].schema, compression=self.compression), path)
+        writer, _ = self.writers[table]
+        for part in parts:
+            if part.num_rows > 0:
+                writer.write_table(part, row_group_size=self.row_group_size)
+
+    def path(self, table : str, seq_hash : str, option_id : int|None=None) -> Path:
+        name = seq_hash if option_id is None else f"{seq_hash}_{option_id}"
+        return self.root / table / f"seq_prefix={seq_hash[:self.prefix_length]}" / f"{name}.parquet"
+
+    def end_job(self) -> None:
+        if self.seq_hash is None:
+            raise ValueError("The Protein row of the job must be written before its other tables")
+        if self.option_id is None and any(table != "Protein" for table in self.tables):
+            raise ValueError("The Variant rows of the job must be written before its other tables")
+        for table in list(self.tables):
+            self.flush(table)
+        for writer, path in self.writers.values():
+            writer.close()
+            os.replace(self.tmp_path(path), path)
+        self.begin_job()
+
+    def abort_job(self) -> None:
+        for writer, path in self.writers.values():
+            writer.close()
+            self.tmp_path(path).unlink(missing_ok=True)
+        self.begin_job()
+
+    def close(self) -> None:
+        self.abort_job()
+
+def read_parquet_table(root : str|Path, table : str, columns : List[str]|None=None, seq_hashes : Iterable[str]|None=None,
+                        option_ids : Iterable[int]|None=None, prefix_length : int=2) -> pa.Table:
+    """
+    Read a table of a dataset written by ParquetSink, optionally restricted to columns and proteins
+
+    Parameters
+    ----------
+    root : str|Path
+        The dataset directory
+
+    table : str
+        The table to read, e.g. 'Variant' or 'features_pssm'
+
+    columns : List[str]|None
+        The columns to read (default: all)
+
+    seq_hashes : Iterable[str]|None
+        Only read the files of these proteins
+
+    option_ids : Iterable[int]|None
+        With seq_hashes, only read the files of these run options (default: all)
+
+    prefix_length : int
+        The prefix_length the dataset was written with
+
+    Returns
+    -------
+    pa.Table
+        Call .to_pandas() for a DataFrame
+    """
+    table_dir = Path(root) / table
+    if seq_hashes is not None:
+        sink = ParquetSink(root, prefix_length=prefix_length)
+        if table == "Protein":
+            paths = [sink.path(table, seq_hash) for seq_hash in seq_hashes]
+        elif option_ids is not None:
+            paths = [sink.path(table, seq_hash, option_id) for seq_hash in seq_hashes for option_id in option_ids]
+        else:
+            paths = [path for seq_hash in seq_hashes for path in sorted(sink.path(table, seq_hash).parent.glob(f"{seq_hash}_*.parquet"))]
+        paths = [str(path) for path in paths if path.exists()]
+        if len(paths) == 0:
+            return pa.schema([]).empty_table() if columns is None else table_schema(columns).empty_table()
+        dataset = ds.dataset(paths, format="parquet", partitioning="hive", partition_base_dir=str(table_dir))
+    else:
+        dataset = ds.dataset(table_dir, format="parquet", partitioning="hive")
+    return dataset.to_table(columns=columns)
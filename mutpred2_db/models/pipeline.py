@@ -0,0 +1,250 @@
+from .job_processor import Processor
+from .sql_connection import SQL_Connection
+from .job_runner import job_errors
+from .schema import set_foreign_key_checks
+from .instrumentation import JobMetrics, InstrumentedCursor, InstrumentedConnection
+from .memory import peak_rss_mb
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from typing import Dict, Iterable, Iterator, Tuple
+import threading
+import queue
+import time
+
+class StageCounter:
+    def __init__(self, name : str):
+        """
+        Throughput of one pipeline stage
+
+        busy is the time spent doing the stage's work, blocked the time spent waiting on the other stage
+        (a reader blocked on a full queue means the writers are the bottleneck, a writer blocked on an
+        empty queue means the readers are)
+        """
+        self.name = name
+        self.jobs = 0
+        self.rows = 0
+        self.busy = 0.0
+        self.blocked = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, jobs : int=0, rows : int=0, busy : float=0.0, blocked : float=0.0) -> None:
+        with self._lock:
+            self.jobs += jobs
+            self.rows += rows
+            self.busy += busy
+            self.blocked += blocked
+
+    def summary(self) -> str:
+        rate = self.rows / self.busy if self.busy > 0 else 0.0
+        return (f"{self.name}: {self.jobs} jobs, {self.rows} rows, {self.busy:.1f}s busy ({rate:.0f} rows/s), "
+                f"{self.blocked:.1f}s blocked")
+
+def count_rows(results : Dict) -> int:
+    return sum(Processor.row_counts(results).values())
+
+def parse_job(job_dir : str, instrument : bool=False, **kwargs) -> Tuple[str,Dict,float,Dict|None]:
+    """
+    Parse a job, returning it with the parsing time and, if instrument, the JobMetrics record of its parsing stages
+    """
+    metrics = JobMetrics(job_dir) if instrument else None
+    start = time.perf_counter()
+    results = Processor(None, None, metrics=metrics).parse(job_dir, **kwargs)
+    return job_dir, results, time.perf_counter() - start, None if metrics is None else metrics.to_dict()
+
+class JobPipeline:
+    _DONE = object()
+    _FED = object()
+    MAX_WRITERS = 4
+    # Interval at which the reader and the writers blocked on the write queue check whether another stage failed
+    POLL_SECONDS = 0.5
+
+    def __init__(self, sql_connection : SQL_Connection, readers : int=2, writers : int=1, queue_depth : int=4, **kwargs):
+        """
+        Bounded producer/consumer pipeline: reader processes decode the .mat files of upcoming jobs
+        while writer threads write already parsed jobs, each on its own connection from the pool
+
+        Parameters
+        ----------
+        sql_connection : SQL_Connection
+            The pool writer connections are taken from (each writer holds one connection)
+
+        readers : int
+            The number of processes parsing jobs
+
+        writers : int
+            The number of threads writing jobs, at most MAX_WRITERS; with the connection of the caller, the pool
+            must hold writers * (1 + table_writers, if table_writers > 1) + 1 connections
+
+        queue_depth : int
+            The number of parsed jobs held in memory waiting to be written; readers stop once it is reached
+
+        kwargs
+            Run options and optional arguments of Processor.process
+        """
+        if writers < 1 or writers > JobPipeline.MAX_WRITERS:
+            raise ValueError(f"writers must be between 1 and {JobPipeline.MAX_WRITERS}, not {writers}")
+        pool_size = getattr(sql_connection, 'pool_size', None)
+        if pool_size is not None and pool_size < JobPipeline.connections(writers, kwargs.get('table_writers', 1)):
+            raise ValueError(f"{writers} writers need a pool of {JobPipeline.connections(writers, kwargs.get('table_writers', 1))} "
+                                f"connections, not {pool_size}")
+        self.sql_connection = sql_connection
+        self.readers = readers
+        self.writers = writers
+        self.queue_depth = queue_depth
+        self.kwargs = kwargs
+        self.parse_counter = StageCounter("parse")
+        self.write_counter = StageCounter("write")
+        self.write_queue = queue.Queue(maxsize=queue_depth)
+        self.done_queue = queue.Queue()
+        self.error = None
+
+    @staticmethod
+    def connections(writers : int, table_writers : int=1) -> int:
+        """
+        The pool size a pipeline needs: the connection of each writer and of its table writers, and the caller's
+        """
+        return 1 + writers * (1 + table_writers if table_writers > 1 else 1)
+
+    def _put(self, item) -> bool:
+        """
+        Put an item on the write queue, giving up (returning False) once a stage failed, as the writers may be gone
+        """
+        while self.error is None:
+            try:
+                self.write_queue.put(item, timeout=JobPipeline.POLL_SECONDS)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _get(self):
+        """
+        The next item of the write queue, or None once a stage failed
+        """
+        while self.error is None:
+            try:
+                return self.write_queue.get(timeout=JobPipeline.POLL_SECONDS)
+            except queue.Empty:
+                pass
+        return None
+
+    def _feed(self, job_list : Iterable[str]) -> None:
+        try:
+            with ProcessPoolExecutor(self.readers) as executor:
+                jobs = iter(job_list)
+                pending = {}
+                n_jobs = 0
+                def submit():
+                    nonlocal n_jobs
+                    for job in jobs:
+                        pending[executor.submit(parse_job, job, **self.kwargs)] = job
+                        n_jobs += 1
+                        return
+                for _ in range(self.readers):
+                    submit()
+                while pending and self.error is None:
+                    done, _ = wait(list(pending), return_when=FIRST_COMPLETED)
+                    for future in done:
+                        job = pending.pop(future)
+                        try:
+                            job_dir, results, busy, parse_metrics = future.result()
+                        except job_errors() as e:
+                            self.done_queue.put((job, str(e), dict(rows={}, seconds=0.0, peak_rss_mb=peak_rss_mb())))
+                            submit()
+                            continue
+                        self.parse_counter.add(jobs=1, rows=count_rows(results), busy=busy)
+                        start = time.perf_counter()
+                        if not self._put((job_dir, results, parse_metrics)):
+                            break
+                        self.parse_counter.add(blocked=time.perf_counter() - start)
+                        submit()
+                if self.error is not None:
+                    executor.shutdown(cancel_futures=True)
+                    return
+            self.done_queue.put((JobPipeline._FED, n_jobs))
+        except Exception as e:
+            self.error = e
+            self.done_queue.put(JobPipeline._DONE)
+        finally:
+            for _ in range(self.writers):
+                self._put(None)
+
+    def _write(self) -> None:
+        cursor, cnx = self.sql_connection.open()
+        if self.kwargs.get('bulk_load', False):
+            set_foreign_key_checks(cursor, False)
+        if self.kwargs.get('instrument', False):
+            cursor, cnx = InstrumentedCursor(cursor, None), InstrumentedConnection(cnx, None)
+        processor = Processor(cursor, cnx, sql_connection=self.sql_connection, **self.kwargs)
+        try:
+            while True:
+                start = time.perf_counter()
+                item = self._get()
+                self.write_counter.add(blocked=time.perf_counter() - start)
+                if item is None:
+                    break
+                job_dir, results, parse_metrics = item
+                if parse_metrics is not None:
+                    processor.metrics = cursor.metrics = cnx.metrics = JobMetrics.from_dict(parse_metrics)
+                start = time.perf_counter()
+                error = None
+                try:
+                    processor.write_job(results)
+                except job_errors() as e:
+                    error = str(e)
+                except Exception as e:
+                    e.job_stats = self.job_stats(processor, results, time.perf_counter() - start, f"{type(e).__name__}: {e}")
+                    raise e
+                seconds = time.perf_counter() - start
+                self.write_counter.add(jobs=1, rows=count_rows(results) if error is None else 0, busy=seconds)
+                self.done_queue.put((job_dir, error, self.job_stats(processor, results, seconds, error)))
+        except Exception as e:
+            self.error = e
+            self.done_queue.put(JobPipeline._DONE)
+        finally:
+            self.sql_connection.close(cnx, cursor)
+
+    @staticmethod
+    def job_stats(processor : Processor, results : Dict, seconds : float, error : str|None) -> Dict:
+        """
+        The statistics of a written job (see run), the metrics of the job recording its error. A job whose write
+        failed was rolled back, so it reports no rows and no sync counts (as job_runner.job_stats)
+        """
+        stats = dict(rows=Processor.row_counts(results) if error is None else {}, seconds=seconds, peak_rss_mb=peak_rss_mb())
+        if processor.delta_sync is not None and error is None:
+            stats['sync'] = processor.sync_counts
+        if processor.partial_commit is not None:
+            stats['partial_commit'] = processor.partial_commit
+        if processor.metrics is not None:
+            processor.metrics.seconds += seconds
+            processor.metrics.error = error
+            stats['metrics'] = processor.metrics.to_dict()
+        return stats
+
+    def run(self, job_list : Iterable[str]) -> Iterator[Tuple[str,str|None,Dict]]:
+        """
+        Process the jobs, yielding (job directory, error or None, job statistics) as each job is written or fails
+        (see job_runner.job_errors; a job that cannot be parsed is yielded with its error and no rows)
+        The statistics hold the row counts of each table, the write time in seconds and the peak RSS in MB.
+        An error that is not a job error stops the run and is raised with the statistics of its job as job_stats
+
+        job_list may be any iterable (e.g. the jobs claimed from a job_queue), consumed as readers become free
+        """
+        threads = [threading.Thread(target=self._feed, args=(job_list,), daemon=True)]
+        threads += [threading.Thread(target=self._write, daemon=True) for _ in range(self.writers)]
+        for thread in threads:
+            thread.start()
+        n_jobs, n_done = None, 0
+        while n_jobs is None or n_done < n_jobs:
+            item = self.done_queue.get()
+            if item is JobPipeline._DONE:
+                raise self.error
+            if item[0] is JobPipeline._FED:
+                n_jobs = item[1]
+                continue
+            n_done += 1
+            yield item
+        for thread in threads:
+            thread.join()
+
+    def summary(self) -> str:
+        return "\n".join([self.parse_counter.summary(), self.write_counter.summary()])
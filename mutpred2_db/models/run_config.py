@@ -0,0 +1,122 @@
+import inspect
+
+class PipelineConfig:
+    def __init__(self, readers : int=2, writers : int=1, queue_depth : int=4):
+        """
+        Options of process_job_list --pipeline (see pipeline.JobPipeline)
+
+        Parameters
+        ----------
+        readers : int
+            The number of processes decoding upcoming jobs
+
+        writers : int
+            The number of threads writing parsed jobs, each holding a connection (at most JobPipeline.MAX_WRITERS)
+
+        queue_depth : int
+            The number of parsed jobs waiting to be written at most
+        """
+        self.readers = readers
+        self.writers = writers
+        self.queue_depth = queue_depth
+
+class ManifestConfig:
+    def __init__(self, path : str, retry_failed_only : bool=False):
+        """
+        Options of process_job_list --manifest (see job_manifest.JobManifest)
+
+        Parameters
+        ----------
+        path : str
+            The LMDB directory of the manifest
+
+        retry_failed_only : bool
+            Only process the jobs recorded as failed in the manifest
+        """
+        self.path = path
+        self.retry_failed_only = retry_failed_only
+
+class BulkLoadConfig:
+    def __init__(self, compress_features : bool=False):
+        """
+        Options of process_job_list --bulk_load (see schema.begin_bulk_load)
+
+        Parameters
+        ----------
+        compress_features : bool
+            Rebuild the features_* tables with ROW_FORMAT=COMPRESSED before loading
+        """
+        self.compress_features = compress_features
+
+class InstrumentationConfig:
+    def __init__(self, metrics_log : str|None=None, prometheus_file : str|None=None, profile_dir : str|None=None,
+                    slowest_jobs : int=10):
+        """
+        Options of process_job_list --instrument (see instrumentation.Instrumentation)
+
+        Parameters
+        ----------
+        metrics_log : str|None
+            The JSON-lines file one JobMetrics record per job is appended to
+
+        prometheus_file : str|None
+            The Prometheus text-format file holding the totals, rewritten after every job
+
+        profile_dir : str|None
+            Run each job under cProfile and dump its stats to <profile_dir>/<job path>.prof
+
+        slowest_jobs : int
+            The number of slowest jobs summarized at the end
+        """
+        self.metrics_log = metrics_log
+        self.prometheus_file = prometheus_file
+        self.profile_dir = profile_dir
+        self.slowest_jobs = slowest_jobs
+
+    @property
+    def records_metrics(self) -> bool:
+        return self.metrics_log is not None or self.prometheus_file is not None
+
+class JobQueueConfig:
+    def __init__(self, location : str, heartbeat_seconds : float=60.0, stale_seconds : float=600.0, requeue_failed : bool=False):
+        """
+        Options of process_job_list --job_queue (see job_queue.open_job_queue)
+
+        Parameters
+        ----------
+        location : str
+            "database" (the JobQueue table) or a directory shared by the nodes
+
+        heartbeat_seconds : float
+            The interval between the heartbeats of claimed jobs
+
+        stale_seconds : float
+            The heartbeat age after which the claims of dead workers are released back to the queue
+
+        requeue_failed : bool
+            Return the jobs that failed in earlier runs to pending before claiming jobs (seeding skips them otherwise)
+        """
+        self.location = location
+        self.heartbeat_seconds = heartbeat_seconds
+        self.stale_seconds = stale_seconds
+        self.requeue_failed = requeue_failed
+
+def option_config(config_class : type, value, main_option : str|None=None, name : str|None=None):
+    """
+    The config of a feature given on the command line as --<name>: None if value is None or False, the defaults
+    if True (refused if the main option has no default), the main option if value is a plain value
+    (e.g. --manifest=path) and the options of a dict otherwise (e.g. --pipeline='{writers: 2, queue_depth: 8}')
+    """
+    if value is None or value is False:
+        return None
+    if isinstance(value, config_class):
+        return value
+    if value is True:
+        if main_option is not None and inspect.signature(config_class).parameters[main_option].default is inspect.Parameter.empty:
+            raise ValueError(f"--{name or config_class.__name__} needs a {main_option}")
+        return config_class()
+    if isinstance(value, dict):
+        return config_class(**value)
+    if main_option is None:
+        raise ValueError(f"Expected True or a dict of {config_class.__name__} options, not {value!r}")
+    return config_class(**{main_option : value})
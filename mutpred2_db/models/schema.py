@@ -0,0 +1,126 @@
+from typing import Dict, List, Tuple
+from tqdm import tqdm
+
+FEATURE_TABLES = ["features_sequence", "features_substitution", "features_pssm", "features_conservation",
+                    "features_homology", "features_structure", "features_function"]
+
+# Non-unique secondary indexes of the ingested tables used by the read paths (client, lookup service, annotation),
+# dropped during bulk loads and rebuilt afterwards. UNIQUE constraints are kept, the no-op upserts rely on them
+READ_INDEXES = {"variant_position_idx" : ("Variant", "(seq_hash, position)"),
+                "variant_mechanism_pvalue_idx" : ("VariantMechanism", "(mechanism_id, pvalue)")}
+
+# (table, column, parent table, parent column) of every foreign key in sql/building_tables.sql
+FOREIGN_KEYS = [("Variant", "seq_hash", "Protein", "seq_hash"),
+                ("Variant", "option_id", "RunOption", "option_id"),
+                ("VariantMechanism", "mechanism_id", "Mechanism", "mechanism_id"),
+                ("VariantMechanism", "variant_id", "Variant", "variant_id"),
+                ("SequenceMapping", "seq_hash", "Protein", "seq_hash"),
+                ("FeatureSite", "seq_hash", "Protein", "seq_hash"),
+                ("FeatureSite", "runoption_id", "RunOption", "option_id"),
+                *[(table, column, parent, parent_column) for table in FEATURE_TABLES + ["FeatureVector", "FeatureSiteVariant"]
+                    for column, parent, parent_column in (("variant_id", "Variant", "variant_id"),
+                                                            ("runoption_id", "RunOption", "option_id"))]]
+
+def set_foreign_key_checks(cursor, enabled : bool) -> None:
+    """
+    Enable or disable foreign key checks for the session of cursor
+    """
+    cursor.execute(f"SET SESSION FOREIGN_KEY_CHECKS = {1 if enabled else 0}")
+
+def existing_tables(cursor) -> List[str]:
+    cursor.execute("SELECT table_name FROM information_schema.TABLES WHERE table_schema = DATABASE()")
+    return [row[0] for row in cursor.fetchall()]
+
+def existing_indexes(cursor, table : str) -> List[str]:
+    cursor.execute("SELECT DISTINCT index_name FROM information_schema.STATISTICS WHERE table_schema = DATABASE() AND table_name = %s",
+                    (table,))
+    return [row[0] for row in cursor.fetchall()]
+
+def drop_read_indexes(cursor, cnx) -> List[str]:
+    """
+    Drop the READ_INDEXES that exist, returning their names
+    """
+    dropped = []
+    for index, (table, _) in READ_INDEXES.items():
+        if index in existing_indexes(cursor, table):
+            cursor.execute(f"DROP INDEX {index} ON {table}")
+            dropped.append(index)
+    cnx.commit()
+    return dropped
+
+def create_read_indexes(cursor, cnx) -> List[str]:
+    """
+    Create the READ_INDEXES that are missing, returning their names
+    """
+    created = []
+    for index, (table, columns) in tqdm(READ_INDEXES.items(), desc="Building indexes", leave=False):
+        if index not in existing_indexes(cursor, table):
+            cursor.execute(f"CREATE INDEX {index} ON {table} {columns}")
+            created.append(index)
+    cnx.commit()
+    return created
+
+def row_formats(cursor, tables : List[str]) -> Dict[str,str]:
+    cursor.execute(f"SELECT table_name, row_format FROM information_schema.TABLES WHERE table_schema = DATABASE() "
+                    f"AND table_name IN ({', '.join(['%s'] * len(tables))})", tuple(tables))
+    return {table : row_format for table, row_format in cursor.fetchall()}
+
+def compress_feature_tables(cursor, cnx, key_block_size : int=8) -> List[str]:
+    """
+    Rebuild the features_* tables that are not compressed yet with ROW_FORMAT=COMPRESSED (requires innodb_file_per_table),
+    returning the tables rebuilt (tables already compressed are left alone, a rebuild copies the whole table)
+    """
+    formats = row_formats(cursor, FEATURE_TABLES)
+    rebuilt = []
+    for table in tqdm(FEATURE_TABLES, desc="Compressing feature tables", leave=False):
+        if str(formats.get(table, "")).lower() == "compressed":
+            continue
+        cursor.execute(f"ALTER TABLE {table} ROW_FORMAT=COMPRESSED KEY_BLOCK_SIZE={key_block_size}")
+        rebuilt.append(table)
+    cnx.commit()
+    return rebuilt
+
+def orphan_counts(cursor) -> Dict[str,int]:
+    """
+    The number of rows of each foreign key whose parent row is missing, checked with one anti-join per key
+    """
+    tables = set(existing_tables(cursor))
+    counts = {}
+    for table, column, parent, parent_column in tqdm(FOREIGN_KEYS, desc="Checking foreign keys", leave=False):
+        if table not in tables or parent not in tables:
+            continue
+        cursor.execute(f"SELECT COUNT(*) FROM {table} AS child LEFT JOIN {parent} AS parent "
+                        f"ON child.{column} = parent.{parent_column} "
+                        f"WHERE child.{column} IS NOT NULL AND parent.{parent_column} IS NULL")
+        counts[f"{table}.{column} -> {parent}.{parent_column}"] = cursor.fetchall()[0][0]
+    return counts
+
+def begin_bulk_load(cursor, cnx, compress_features : bool=False) -> List[str]:
+    """
+    Prepare the schema for a bulk load: drop the read indexes, optionally compress the feature tables,
+    and disable foreign key checks for the session of cursor (writer sessions call set_foreign_key_checks themselves)
+
+    Returns
+    -------
+    List[str]
+        The dropped indexes
+    """
+    dropped = drop_read_indexes(cursor, cnx)
+    if compress_features:
+        compress_feature_tables(cursor, cnx)
+    set_foreign_key_checks(cursor, False)
+    return dropped
+
+def finish_bulk_load(cursor, cnx) -> Tuple[List[str],Dict[str,int]]:
+    """
+    Rebuild the read indexes, verify referential integrity in bulk and re-enable foreign key checks
+
+    Returns
+    -------
+    Tuple[List[str],Dict[str,int]]
+        The created indexes and the foreign keys with orphan rows, with their number of orphans
+    """
+    created = create_read_indexes(cursor, cnx)
+    orphans = {key : count for key, count in orphan_counts(cursor).items() if count > 0}
+    set_foreign_key_checks(cursor, True)
+    return created, orphans
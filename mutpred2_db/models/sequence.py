@@ -1,8 +1,5 @@
 import hashlib
-import pandas as pd
 from pathlib import Path
-from Bio.SeqIO import parse
-from sqlalchemy.engine import Engine
 
 class Sequence:
     def __init__(self,seq):
@@ -12,6 +9,7 @@ class Sequence:
         self.seq_hash = Sequence.get_sequence_hash(seq)
 
     def to_series(self):
+        import pandas as pd
         return pd.Series({'seq_hash': self.seq_hash,
                           'sequence':self.seq})
 
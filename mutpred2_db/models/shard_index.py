@@ -0,0 +1,127 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List, Tuple
+from pathlib import Path
+import os
+import re
+
+from .job_manifest import fingerprint_files
+from .errors import JobDataError
+import numpy as np
+
+# <prefix>.<kind>_<number>.mat, e.g. output.txt.prop_pvals_pu_3.mat
+SHARD_PATTERN = re.compile(r"^(?P<prefix>.+)\.(?P<kind>[A-Za-z0-9_]+?)_(?P<number>\d+)\.mat$")
+
+# Sharded series read when processing a job, which must all have the same shards, and the variable stored in their files
+SHARD_KEYS = {"feats" : "feats",
+                "positions_pu" : "positions_pu",
+                "prop_pvals_pu" : "prop_pvals_pu",
+                "prop_scores_pu" : "prop_scores_pu",
+                "prop_types_pu" : "prop_types_pu",
+                "motif_info" : "motif_info",
+                "MutPred2Score" : "S"}
+SHARD_SERIES = list(SHARD_KEYS)
+
+class ShardIndex:
+    def __init__(self, job_dir : str|Path, shards : Dict[str,Dict[int,str]], files : List[str], file_stats : List[Tuple[str,int,int]]|None=None):
+        """
+        The sharded .mat files of a job directory, built from a single directory scan
+
+        Parameters
+        ----------
+        job_dir : str|Path
+            The job directory
+
+        shards : Dict[str,Dict[int,str]]
+            The file name of each shard number of each kind of series (e.g. 'feats')
+
+        files : List[str]
+            Every file name in the directory
+
+        file_stats : List[Tuple[str,int,int]]|None
+            The (name, size, mtime_ns) of every file, if the scan collected them
+        """
+        self.job_dir = job_dir
+        self.shards = shards
+        self.files = files
+        self.file_stats = file_stats
+
+    @staticmethod
+    def scan(job_dir : str|Path, with_stats : bool=False) -> "ShardIndex":
+        """
+        Index a job directory with one scan, also collecting file sizes and mtimes for fingerprint() if with_stats
+        """
+        shards = {}
+        files = []
+        file_stats = [] if with_stats else None
+        with os.scandir(job_dir) as entries:
+            for entry in entries:
+                files.append(entry.name)
+                if with_stats and entry.is_file():
+                    stat = entry.stat()
+                    file_stats.append((entry.name, stat.st_size, stat.st_mtime_ns))
+                match = SHARD_PATTERN.match(entry.name)
+                if match is not None:
+                    shards.setdefault(match.group('kind'), {})[int(match.group('number'))] = entry.name
+        return ShardIndex(job_dir, shards, sorted(files), file_stats)
+
+    def fingerprint(self) -> str:
+        """
+        The job fingerprint (see job_manifest.job_fingerprint), computed from the scan
+        """
+        if self.file_stats is None:
+            raise ValueError("The shard index was scanned without file stats")
+        return fingerprint_files(self.file_stats)
+
+    def shard_numbers(self, kind : str) -> List[int]:
+        return sorted(self.shards.get(kind, {}))
+
+    def shard_files(self, kind : str) -> List[str]:
+        return [self.shards[kind][number] for number in self.shard_numbers(kind)]
+
+    def match(self, pattern : str) -> List[str]:
+        """
+        The shard files whose name matches pattern, sorted by shard number
+        """
+        re_pattern = re.compile(pattern)
+        files = [(kind, number, name) for kind, numbers in self.shards.items() for number, name in numbers.items() if re_pattern.match(name)]
+        return [name for _, _, name in sorted(files, key=lambda f : (f[1], f[0]))]
+
+    def check_complete(self, kinds : Iterable[str]=SHARD_SERIES) -> None:
+        """
+        Raise a JobDataError unless every series of kinds that is present has the same shard numbers
+        """
+        numbers = {kind : self.shard_numbers(kind) for kind in kinds if kind in self.shards}
+        if len(numbers) == 0:
+            return
+        expected = max(numbers.values(), key=len)
+        incomplete = {kind : sorted(set(expected) - set(found)) for kind, found in numbers.items() if found != expected}
+        if len(incomplete) > 0:
+            raise JobDataError(f"Incomplete shards in {self.job_dir}: {len(expected)} shards expected, missing {incomplete}")
+
+    def load(self, files : List[str], key_value : str, threads : int=4) -> List[np.ndarray]:
+        """
+        Load key_value (only) from each file, using a thread pool, in the order of files
+        """
+        from scipy.io import loadmat
+        def load_file(name : str) -> np.ndarray:
+            return loadmat(os.path.join(self.job_dir, name), variable_names=[key_value])[key_value]
+        if threads <= 1 or len(files) <= 1:
+            return list(map(load_file, files))
+        with ThreadPoolExecutor(max_workers=min(threads, len(files))) as executor:
+            return list(executor.map(load_file, files))
+
+    def load_shard(self, number : int, kinds : Iterable[str]=SHARD_SERIES, threads : int=4) -> Dict[str,np.ndarray]:
+        """
+        Load shard `number` of every series of kinds that is present, using a thread pool
+
+        Returns
+        -------
+        Dict[str,np.ndarray]
+            The array stored in the shard file of each kind (see SHARD_KEYS)
+        """
+        kinds = [kind for kind in kinds if number in self.shards.get(kind, {})]
+        from scipy.io import loadmat
+        def load_file(kind : str) -> np.ndarray:
+            return loadmat(os.path.join(self.job_dir, self.shards[kind][number]), variable_names=[SHARD_KEYS[kind]])[SHARD_KEYS[kind]]
+        with ThreadPoolExecutor(max_workers=max(1, min(threads, len(kinds)))) as executor:
+            return dict(zip(kinds, executor.map(load_file, kinds)))
@@ -1,16 +1,38 @@
-import mysql.connector
 import yaml
 from .sequence import Sequence
 from .variant import Variant
 from .mechanism import Mechanism
 from .feature_set import Features_Set
-from typing import List
+from .errors import JobDataError
+from .feature_block import FeatureBlock
+from .mechanism_block import MechanismBlock
+from .variant_batch import VariantBatch
+from .feature_codec import FeatureVectorBlock, FEATURE_VECTOR_COLUMNS, decode_features, features_frame
+from .feature_sites import FeatureSiteBlock, FeatureSiteVariantBlock, assemble_site_features, pack_mask
+from typing import TYPE_CHECKING, List, Iterable, Tuple, Sequence as SequenceType
+from functools import lru_cache
+from itertools import islice
+import sys
 from tqdm import tqdm
-from joblib import Parallel, delayed
-import pandas as pd
+import numpy as np
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+DEFAULT_BATCH_SIZE = 500
+
+SEQUENCE_COLUMNS = ("seq_hash", "sequence")
+VARIANT_COLUMNS = ("variant_id", "seq_hash", "reference_aa", "position", "alternate_aa", "score", "option_id")
+MECHANISM_COLUMNS = ("variant_id", "mechanism_id", "mechanism_type", "altered_position", "score", "pvalue", "description")
 
 class SQL_Connection(object):
-    def __init__(self,config_name, config_file):
+    def __init__(self,config_name, config_file, allow_local_infile=False, pool_name=None, pool_size=None):
+        """
+        A pool of connections to the database described by the config_name entry of a yaml config file
+
+        pool_name and pool_size default to the entry's pool_name and pool_size, or "my_pool" and 5
+        """
+        import mysql.connector
         with open(config_file,'r') as file:
             configs = yaml.safe_load(file)
         cfg = configs[config_name]
@@ -19,12 +41,15 @@ class SQL_Connection(object):
         self.host = cfg['host']
         self.port = cfg['port']
         self.database = cfg['database']
-        self.pool = mysql.connector.pooling.MySQLConnectionPool(pool_name="my_pool", pool_size=5,
+        self.pool_size = pool_size or cfg.get('pool_size', 5)
+        self.pool = mysql.connector.pooling.MySQLConnectionPool(pool_name=pool_name or cfg.get('pool_name', "my_pool"),
+                                                            pool_size=self.pool_size,
                                                             user=self.user,
                                                             database=self.database,
                                                             password=self.password,
                                                             host=self.host,
-                                                            port=self.port)
+                                                            port=self.port,
+                                                            allow_local_infile=allow_local_infile)
 
     def open(self,):
         conn = self.pool.get_connection()
@@ -45,7 +70,139 @@ class SQL_Connection(object):
         self.pool.close()
         super().__exit__()
 
-def write_sequence(cursor, cnx,sequence : Sequence) -> int:
+@lru_cache(maxsize=None)
+def insert_template(table : str, columns : SequenceType[str], n_rows : int, update : bool=False) -> str:
+    """
+    Build (once per table, column set and row count) a multi-row INSERT statement
+
+    Parameters
+    ----------
+    table : str
+        The table to insert into
+
+    columns : Tuple[str]
+        The columns of each row, in the order the row values are given
+
+    n_rows : int
+        The number of rows in the VALUES list
+
+    update : bool
+        Overwrite the stored values of duplicate rows (col=VALUES(col)) instead of keeping them (col=col)
+
+    Returns
+    -------
+    str
+        INSERT ... VALUES (...),(...) ON DUPLICATE KEY UPDATE statement with %s placeholders
+    """
+    row = f"({', '.join(['%s'] * len(columns))})"
+    assignment = "{column}=VALUES({column})" if update else "{column}={column}"
+    return (f"INSERT INTO {table} "
+            f"({', '.join(columns)}) "
+            f"VALUES {', '.join([row] * n_rows)} "
+            f"ON DUPLICATE KEY UPDATE {', '.join([assignment.format(column=column) for column in columns])};")
+
+def database_errors() -> tuple:
+    """
+    The database errors caught per job: those of mysql.connector and sqlalchemy, once loaded (neither is imported
+    for this alone: mysql.connector is loaded with the first SQL_Connection, and sqlalchemy takes longer to import
+    than the rest of the ingest)
+    """
+    errors = ()
+    for module in ("mysql.connector.errors", "sqlalchemy.exc"):
+        if module in sys.modules:
+            errors += (sys.modules[module].DatabaseError,)
+    return errors
+
+def iter_batches(rows : Iterable[tuple], batch_size : int) -> Iterable[List[tuple]]:
+    rows = iter(rows)
+    while True:
+        batch = list(islice(rows, batch_size))
+        if not batch:
+            return
+        yield batch
+
+def iter_rows(rows : Iterable[tuple]|FeatureBlock|MechanismBlock|VariantBatch|FeatureVectorBlock|FeatureSiteBlock|FeatureSiteVariantBlock) -> Iterable[tuple]:
+    """
+    Rows of an iterable of tuples, or of a columnar block
+    """
+    return rows.rows() if isinstance(rows, (FeatureBlock, MechanismBlock, VariantBatch, FeatureVectorBlock, FeatureSiteBlock, FeatureSiteVariantBlock)) else rows
+
+def write_rows(cursor, table : str, columns : SequenceType[str], rows : Iterable[tuple], **kwargs) -> int:
+    """
+    Write rows to a table using multi-row INSERT statements, without committing
+
+    Required Parameters
+    ----------
+    table : str
+        The table to insert into
+
+    columns : Tuple[str]
+        The column names, in the order the row values are given
+
+    rows : Iterable[tuple]|FeatureBlock|MechanismBlock
+        The rows to write
+
+    Optional Parameters
+    ----------
+    batch_size : int
+        The number of rows sent per INSERT statement (default DEFAULT_BATCH_SIZE)
+
+    total : int
+        The number of rows, used for the progress bar
+
+    update : bool
+        Overwrite the stored values of rows whose key already exists (default False: keep them)
+
+    Returns
+    -------
+    int
+        The number of rows written
+    """
+    batch_size = kwargs.get("batch_size", DEFAULT_BATCH_SIZE) or DEFAULT_BATCH_SIZE
+    total = kwargs.get("total")
+    update = kwargs.get("update", False)
+    columns = tuple(columns)
+    n_written = 0
+    with tqdm(total=total, desc=f"Writing {table}", leave=False, unit="rows") as progress:
+        for batch in iter_batches(iter_rows(rows), batch_size):
+            query = insert_template(table, columns, len(batch), update)
+            data = [value for row in batch for value in row]
+            try:
+                cursor.execute(query, data)
+            except Exception as e:
+                print(f"Failed writing rows {n_written}-{n_written + len(batch)} to {table}")
+                print(batch[0])
+                raise e
+            n_written += len(batch)
+            progress.update(len(batch))
+    return n_written
+
+def variant_rows(variants : Iterable[Variant]|VariantBatch) -> Iterable[tuple]:
+    if isinstance(variants, VariantBatch):
+        return variants.rows()
+    return ((variant.variant_id, variant.seq_hash, variant.reference_aa, variant.position,
+                variant.alternate_aa, variant.mutpred_score, variant.option_id) for variant in variants)
+
+def mechanism_rows(mechanisms : Iterable[Mechanism]|MechanismBlock) -> Iterable[tuple]:
+    if isinstance(mechanisms, MechanismBlock):
+        return mechanisms.rows()
+    return ((mechanism.variant_id, mechanism.mechanism_id, mechanism.mechanism_type, mechanism.position,
+                mechanism.score, mechanism.pvalue, mechanism.description) for mechanism in mechanisms)
+
+def feature_set_columns(feature_sets : List[Features_Set]|FeatureBlock|type) -> tuple:
+    if isinstance(feature_sets, FeatureBlock):
+        return feature_sets.columns
+    feature_set_type = feature_sets if isinstance(feature_sets, type) else type(feature_sets[0])
+    return ("variant_id", "runoption_id", *feature_set_type.__features_order__)
+
+def feature_set_rows(feature_sets : Iterable[Features_Set]|FeatureBlock) -> Iterable[tuple]:
+    if isinstance(feature_sets, FeatureBlock):
+        return feature_sets.rows()
+    return ((feature_set.variant_id, feature_set.runoption_id, *feature_set.feature_vec[:len(feature_set.__features_order__)])
+                for feature_set in feature_sets)
+
+def write_sequence(cursor, cnx,sequence : Sequence, **kwargs) -> int:
+    do_commit = kwargs.get("do_commit",True)
     add_sequence = ("INSERT INTO Protein "
             "(seq_hash, sequence) "
             "VALUES (%s, %s)"
@@ -53,7 +210,8 @@ def write_sequence(cursor, cnx,sequence : Sequence) -> int:
     data_sequence = (sequence.seq_hash, sequence.seq)
     cursor.execute(add_sequence, data_sequence)
     sequence_number = 0#cursor.lastrowid
-    cnx.commit()
+    if do_commit:
+        cnx.commit()
     return sequence_number
 
 def write_variant( cursor, cnx,variant : Variant, **kwargs) -> int:
@@ -73,11 +231,13 @@ def write_variant( cursor, cnx,variant : Variant, **kwargs) -> int:
     # cursor.execute('SELECT LAST_INSERT_ID()')
     return 0#last_insert_id[0]
 
-def write_variants(cursor, cnx,variants : List[Variant]) -> List[int]:
-    variant_numbers = []
-    for variant in tqdm(variants,desc="Writing variants",leave=False):
-        variant_numbers.append(write_variant(cursor, cnx,variant, do_commit=True))
-    return variant_numbers
+def write_variants(cursor, cnx,variants : List[Variant], **kwargs) -> int:
+    do_commit = kwargs.get("do_commit",True)
+    n_written = write_rows(cursor, "Variant", VARIANT_COLUMNS, variant_rows(variants),
+                            total=len(variants), batch_size=kwargs.get("batch_size"))
+    if do_commit:
+        cnx.commit()
+    return n_written
 
 def query_runoption(cursor, cnx,compute_homology_profile : bool,
                     use_predicted_conservation_scores : bool,
@@ -112,7 +272,7 @@ def insert_runoption(cursor, cnx, compute_homology_profile : bool,
     cnx.commit()
     return option_id
 
-def write_mechanism(cursor, cnx, mechanism : Mechanism|pd.Series, **kwargs) -> int:
+def write_mechanism(cursor, cnx, mechanism : "Mechanism|pd.Series", **kwargs) -> int:
     do_commit = kwargs.get("do_commit",True)
     add_mechanism = ("INSERT INTO VariantMechanism "
                         "(variant_id, mechanism_id, mechanism_type, altered_position, score, pvalue, description) "
@@ -130,13 +290,13 @@ def write_mechanism(cursor, cnx, mechanism : Mechanism|pd.Series, **kwargs) -> i
         cnx.commit()
     return variant_mechanism_id
 
-def write_mechanisms(cursor, cnx,mechanisms : List[Mechanism]) -> List[int]:
-    variant_mechanism_ids = [write_mechanism(cursor, cnx,mechanism, do_commit=False) for mechanism in tqdm(map(lambda m: m.to_dict(), mechanisms),
-                                                                                                        total=len(mechanisms),
-                                                                                                        desc="Writing mechanisms",
-                                                                                                        leave=False)]
-    cnx.commit()
-    return variant_mechanism_ids
+def write_mechanisms(cursor, cnx,mechanisms : List[Mechanism]|MechanismBlock, **kwargs) -> int:
+    do_commit = kwargs.get("do_commit",True)
+    n_written = write_rows(cursor, "VariantMechanism", MECHANISM_COLUMNS, mechanism_rows(mechanisms),
+                            total=len(mechanisms), batch_size=kwargs.get("batch_size"))
+    if do_commit:
+        cnx.commit()
+    return n_written
 
 def initialize_mechanisms(cursor, cnx):
     for idx, mechanism in enumerate(Mechanism.mechanism_order):
@@ -167,9 +327,123 @@ def write_feature_set(cursor, cnx,feature_set : Features_Set, feature_set_table,
         cnx.commit()
     return feature_set_id
 
-def write_feature_sets(cursor, cnx,feature_sets : List[Features_Set], feature_set_table) -> List[int]:
-    feature_set_ids = []
-    for feature_set in tqdm(feature_sets, desc=f"Writing {feature_set_table} sets",leave=False):
-        feature_set_ids.append(write_feature_set(cursor, cnx, feature_set, feature_set_table, do_commit=False))
-    cnx.commit()
-    return feature_set_ids
\ No newline at end of file
+def write_feature_sets(cursor, cnx,feature_sets : List[Features_Set]|FeatureBlock, feature_set_table, **kwargs) -> int:
+    do_commit = kwargs.get("do_commit",True)
+    if len(feature_sets) == 0:
+        return 0
+    n_written = write_rows(cursor, feature_set_table, feature_set_columns(feature_sets), feature_set_rows(feature_sets),
+                            total=len(feature_sets), batch_size=kwargs.get("batch_size"))
+    if do_commit:
+        cnx.commit()
+    return n_written
+
+def write_feature_vectors(cursor, cnx, feature_vectors : FeatureVectorBlock, **kwargs) -> int:
+    do_commit = kwargs.get("do_commit",True)
+    if len(feature_vectors) == 0:
+        return 0
+    n_written = write_rows(cursor, "FeatureVector", FEATURE_VECTOR_COLUMNS, feature_vectors,
+                            total=len(feature_vectors), batch_size=kwargs.get("batch_size"))
+    if do_commit:
+        cnx.commit()
+    return n_written
+
+def check_site_mask(cursor, feature_sites : FeatureSiteBlock) -> None:
+    """
+    Refuse site features whose mask differs from the one already stored for their protein and run option
+
+    FeatureSite rows are keyed by (seq_hash, position, runoption_id) and kept as first written, so the
+    FeatureSiteVariant blobs of a job split with another mask could not be reassembled with them (a later job
+    for the same protein, e.g. the sequence of another transcript, detects its own site-level columns)
+    """
+    cursor.execute("SELECT DISTINCT site_mask FROM FeatureSite WHERE seq_hash = %s AND runoption_id = %s",
+                    (feature_sites.seq_hash, feature_sites.runoption_id))
+    stored = {bytes(row[0]) for row in cursor.fetchall()}
+    if len(stored - {pack_mask(feature_sites.mask)}) > 0:
+        raise JobDataError(f"FeatureSite rows of {feature_sites.seq_hash} (run option {feature_sites.runoption_id}) are stored with "
+                            f"another site mask; store the variants of this job with feature_storage='packed' or 'tables'")
+
+def write_site_features(cursor, cnx, feature_sites : FeatureSiteBlock, feature_site_variants : FeatureSiteVariantBlock, **kwargs) -> int:
+    """
+    Write the site and per-variant features of a job, after checking its site mask against the stored one (see check_site_mask)
+    """
+    do_commit = kwargs.get("do_commit",True)
+    check_site_mask(cursor, feature_sites)
+    n_written = 0
+    if len(feature_sites) > 0:
+        n_written += write_rows(cursor, "FeatureSite", feature_sites.columns, feature_sites,
+                                total=len(feature_sites), batch_size=kwargs.get("batch_size"))
+    if len(feature_site_variants) > 0:
+        n_written += write_rows(cursor, "FeatureSiteVariant", feature_site_variants.columns, feature_site_variants,
+                                total=len(feature_site_variants), batch_size=kwargs.get("batch_size"))
+    if do_commit:
+        cnx.commit()
+    return n_written
+
+def query_feature_vectors(cursor, cnx, variant_ids : Iterable[str], runoption_id : int, **kwargs) -> "pd.DataFrame":
+    """
+    Read the packed feature vectors of variants from the FeatureVector table, reassembling those of the variants
+    stored with site-level deduplication (see query_site_features) transparently
+
+    Required Parameters
+    ----------
+    variant_ids : Iterable[str]
+        The variants to read; variants without a feature vector are left out
+
+    runoption_id : int
+        The run option the features were computed with
+
+    Optional Parameters
+    ----------
+    tables : List[str]
+        Only return the columns of these feature tables (e.g. ['features_pssm'])
+
+    batch_size : int
+        The number of variants looked up per query (default DEFAULT_BATCH_SIZE)
+
+    site_features : bool
+        Also look the variants missing from FeatureVector up in the FeatureSite tables (default True)
+
+    Returns
+    -------
+    pd.DataFrame
+        The named float32 feature columns (see feature_codec.FEATURE_COLUMNS), indexed by variant_id
+    """
+    variant_ids = list(variant_ids)
+    fetched = []
+    for batch in iter_batches(variant_ids, kwargs.get("batch_size") or DEFAULT_BATCH_SIZE):
+        query = (f"SELECT variant_id, dtype, features FROM FeatureVector "
+                    f"WHERE runoption_id = %s AND variant_id IN ({', '.join(['%s'] * len(batch))})")
+        cursor.execute(query, (runoption_id, *batch))
+        fetched.extend(cursor.fetchall())
+    ids = [row[0] for row in fetched]
+    values = decode_features([bytes(row[2]) for row in fetched], [row[1] for row in fetched])
+    if kwargs.get("site_features", True) and len(ids) < len(set(variant_ids)):
+        found = set(ids)
+        site_ids, site_values = query_site_features(cursor, cnx, [variant_id for variant_id in variant_ids if variant_id not in found],
+                                                    runoption_id, batch_size=kwargs.get("batch_size"))
+        ids += site_ids
+        values = np.concatenate([values, site_values])
+    return features_frame(ids, values, kwargs.get("tables"))
+
+def query_site_features(cursor, cnx, variant_ids : Iterable[str], runoption_id : int, **kwargs) -> Tuple[List[str],np.ndarray]:
+    """
+    Reassemble the feature vectors of variants stored with site-level deduplication, joining the substitution-specific
+    columns of FeatureSiteVariant with the site-level columns of the FeatureSite row of their position
+    (see feature_sites.split_site_features); variants without site features are left out
+
+    Returns
+    -------
+    Tuple[List[str],np.ndarray]
+        The variant ids found and their (n_variants, N_FEATURES) float32 feature vectors
+    """
+    fetched = []
+    for batch in iter_batches(variant_ids, kwargs.get("batch_size") or DEFAULT_BATCH_SIZE):
+        query = (f"SELECT fv.variant_id, fs.site_mask, fs.dtype, fs.features, fv.dtype, fv.features "
+                    f"FROM FeatureSiteVariant fv "
+                    f"JOIN Variant v ON v.variant_id = fv.variant_id "
+                    f"JOIN FeatureSite fs ON fs.seq_hash = v.seq_hash AND fs.position = v.position AND fs.runoption_id = fv.runoption_id "
+                    f"WHERE fv.runoption_id = %s AND fv.variant_id IN ({', '.join(['%s'] * len(batch))})")
+        cursor.execute(query, (runoption_id, *batch))
+        fetched.extend(cursor.fetchall())
+    columns = list(zip(*fetched)) or [()] * 6
+    return list(columns[0]), assemble_site_features(*columns[1:])
@@ -0,0 +1,77 @@
+from typing import Iterable, List
+from functools import lru_cache
+from pathlib import Path
+import re
+import sqlite3
+
+UPSERT_CLAUSE = re.compile(r"\s*ON DUPLICATE KEY UPDATE .*$", re.DOTALL)
+FOREIGN_KEY_CHECKS = re.compile(r"^SET SESSION FOREIGN_KEY_CHECKS = ([01])$")
+
+class SQLiteCursor:
+    def __init__(self, cursor : sqlite3.Cursor):
+        """
+        A cursor accepting the %s placeholders of mysql.connector queries
+        """
+        self.cursor = cursor
+
+    @staticmethod
+    @lru_cache(maxsize=256)
+    def translate(query : str) -> str:
+        """
+        Replace %s placeholders by ?, INSERT IGNORE by INSERT OR IGNORE, the ON DUPLICATE KEY UPDATE clause of
+        sql_connection.insert_template by INSERT OR IGNORE (col=col) or INSERT OR REPLACE (col=VALUES(col)),
+        and SET SESSION FOREIGN_KEY_CHECKS by PRAGMA foreign_keys
+        """
+        foreign_key_checks = FOREIGN_KEY_CHECKS.match(query)
+        if foreign_key_checks is not None:
+            return f"PRAGMA foreign_keys = {foreign_key_checks.group(1)}"
+        query = query.replace("%s", "?")
+        if query.startswith("INSERT IGNORE "):
+            query = "INSERT OR IGNORE " + query[len("INSERT IGNORE "):]
+        upsert = UPSERT_CLAUSE.search(query)
+        if upsert is not None:
+            verb = "INSERT OR REPLACE " if "VALUES(" in upsert.group(0) else "INSERT OR IGNORE "
+            query = verb + query[len("INSERT "):upsert.start()] + ";"
+        return query
+
+    def execute(self, query : str, params : Iterable=()) -> None:
+        self.cursor.execute(SQLiteCursor.translate(query), tuple(params or ()))
+
+    def executemany(self, query : str, seq_params : Iterable[Iterable]) -> None:
+        self.cursor.executemany(SQLiteCursor.translate(query), seq_params)
+
+    def fetchall(self) -> List[tuple]:
+        return self.cursor.fetchall()
+
+    def fetchone(self) -> tuple|None:
+        return self.cursor.fetchone()
+
+    def fetchmany(self, size : int) -> List[tuple]:
+        return self.cursor.fetchmany(size)
+
+    @property
+    def rowcount(self) -> int:
+        return self.cursor.rowcount
+
+    @property
+    def description(self):
+        return self.cursor.description
+
+    def close(self) -> None:
+        self.cursor.close()
+
+class SQLiteConnection:
+    def __init__(self, path : str|Path):
+        """
+        A local SQLite stand-in for SQL_Connection, for tests and benchmarks of the read and write paths:
+        open() returns a (cursor, connection) pair and close() releases it, as with SQL_Connection
+        """
+        self.path = str(path)
+
+    def open(self,):
+        cnx = sqlite3.connect(self.path, check_same_thread=False)
+        return SQLiteCursor(cnx.cursor()), cnx
+
+    def close(self, conn, cursor):
+        for resource in (cursor, conn):
+            resource.close()
@@ -0,0 +1,96 @@
+from .variant import RESIDUES
+from .feature_codec import N_FEATURES
+from .mechanism import Mechanism
+
+from pathlib import Path
+from typing import Dict, List
+from scipy.io import savemat
+import numpy as np
+
+ALPHABET = np.array(sorted(RESIDUES))
+
+def cell_column(values : List[str]) -> np.ndarray:
+    """
+    A (n, 1) MATLAB cell array of strings
+    """
+    cell = np.empty((len(values), 1), dtype=object)
+    for i, value in enumerate(values):
+        cell[i, 0] = value
+    return cell
+
+def synthetic_substitutions(sequence : str, n_variants : int, rng : np.random.Generator) -> List[str]:
+    """
+    n_variants distinct substitutions of sequence (in position order), drawn from its 19 * len(sequence) substitutions
+    """
+    reference = np.array(list(sequence))
+    alternates = np.array([[a for a in ALPHABET if a != ref] for ref in reference])
+    n_variants = min(n_variants, alternates.size)
+    chosen = np.sort(rng.choice(alternates.size, size=n_variants, replace=False))
+    positions, columns = np.divmod(chosen, alternates.shape[1])
+    return [f"{reference[p]}{p + 1}{alternates[p, c]}" for p, c in zip(positions.tolist(), columns.tolist())]
+
+def write_synthetic_job(job_dir : str|Path, protein_length : int=500, n_variants : int|None=None, n_shards : int=4,
+                        seed : int=0, prefix : str="output.txt") -> Dict:
+    """
+    Write a synthetic MutPred2 job directory with scipy.io.savemat, laid out as the real output read by Processor:
+    <prefix>.sequences.mat, <prefix>.substitutions.mat and, for each shard N, <prefix>.feats_N.mat,
+    positions_pu_N, prop_pvals_pu_N, prop_scores_pu_N, prop_types_pu_N, motif_info_N and MutPred2Score_N
+
+    Parameters
+    ----------
+    job_dir : str|Path
+        The directory to write (created if missing)
+
+    protein_length : int
+        The length of the random protein sequence
+
+    n_variants : int|None
+        The number of substitutions (default: all 19 * protein_length)
+
+    n_shards : int
+        The number of shards the variants are split into
+
+    seed : int
+        The seed of the random values, so a job can be regenerated identically
+
+    Returns
+    -------
+    Dict
+        The sequence, the number of variants and the number of shards
+    """
+    rng = np.random.default_rng(seed)
+    job_dir = Path(job_dir)
+    job_dir.mkdir(parents=True, exist_ok=True)
+    sequence = "".join(rng.choice(ALPHABET, protein_length))
+    substitutions = synthetic_substitutions(sequence, 19 * protein_length if n_variants is None else n_variants, rng)
+    n = len(substitutions)
+    savemat(job_dir / f"{prefix}.sequences.mat", {"sequences" : cell_column([sequence])})
+    outer = np.empty((1, 1), dtype=object)
+    outer[0, 0] = cell_column(substitutions)
+    savemat(job_dir / f"{prefix}.substitutions.mat", {"substitutions" : outer})
+    n_mechanisms = len(Mechanism.mechanism_order)
+    for number, rows in enumerate(np.array_split(np.arange(n), n_shards), start=1):
+        m = len(rows)
+        # Mechanism p-values are mostly insignificant, with a tail of small ones as in real jobs
+        pvalues = np.where(rng.random((m, n_mechanisms)) < 0.1, rng.random((m, n_mechanisms)) * 0.05, rng.random((m, n_mechanisms)))
+        shard = {"feats" : {"feats" : rng.standard_normal((m, N_FEATURES))},
+                    "positions_pu" : {"positions_pu" : rng.integers(1, protein_length + 1, (m, n_mechanisms - 1)).astype(float)},
+                    "prop_pvals_pu" : {"prop_pvals_pu" : pvalues},
+                    "prop_scores_pu" : {"prop_scores_pu" : rng.random((m, n_mechanisms))},
+                    "prop_types_pu" : {"prop_types_pu" : rng.integers(0, 2, (m, n_mechanisms)).astype(float)},
+                    "motif_info" : {"motif_info" : cell_column([f"motif_{number}_{i}" for i in range(m)])},
+                    "MutPred2Score" : {"S" : rng.random((m, 1))}}
+        for kind, variables in shard.items():
+            savemat(job_dir / f"{prefix}.{kind}_{number}.mat", variables)
+    return dict(sequence=sequence, n_variants=n, n_shards=n_shards)
+
+def write_synthetic_jobs(root : str|Path, n_jobs : int, seed : int=0, **kwargs) -> List[str]:
+    """
+    Write n_jobs synthetic jobs to root/job_<i> (see write_synthetic_job for kwargs), returning their directories
+    """
+    job_dirs = []
+    for i in range(n_jobs):
+        job_dir = Path(root) / f"job_{i}"
+        write_synthetic_job(job_dir, seed=seed + i, **kwargs)
+        job_dirs.append(str(job_dir))
+    return job_dirs
@@ -1,8 +1,7 @@
 # from .sequence_mapping import SequenceMapping
-import pandas as pd
-from Bio.PDB.Polypeptide import protein_letters_3to1
 import hashlib
-RESIDUES = set(protein_letters_3to1 .values())
+# The 20 standard residues (the values of Bio.PDB.Polypeptide.protein_letters_3to1, without importing Bio.PDB)
+RESIDUES = set("ACDEFGHIKLMNPQRSTVWY")
 
 class Variant:
     def __init__(self, seq_hash : str, substitution: str, mutpred_score: float, option_id: int):
@@ -21,6 +20,7 @@ class Variant:
         assert self.alternate_aa in RESIDUES, f"Invalid residue {self.alternate_aa} for substitution {substitution}"
 
     def to_series(self):
+        import pandas as pd
         return pd.Series({'seq_hash': self.seq_hash,
                           'reference_aa': self.reference_aa,
                           'position': self.position,
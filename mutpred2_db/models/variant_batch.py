@@ -0,0 +1,191 @@
+from .variant import Variant, RESIDUES
+from .sequence import Sequence
+from .errors import JobDataError
+
+from typing import TYPE_CHECKING, Dict, Iterable, Iterator, List
+import hashlib
+import numpy as np
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+# Unicode code points of the valid residues, compared against the parsed substitutions
+RESIDUE_CODES = np.array(sorted(map(ord, RESIDUES)), dtype=np.uint32)
+
+def variant_hashes(seq_hash : str, reference_aa : List[str], position : List[int], alternate_aa : List[str], option_id : int) -> List[str]:
+    """
+    md5 of f"{seq_hash}{reference_aa}{position}{alternate_aa}{option_id}" for each substitution, as in Variant
+    """
+    prefix = hashlib.md5(seq_hash.encode(encoding='utf-8'))
+    ids = []
+    for ref, pos, alt in zip(reference_aa, position, alternate_aa):
+        h = prefix.copy()
+        h.update(f"{ref}{pos}{alt}{option_id}".encode(encoding='utf-8'))
+        ids.append(h.hexdigest())
+    return ids
+
+def substitution_report(substitutions : np.ndarray, invalid : np.ndarray, reason : str, max_listed : int=10) -> str:
+    """
+    A short description of the invalid substitutions, listing at most max_listed of them
+    """
+    offending = substitutions[invalid].tolist()
+    listed = ", ".join(offending[:max_listed])
+    more = f" and {len(offending) - max_listed} more" if len(offending) > max_listed else ""
+    return f"{len(offending)} of {len(substitutions)} substitutions {reason}: {listed}{more}"
+
+class VariantBatch:
+    row_chunk_size = 4096
+    hash_chunk_size = 65536
+
+    def __init__(self, seq_hash : str,
+                        reference_aa : np.ndarray,
+                        position : np.ndarray,
+                        alternate_aa : np.ndarray,
+                        score : np.ndarray,
+                        option_id : int,
+                        variant_ids : np.ndarray):
+        """
+        The variants of a job, stored as columns
+
+        Parameters
+        ----------
+        seq_hash : str
+            The protein of every variant
+
+        reference_aa, alternate_aa : np.ndarray
+            The one letter residues of each substitution
+
+        position : np.ndarray
+            The 1-based position of each substitution
+
+        score : np.ndarray
+            The MutPred2 score of each variant
+
+        option_id : int
+            The run option shared by all variants
+
+        variant_ids : np.ndarray
+            The variant_id of each variant, identical to Variant.variant_id
+        """
+        self.seq_hash = seq_hash
+        self.reference_aa = reference_aa
+        self.position = position
+        self.alternate_aa = alternate_aa
+        self.score = score
+        self.option_id = option_id
+        self.variant_ids = variant_ids
+
+    @staticmethod
+    def parse_substitutions(substitutions : Iterable[str], strict : bool=True) -> Dict[str,np.ndarray]:
+        """
+        Parse substitutions such as 'M1A' into reference_aa, position and alternate_aa arrays at once,
+        raising a ValueError listing the substitutions that are malformed or use invalid residues.
+        If not strict, invalid substitutions are flagged in a `valid` array (with position 0) instead
+        """
+        substitutions = np.asarray(substitutions, dtype=str)
+        n = len(substitutions)
+        if n == 0:
+            return dict(reference_aa=np.array([], dtype='<U1'), position=np.array([], dtype=np.int64),
+                        alternate_aa=np.array([], dtype='<U1'), valid=np.array([], dtype=bool))
+        if substitutions.dtype.itemsize == 0:
+            substitutions = substitutions.astype('<U1')
+        width = substitutions.dtype.itemsize // 4
+        codes = np.ascontiguousarray(substitutions).view(np.uint32).reshape(n, width)
+        lengths = np.char.str_len(substitutions)
+        last = np.maximum(lengths - 1, 0)
+        reference = codes[:, 0]
+        alternate = codes[np.arange(n), last]
+        digits = codes.astype(np.int64) - ord('0')
+        columns = np.arange(width)[None, :]
+        is_position = (columns >= 1) & (columns < last[:, None])
+        malformed = (lengths < 3) | np.any(is_position & ((digits < 0) | (digits > 9)), axis=1)
+        if strict and malformed.any():
+            raise JobDataError(substitution_report(substitutions, malformed, "are malformed"))
+        invalid = malformed | ~np.isin(reference, RESIDUE_CODES) | ~np.isin(alternate, RESIDUE_CODES)
+        if strict and invalid.any():
+            raise JobDataError(substitution_report(substitutions, invalid, "have invalid residues"))
+        exponent = np.clip(last[:, None] - 1 - columns, 0, None)
+        position = np.sum(np.where(is_position & ~malformed[:, None], digits * 10 ** exponent, 0), axis=1)
+        return dict(reference_aa=reference.view('<U1'), position=position, alternate_aa=alternate.view('<U1'), valid=~invalid)
+
+    @staticmethod
+    def from_substitutions(seq_hash : str, substitutions : Iterable[str], scores : Iterable[float], option_id : int, n_jobs : int=1) -> "VariantBatch":
+        """
+        Build the variants of a job from its substitutions and MutPred2 scores (truncated to the shorter of the two)
+
+        Parameters
+        ----------
+        n_jobs : int
+            The number of processes computing the variant ids; only used for jobs of more than hash_chunk_size variants
+        """
+        scores = np.asarray(scores, dtype=float)
+        substitutions = list(substitutions)
+        n = min(len(substitutions), len(scores))
+        parsed = VariantBatch.parse_substitutions(substitutions[:n])
+        reference_aa, position, alternate_aa = parsed['reference_aa'], parsed['position'], parsed['alternate_aa']
+        chunks = [slice(start, start + VariantBatch.hash_chunk_size) for start in range(0, n, VariantBatch.hash_chunk_size)]
+        chunk_args = [(seq_hash, reference_aa[chunk].tolist(), position[chunk].tolist(), alternate_aa[chunk].tolist(), option_id) for chunk in chunks]
+        if n_jobs > 1 and len(chunks) > 1:
+            from joblib import Parallel, delayed
+            hashes = Parallel(n_jobs=n_jobs)(delayed(variant_hashes)(*args) for args in chunk_args)
+        else:
+            hashes = [variant_hashes(*args) for args in chunk_args]
+        variant_ids = np.array([variant_id for chunk in hashes for variant_id in chunk], dtype=object)
+        return VariantBatch(seq_hash, reference_aa, position, alternate_aa, scores[:n], option_id, variant_ids)
+
+    def validate(self, sequence : Sequence) -> None:
+        """
+        Raise a ValueError listing the substitutions whose reference residue does not match the sequence
+        """
+        residues = np.frombuffer(sequence.seq.encode('utf-32-le'), dtype=np.uint32)
+        in_range = (self.position >= 1) & (self.position <= len(residues))
+        mismatch = ~in_range
+        mismatch[in_range] = residues[self.position[in_range] - 1] != self.reference_aa[in_range].view(np.uint32)
+        if mismatch.any():
+            raise JobDataError(substitution_report(self.substitutions(), mismatch,
+                                                    f"do not match sequence {sequence.seq_hash} (length {len(residues)})"))
+
+    def substitutions(self) -> np.ndarray:
+        return np.char.add(np.char.add(self.reference_aa, self.position.astype(str)), self.alternate_aa)
+
+    def __len__(self) -> int:
+        return len(self.variant_ids)
+
+    def __getitem__(self, index : slice|np.ndarray) -> "VariantBatch":
+        return VariantBatch(self.seq_hash,
+                            self.reference_aa[index],
+                            self.position[index],
+                            self.alternate_aa[index],
+                            self.score[index],
+                            self.option_id,
+                            self.variant_ids[index])
+
+    def __iter__(self) -> Iterator[Variant]:
+        for substitution, score in zip(self.substitutions().tolist(), self.score.tolist()):
+            yield Variant(self.seq_hash, substitution, score, self.option_id)
+
+    def to_arrays(self) -> Dict[str,np.ndarray]:
+        return dict(variant_id=self.variant_ids,
+                    seq_hash=np.full(len(self), self.seq_hash, dtype=object),
+                    reference_aa=self.reference_aa,
+                    position=self.position,
+                    alternate_aa=self.alternate_aa,
+                    score=self.score,
+                    option_id=np.full(len(self), self.option_id))
+
+    def to_frame(self) -> "pd.DataFrame":
+        import pandas as pd
+        return pd.DataFrame(self.to_arrays())
+
+    def rows(self) -> Iterator[tuple]:
+        """
+        Yield rows in sql_connection.VARIANT_COLUMNS order, a chunk at a time
+        """
+        for start in range(0, len(self), self.row_chunk_size):
+            chunk = slice(start, start + self.row_chunk_size)
+            for variant_id, ref, pos, alt, score in zip(self.variant_ids[chunk].tolist(),
+                                                        self.reference_aa[chunk].tolist(),
+                                                        self.position[chunk].tolist(),
+                                                        self.alternate_aa[chunk].tolist(),
+                                                        self.score[chunk].tolist()):
+                yield (variant_id, self.seq_hash, ref, pos, alt, score, self.option_id)
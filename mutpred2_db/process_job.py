@@ -1,66 +1,252 @@
-from models.job_processor import Processor
 from models.sql_connection import SQL_Connection, initialize_mechanisms
+from models.job_runner import process_job, load_staging_dir, release_worker_resources, share_worker_resources, uses_database
+from models.pipeline import JobPipeline
+from models.job_manifest import JobManifest, job_fingerprint
+from models.schema import begin_bulk_load, finish_bulk_load
+from models.instrumentation import Instrumentation
+from models.job_queue import QueueWorker, open_job_queue
+from models.run_config import (PipelineConfig, ManifestConfig, BulkLoadConfig, InstrumentationConfig, JobQueueConfig,
+                                option_config)
 from fire import Fire
-from sqlalchemy.exc import DatabaseError
-import mysql.connector
 
 from tqdm import tqdm
 # tqdm.__init__ = partialmethod(tqdm.__init__, disable=True)
 
-class FileCursor:
-    def __init__(self, filepath):
-        self.file = open(filepath, 'w')
+def end_bulk_load(cursor, cnx) -> None:
+    """
+    Rebuild the read indexes and report the orphan rows after a bulk load, even if the load failed part way
+    """
+    created, orphans = finish_bulk_load(cursor, cnx)
+    print(f"Bulk load: rebuilt indexes {created}")
+    if len(orphans) > 0:
+        print(f"REFERENTIAL_INTEGRITY_ERROR: orphan rows {orphans}")
+    else:
+        print("Bulk load: referential integrity verified")
 
-    def __exit__(self):
-        super().__exit__()
+def process_job_list(sql_config_name : str, sql_config_file : str,
+                    job_list_file : str|None=None,
+                    job_path : str|None=None,
+                    staging_dir : str|None=None,
+                    load_data : str="job",
+                    workers : int=1,
+                    parquet_dir : str|None=None,
+                    pipeline : bool|dict|PipelineConfig=False,
+                    manifest : str|dict|ManifestConfig|None=None,
+                    bulk_load : bool|dict|BulkLoadConfig=False,
+                    instrument : str|dict|InstrumentationConfig|None=None,
+                    job_queue : str|dict|JobQueueConfig|None=None,**run_option_kwargs):
+    """
+    Process MutPred2 jobs and write them to the database
 
-    def execute(self, query, data=None):
-        if data is not None:
-            query = query.replace("%s","{}")
-            w = query.format(*data)
-        else:
-            w = query
-        self.file.write(w)
-        self.file.write("\n")
+    The options of pipeline, manifest, bulk_load, instrument and job_queue are grouped per feature (see run_config):
+    each is given as a flag or its main value (e.g. --pipeline, --manifest=path) or as a dict of its options
+    (e.g. --pipeline='{writers: 2, queue_depth: 8}', --job_queue='{location: database, stale_seconds: 300}')
 
-class FileConnection:
-    def __init__(self, filepath):
-        self._cursor = FileCursor(filepath)
+    Parameters
+    ----------
+    sql_config_name, sql_config_file : str
+        The entry of the yaml config file holding the database credentials
 
-    @property
-    def cursor(self):
-        return self._cursor
+    job_list_file : str|None
+        A file listing one job directory per line
 
-    def commit(self):
-        self._cursor.file.flush()
+    job_path : str|None
+        A single job directory
 
+    staging_dir : str|None
+        If given, stream each table's rows into <staging_dir>/<table>.tsv and bulk load them with LOAD DATA LOCAL INFILE
+        (requires local_infile to be enabled on the server). Without jobs, loads files already staged in staging_dir
 
-def process_job_list(sql_config_name : str, sql_config_file : str,
-                    job_list_file : str|None=None,
-                    job_path : str|None=None,**run_option_kwargs):
+    load_data : str
+        When staged files are loaded: "job" (after each job), "list" (after the whole job list)
+        or "none" (only write the staging files, no database connection is opened)
+
+    workers : int
+        The number of processes jobs are fanned out to; each process opens its own connection, closed when it exits
+        (and, when staging, its own <staging_dir>/worker_<pid> directory). With 1, jobs are processed in this process
+        on its connection
+
+    parquet_dir : str|None
+        If given, write each job to a Parquet dataset in parquet_dir (partitioned by seq_hash prefix, see
+        parquet_sink.ParquetSink) instead of the database; no database connection is opened
+
+    pipeline : bool|dict|PipelineConfig
+        Overlap parsing and writing: `readers` processes decode upcoming jobs while `writers` threads
+        (at most 4, each holding a connection of a pool sized for them) write parsed jobs. At most `queue_depth` parsed jobs
+        wait to be written. Per-stage throughput is printed at the end. Not combined with staging_dir or workers
+
+    manifest : str|dict|ManifestConfig|None
+        An LMDB directory (`path`) recording the fingerprint, status, row counts and time of every job (see job_manifest.JobManifest).
+        Jobs already done whose files are unchanged are skipped, and with `retry_failed_only`, only the jobs recorded as
+        failed are processed. With load_data="list", jobs are recorded once the staged files are loaded
+
+    bulk_load : bool|dict|BulkLoadConfig
+        Load-optimized mode for initial loads: the read indexes (schema.READ_INDEXES) are dropped and foreign key checks
+        are disabled on every writing connection. After the load the indexes are rebuilt and referential integrity is
+        verified with one anti-join per foreign key; orphan rows are reported. UNIQUE constraints are kept.
+        With `compress_features`, the features_* tables are rebuilt with ROW_FORMAT=COMPRESSED before loading
+
+    instrument : str|dict|InstrumentationConfig|None
+        Instrument the run: with `metrics_log` (the main value), append one JSON line per job to this file: the time
+        of each stage (directory scan, each read_mat_files call, object construction), the rows, approximate bytes,
+        statements and time of each table write, the commits, and the database round-trip latency histogram
+        (see instrumentation.JobMetrics); with `prometheus_file`, keep the totals in this Prometheus text-format file,
+        rewritten after every job. The `slowest_jobs` are summarized at the end. Failed jobs are recorded with their
+        error, including a job whose unexpected error stops the run. With `profile_dir`, each job is run under cProfile
+        and its stats dumped to <profile_dir>/<job path>.prof (not combined with pipeline)
+
+    job_queue : str|dict|JobQueueConfig|None
+        Distributed scheduling: the queue `location`, "database" (the JobQueue table) or a directory shared by the
+        nodes (a lock-file queue, see job_queue.LockDirJobQueue). The jobs of job_list_file or job_path (if any, after
+        the manifest filter) are added to the queue with a size estimate, then the jobs are claimed one at a time,
+        largest first, until the queue is empty, so any number of process_job_list runs on any node share the work.
+        Claimed jobs send a heartbeat every `heartbeat_seconds`, and the claims of workers without a heartbeat for
+        `stale_seconds` are released back to the queue. Jobs that failed stay failed when seeded again; with
+        `requeue_failed`, they are returned to pending first (e.g. --job_queue='{location: database, requeue_failed: true}').
+        Combines with workers and pipeline
+
+    run_option_kwargs
+        Run options (see run_options.py) and optional arguments of Processor.process. With --streaming, each job is
+        processed one shard at a time (see Processor.process_streaming) and --max_rss_mb aborts jobs whose resident
+        memory exceeds it. Streaming is not combined with pipeline. With --delta_sync=keys (or content), re-ingested
+        jobs only write the rows missing from the database (and update the changed ones), see Processor.process;
+        delta_sync is not combined with staging_dir or parquet_dir. With --table_writers=N, the mechanism and feature
+        tables of each job are written concurrently on N more pooled connections per worker or pipeline writer, committed
+        after the job's Protein and Variant rows (see Processor.write_concurrently)
+    """
+    pipeline = option_config(PipelineConfig, pipeline)
+    manifest = option_config(ManifestConfig, manifest, "path", "manifest")
+    bulk_load = option_config(BulkLoadConfig, bulk_load)
+    instrument = option_config(InstrumentationConfig, instrument, "metrics_log", "instrument")
+    job_queue = option_config(JobQueueConfig, job_queue, "location", "job_queue")
+    profile_dir = instrument.profile_dir if instrument is not None else None
     if job_list_file is not None:
         with open(job_list_file,'r') as file:
             job_list = list(map(str.strip, file.readlines()))
     elif job_path is not None:
         job_list = [job_path, ]
+    elif staging_dir is not None or job_queue is not None:
+        job_list = []
     else:
         raise ValueError("Either job_list_file or job_path must be provided")
-    sql_connection = SQL_Connection(sql_config_name, sql_config_file)
-    cursor, cnx = sql_connection.open()
-    initialize_mechanisms(cursor,cnx)
-    def process_job(cursor, cnx, job_dir : str, sql_config_name : str, sql_config_file : str,**run_option_kwargs):
-        job_processor = Processor(cursor, cnx)
-        job_processor.process(job_dir, write_to_db=True,**run_option_kwargs)
-    failed_jobs = []
-    for job in tqdm(job_list):
+    if load_data not in ("job", "list", "none"):
+        raise ValueError(f"load_data must be one of 'job', 'list' or 'none', not {load_data}")
+    if pipeline is not None and (staging_dir is not None or parquet_dir is not None or workers != 1):
+        raise ValueError("pipeline cannot be combined with staging_dir, parquet_dir or workers")
+    if pipeline is not None and run_option_kwargs.get('streaming', False):
+        raise ValueError("pipeline cannot be combined with streaming")
+    if staging_dir is not None and parquet_dir is not None:
+        raise ValueError("Only one of staging_dir and parquet_dir can be provided")
+    if pipeline is not None and profile_dir is not None:
+        raise ValueError("pipeline cannot be combined with profile_dir")
+    if run_option_kwargs.get('delta_sync') is not None and (staging_dir is not None or parquet_dir is not None):
+        raise ValueError("delta_sync cannot be combined with staging_dir or parquet_dir")
+    job_manifest, fingerprints = None, {}
+    if manifest is not None:
+        job_manifest = JobManifest(manifest.path)
+        fingerprints = {job : job_fingerprint(job) for job in job_list}
+        n_jobs = len(job_list)
+        job_list = [job for job in job_list if job_manifest.should_process(job, fingerprints[job], manifest.retry_failed_only)]
+        print(f"Skipping {n_jobs - len(job_list)} of {n_jobs} jobs recorded in {manifest.path}")
+    queue_worker = None
+    if job_queue is not None:
+        work_queue = open_job_queue(job_queue.location, sql_config_name, sql_config_file)
+        if job_queue.requeue_failed:
+            print(f"Requeued {work_queue.requeue_failed()} failed jobs in {job_queue.location}")
+        print(f"Queued {work_queue.seed(job_list)} of {len(job_list)} jobs in {job_queue.location}")
+        queue_worker = QueueWorker(work_queue, heartbeat_seconds=job_queue.heartbeat_seconds, stale_seconds=job_queue.stale_seconds)
+        job_list = queue_worker.jobs()
+    total_jobs = len(job_list) if isinstance(job_list, list) else None
+    use_db = uses_database(staging_dir, load_data, parquet_dir)
+    if use_db:
+        table_writers = run_option_kwargs.get('table_writers', 1)
+        if pipeline is not None:
+            pool_size = JobPipeline.connections(pipeline.writers, table_writers)
+        else:
+            pool_size = table_writers + 1 if workers == 1 and table_writers > 1 else None
+        sql_connection = SQL_Connection(sql_config_name, sql_config_file, allow_local_infile=staging_dir is not None, pool_size=pool_size)
+        cursor, cnx = sql_connection.open()
+        initialize_mechanisms(cursor,cnx)
+    bulk_load = bulk_load if use_db else None
+    try:
+        if bulk_load is not None:
+            dropped = begin_bulk_load(cursor, cnx, compress_features=bulk_load.compress_features)
+            print(f"Bulk load: foreign key checks disabled, dropped indexes {dropped}")
+        instrumentation = None
+        if instrument is not None and instrument.records_metrics:
+            instrumentation = Instrumentation(instrument.metrics_log, instrument.prometheus_file, slowest=instrument.slowest_jobs)
+        job_kwargs = dict(sql_config_name=sql_config_name, sql_config_file=sql_config_file,
+                            staging_dir=staging_dir, load_data=load_data, workers=workers, parquet_dir=parquet_dir,
+                            bulk_load=bulk_load is not None, instrument=instrumentation is not None, profile_dir=profile_dir, **run_option_kwargs)
+        if pipeline is not None:
+            job_pipeline = JobPipeline(sql_connection, readers=pipeline.readers, writers=pipeline.writers, queue_depth=pipeline.queue_depth,
+                                        bulk_load=bulk_load is not None, instrument=instrumentation is not None, **run_option_kwargs)
+            results = job_pipeline.run(job_list)
+        elif workers == 1:
+            if use_db:
+                share_worker_resources(sql_connection, cursor, cnx)
+            results = (process_job(job, **job_kwargs) for job in job_list)
+        else:
+            from joblib import Parallel, delayed
+            results = Parallel(n_jobs=workers, return_as="generator_unordered")(delayed(process_job)(job, **job_kwargs) for job in job_list)
+        failed_jobs = []
+        job_records = []
+        sync_counts = {}
+        peak_rss = 0.0
+        defer_records = staging_dir is not None and load_data == "list"
         try:
-            process_job(cursor, cnx, job, sql_config_name, sql_config_file, **run_option_kwargs)
-        except (DatabaseError, mysql.connector.errors.DatabaseError) as e:
-            print(f"JOB_ERROR: Error processing {job}")
-            failed_jobs.append(job)
-            print(e)
-            continue
-    sql_connection.close(cursor,cnx)
+            for job, error, stats in tqdm(results, total=total_jobs):
+                if error is not None:
+                    print(f"JOB_ERROR: Error processing {job}")
+                    failed_jobs.append(job)
+                    print(error)
+                peak_rss = max(peak_rss, stats.get('peak_rss_mb') or 0.0)
+                for table, counts in stats.get('sync', {}).items():
+                    table_counts = sync_counts.setdefault(table, dict(inserted=0, updated=0, unchanged=0))
+                    for k, count in counts.items():
+                        table_counts[k] += count
+                if instrumentation is not None and 'metrics' in stats:
+                    instrumentation.record(stats['metrics'])
+                    instrumentation.write_prometheus()
+                if queue_worker is not None:
+                    queue_worker.complete(job, error)
+                if job_manifest is not None:
+                    fingerprint = fingerprints[job] if job in fingerprints else job_fingerprint(job)
+                    if defer_records:
+                        job_records.append((job, fingerprint, error, stats))
+                    else:
+                        job_manifest.record(job, fingerprint, error, stats)
+        except Exception as e:
+            job_stats = getattr(e, 'job_stats', {})
+            if instrumentation is not None and 'metrics' in job_stats:
+                instrumentation.record(job_stats['metrics'])
+                instrumentation.write_prometheus()
+            raise e
+        release_worker_resources()
+        if pipeline is not None:
+            print(job_pipeline.summary())
+        if len(sync_counts) > 0:
+            print(f"Delta sync: {sync_counts}")
+        if peak_rss > 0:
+            print(f"Peak RSS of a job process: {peak_rss:.0f} MB")
+        if queue_worker is not None:
+            queue_worker.stop()
+            print(f"Job queue {job_queue.location}: {queue_worker.job_queue.counts()}")
+        if instrumentation is not None:
+            print(instrumentation.summary())
+            instrumentation.close()
+        if use_db and staging_dir is not None and (load_data == "list" or total_jobs == 0):
+            load_staging_dir(cursor, cnx, staging_dir)
+    finally:
+        if bulk_load is not None:
+            end_bulk_load(cursor, cnx)
+        if use_db:
+            sql_connection.close(cnx, cursor)
+    if job_manifest is not None:
+        for job_record in job_records:
+            job_manifest.record(*job_record)
+        print(f"Manifest {manifest.path}: {job_manifest.summary()}")
+        job_manifest.close()
     if len(failed_jobs) > 0:
         print("Failed jobs:")
         for job in failed_jobs:
@@ -0,0 +1,106 @@
+from models.synthetic_job import write_synthetic_jobs
+from models.benchmark import run_benchmarks, save_baseline, load_baseline, compare_to_baseline, startup_report, STARTUP_BUDGETS
+from fire import Fire
+from pathlib import Path
+import tempfile
+
+def generate(output_dir : str, n_jobs : int=4, protein_length : int=500, n_variants : int|None=None, n_shards : int=4, seed : int=0):
+    """
+    Write n_jobs synthetic MutPred2 jobs to <output_dir>/job_<i> (see models/synthetic_job.write_synthetic_job)
+
+    Parameters
+    ----------
+    protein_length : int
+        The length of each protein
+
+    n_variants : int|None
+        The number of variants of each job (default: every substitution, 19 * protein_length)
+
+    n_shards : int
+        The number of shards of each job
+    """
+    job_dirs = write_synthetic_jobs(output_dir, n_jobs, seed=seed, protein_length=protein_length, n_variants=n_variants, n_shards=n_shards)
+    print(f"Wrote {len(job_dirs)} jobs to {output_dir}")
+
+def run(job_dir : str|None=None,
+        n_jobs : int=2,
+        protein_length : int=300,
+        n_variants : int|None=None,
+        n_shards : int=4,
+        database : str|None=None,
+        batch_size : int|None=None,
+        baseline : str|None=None,
+        save : bool=False,
+        tolerance : float=0.2,
+        **processor_kwargs):
+    """
+    Benchmark each Processor stage and each sql_connection writer (against a local SQLite stand-in database)
+    and report variants/s, rows/s and memory
+
+    Parameters
+    ----------
+    job_dir : str|None
+        A directory of job_* directories to benchmark; by default n_jobs synthetic jobs of protein_length residues,
+        n_variants variants and n_shards shards are generated in a temporary directory
+
+    database : str|None
+        The stand-in SQLite database file (default: a temporary file)
+
+    batch_size : int|None
+        The number of rows per INSERT statement
+
+    baseline : str|None
+        A JSON baseline: with --save the results are written to it, otherwise they are compared to it and the
+        stages or writers whose rows/s dropped by more than tolerance are reported as regressions
+
+    processor_kwargs
+        Optional arguments of Processor, e.g. --load_threads or --feature_dtype=float16
+    """
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        if job_dir is None:
+            job_dirs = write_synthetic_jobs(Path(tmp_dir) / "jobs", n_jobs, protein_length=protein_length, n_variants=n_variants, n_shards=n_shards)
+        else:
+            job_dirs = sorted(str(path) for path in Path(job_dir).glob("job_*") if path.is_dir())
+        report = run_benchmarks(job_dirs, database or Path(tmp_dir) / "standin.db", batch_size=batch_size, **processor_kwargs)
+    print(f"{'benchmark':<50}{'seconds':>10}{'variants/s':>14}{'rows/s':>14}{'RSS MB':>10}")
+    for name, entry in report['results'].items():
+        print(f"{name:<50}{entry['seconds']:>10.3f}{entry['variants_per_s']:>14.0f}{entry['rows_per_s']:>14.0f}{entry['rss_mb']:>10.0f}")
+    print(f"Peak RSS: {report['peak_rss_mb']:.0f} MB")
+    if baseline is None:
+        return
+    if save:
+        save_baseline(report, baseline)
+        print(f"Saved baseline {baseline}")
+        return
+    regressions = compare_to_baseline(report, load_baseline(baseline), tolerance=tolerance)
+    for name, regression in regressions.items():
+        print(f"REGRESSION: {name} {regression['rows_per_s']:.0f} rows/s, baseline {regression['baseline_rows_per_s']:.0f} rows/s "
+                f"({regression['ratio']:.0%})")
+    if len(regressions) == 0:
+        print(f"No regression beyond {tolerance:.0%} of {baseline}")
+
+def startup(repeats : int=3, **budgets):
+    """
+    Measure the import time of the CLI modules against their budgets (models/benchmark.STARTUP_BUDGETS),
+    reporting the modules over budget
+
+    Parameters
+    ----------
+    repeats : int
+        The number of fresh interpreters timed per module (the best is kept)
+
+    budgets
+        Budgets in seconds overriding the defaults, e.g. --process_job=1.0
+    """
+    report = startup_report(Path(__file__).parent, {**STARTUP_BUDGETS, **budgets}, repeats=repeats)
+    print(f"{'module':<30}{'seconds':>10}{'budget':>10}")
+    for module, entry in report.items():
+        print(f"{module:<30}{entry['seconds']:>10.3f}{entry['budget_seconds']:>10.3f}")
+    over_budget = [module for module, entry in report.items() if entry['over_budget']]
+    for module in over_budget:
+        print(f"REGRESSION: importing {module} takes {report[module]['seconds']:.3f}s, over its {report[module]['budget_seconds']:.3f}s budget")
+    if len(over_budget) == 0:
+        print("All modules within their startup budget")
+
+if __name__ == "__main__":
+    Fire({"generate" : generate, "run" : run, "startup" : startup})
@@ -0,0 +1,74 @@
+from models.sql_connection import SQL_Connection
+from models.sqlite_connection import SQLiteConnection
+from models.lookup_service import LookupService, request_latencies
+from fire import Fire
+import asyncio
+import json
+import time
+
+import numpy as np
+
+def serve(sql_config_name : str|None=None, sql_config_file : str|None=None,
+            sqlite : str|None=None,
+            host : str="127.0.0.1",
+            port : int=8080,
+            pool_size : int=8,
+            cache_size : int=10000,
+            cache_ttl : float=300.0,
+            batch_delay_ms : float=2.0,
+            max_batch : int=500,
+            option_id : int|None=None):
+    """
+    Serve variant, protein and mechanism lookups over HTTP/JSON (see models/lookup_service.LookupService)
+
+    Parameters
+    ----------
+    sql_config_name, sql_config_file : str
+        The entry of the yaml config file holding the database credentials
+
+    sqlite : str|None
+        Serve a local SQLite database with the same tables instead
+
+    pool_size : int
+        The number of pooled connections, i.e. of queries run concurrently
+
+    cache_size, cache_ttl : int, float
+        The number of cached responses and the seconds they stay valid
+
+    batch_delay_ms : float
+        How long point lookups wait to be batched with concurrent ones
+
+    max_batch : int
+        The maximum number of keys per query
+
+    option_id : int|None
+        If given, only return variants computed with this run option
+    """
+    if sqlite is not None:
+        sql_connection = SQLiteConnection(sqlite)
+    elif sql_config_name is not None and sql_config_file is not None:
+        sql_connection = SQL_Connection(sql_config_name, sql_config_file, pool_name="lookup_service", pool_size=pool_size)
+    else:
+        raise ValueError("Either sqlite or sql_config_name and sql_config_file must be provided")
+    service = LookupService(sql_connection, pool_size=pool_size, cache_size=cache_size, cache_ttl=cache_ttl,
+                            batch_delay=batch_delay_ms / 1000, max_batch=max_batch, option_id=option_id)
+    try:
+        asyncio.run(service.serve(host, port))
+    except KeyboardInterrupt:
+        print(json.dumps(service.stats(), indent=2))
+
+def load_test(paths_file : str, host : str="127.0.0.1", port : int=8080, concurrency : int=32):
+    """
+    Request every path listed in paths_file (one per line, e.g. /variant/<variant_id>) from a running service
+    and print the client-side p50/p99 latency and throughput
+    """
+    with open(paths_file, 'r') as file:
+        paths = [line.strip() for line in file if line.strip()]
+    start = time.perf_counter()
+    latencies = asyncio.run(request_latencies(host, port, paths, concurrency))
+    seconds = time.perf_counter() - start
+    p50, p99 = np.percentile(latencies, [50, 99]) * 1000
+    print(f"{len(latencies)} requests in {seconds:.2f}s ({len(latencies) / seconds:.0f} requests/s), p50 {p50:.2f} ms, p99 {p99:.2f} ms")
+
+if __name__ == "__main__":
+    Fire({"serve" : serve, "load_test" : load_test})
@@ -16,6 +16,10 @@ DROP TABLE IF EXISTS `features_conservation`;
 DROP TABLE IF EXISTS `features_homology`;
 DROP TABLE IF EXISTS `features_structure`;
 DROP TABLE IF EXISTS `features_function`;
+DROP TABLE IF EXISTS `FeatureVector`;
+DROP TABLE IF EXISTS `FeatureSite`;
+DROP TABLE IF EXISTS `FeatureSiteVariant`;
+DROP TABLE IF EXISTS `JobQueue`;
 SET FOREIGN_KEY_CHECKS = 1;
 
 CREATE TABLE Protein (
@@ -45,6 +49,8 @@ CREATE TABLE Variant (
         FOREIGN KEY (seq_hash) REFERENCES Protein(seq_hash),
         FOREIGN KEY (option_id) REFERENCES RunOption(option_id));
 
+CREATE INDEX variant_position_idx ON Variant (seq_hash, position);
+
 
 CREATE TABLE Mechanism(
     mechanism_id int UNSIGNED NOT NULL PRIMARY KEY,
@@ -63,6 +69,8 @@ CREATE TABLE VariantMechanism(
         FOREIGN KEY (mechanism_id) REFERENCES Mechanism(mechanism_id),
         FOREIGN KEY (variant_id) REFERENCES Variant(variant_id));
 
+CREATE INDEX variant_mechanism_pvalue_idx ON VariantMechanism (mechanism_id, pvalue);
+
 CREATE TABLE SequenceMapping(
     seq_hash CHAR(32) NOT NULL,
     ensembl_prot_id CHAR(20),
@@ -73,6 +81,7 @@ CREATE TABLE SequenceMapping(
     FOREIGN KEY (seq_hash) REFERENCES Protein(seq_hash));
 
 CREATE INDEX ensembl_transcript_idx ON SequenceMapping (ensembl_nuc_id(17));
+CREATE INDEX gene_symbol_idx ON SequenceMapping (gene_symbol(32));
 
 CREATE TABLE notes(
     variant_id CHAR(32) UNIQUE NOT NULL,
@@ -1493,6 +1502,52 @@ CREATE TABLE features_function (
         Ubiquitylation_exist FLOAT(5),
         Motifs_exist FLOAT(5));
 
+-- Optional packed alternative to the features_* tables: the 1345 features of a variant, in features_* column order,
+-- as one little endian float32 (5380 bytes) or float16 (2690 bytes) blob (see mutpred2_db/models/feature_codec.py)
+CREATE TABLE FeatureVector (
+        variant_id CHAR(32) NOT NULL,
+        FOREIGN KEY (variant_id) REFERENCES Variant(variant_id),
+        runoption_id int UNSIGNED NOT NULL,
+        FOREIGN KEY (runoption_id) REFERENCES RunOption(option_id),
+        dtype ENUM('float32','float16') NOT NULL,
+        features BLOB NOT NULL,
+        PRIMARY KEY (variant_id, runoption_id));
+
+-- Optional site-deduplicated alternative to FeatureVector (see mutpred2_db/models/feature_sites.py): the feature columns
+-- constant among the substitutions of every position of a job are stored once per position, in FeatureSite, with the
+-- bit mask (packbits, 169 bytes) of those columns; the remaining columns of each variant are stored in FeatureSiteVariant
+CREATE TABLE FeatureSite (
+        seq_hash CHAR(32) NOT NULL,
+        FOREIGN KEY (seq_hash) REFERENCES Protein(seq_hash),
+        position int UNSIGNED NOT NULL,
+        runoption_id int UNSIGNED NOT NULL,
+        FOREIGN KEY (runoption_id) REFERENCES RunOption(option_id),
+        dtype ENUM('float32','float16') NOT NULL,
+        site_mask VARBINARY(169) NOT NULL,
+        features BLOB NOT NULL,
+        PRIMARY KEY (seq_hash, position, runoption_id));
+
+CREATE TABLE FeatureSiteVariant (
+        variant_id CHAR(32) NOT NULL,
+        FOREIGN KEY (variant_id) REFERENCES Variant(variant_id),
+        runoption_id int UNSIGNED NOT NULL,
+        FOREIGN KEY (runoption_id) REFERENCES RunOption(option_id),
+        dtype ENUM('float32','float16') NOT NULL,
+        features BLOB NOT NULL,
+        PRIMARY KEY (variant_id, runoption_id));
+
+-- Jobs shared by distributed process_job_list workers (see mutpred2_db/models/job_queue.py), keyed by the md5 of job_dir
+CREATE TABLE JobQueue (
+        job_key CHAR(32) PRIMARY KEY NOT NULL,
+        job_dir TEXT NOT NULL,
+        size_bytes BIGINT UNSIGNED NOT NULL DEFAULT 0,
+        status ENUM('pending','claimed','done','failed') NOT NULL DEFAULT 'pending',
+        worker VARCHAR(255),
+        claimed_at DATETIME,
+        heartbeat_at DATETIME,
+        attempts int UNSIGNED NOT NULL DEFAULT 0,
+        error TEXT,
+        INDEX job_queue_claim_idx (status, size_bytes));
 
 
 
@@ -0,0 +1,36 @@
+from pathlib import Path
+import sys
+
+import pytest
+
+# The modules import each other as models.<module>, as when the scripts are run from mutpred2_db
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "mutpred2_db"))
+
+from models import benchmark
+from models.sqlite_connection import SQLiteConnection
+from models.sql_connection import initialize_mechanisms
+from models.synthetic_job import write_synthetic_job
+
+@pytest.fixture
+def database(tmp_path):
+    """
+    A SQLite stand-in database with the ingested tables and the Mechanism rows, as (connection, cursor, cnx)
+    """
+    connection = SQLiteConnection(tmp_path / "standin.db")
+    cursor, cnx = connection.open()
+    benchmark.create_standin_tables(cursor, cnx)
+    initialize_mechanisms(cursor, cnx)
+    yield connection, cursor, cnx
+    connection.close(cnx, cursor)
+
+@pytest.fixture
+def job_dir(tmp_path) -> str:
+    """
+    A small synthetic job: 30 variants of a 20 residue protein in 3 shards, so positions hold several variants
+    """
+    write_synthetic_job(tmp_path / "job", protein_length=20, n_variants=30, n_shards=3, seed=1)
+    return str(tmp_path / "job")
+
+def table_rows(cursor, table : str) -> list:
+    cursor.execute(f"SELECT * FROM {table}")
+    return sorted(tuple(row) for row in cursor.fetchall())
@@ -0,0 +1,14 @@
+import pandas as pd
+import pytest
+
+import annotate_variants
+from models.sqlite_connection import SQLiteConnection
+
+@pytest.mark.parametrize("input_text, header", [("", False), ("transcript\tsubstitution\n", True)])
+def test_empty_input_writes_header(tmp_path, monkeypatch, input_text, header):
+    monkeypatch.setattr(annotate_variants, "SQL_Connection", lambda *args : SQLiteConnection(tmp_path / "standin.db"))
+    input_file, output_file = tmp_path / "variants.tsv", tmp_path / "annotated.tsv.gz"
+    input_file.write_text(input_text)
+    annotate_variants.annotate_variants("standin", "standin.yaml", str(input_file), str(output_file), header=header)
+    frame = pd.read_csv(output_file, sep="\t")
+    assert list(frame.columns) == annotate_variants.ANNOTATION_COLUMNS and len(frame) == 0
@@ -0,0 +1,71 @@
+import pytest
+
+from models import benchmark
+from models.delta_sync import existing_rows, forget_sequences, known_sequences
+from models.job_processor import Processor
+from models.pipeline import JobPipeline
+from models.sqlite_connection import SQLiteConnection
+
+from .conftest import table_rows
+
+INGESTED_TABLES = ["Protein", "Variant", "VariantMechanism", "FeatureSite", "FeatureSiteVariant"]
+
+def stored_tables(cursor) -> dict:
+    return {table : table_rows(cursor, table) for table in INGESTED_TABLES}
+
+@pytest.fixture(autouse=True)
+def forget_known_sequences():
+    yield
+    forget_sequences()
+
+@pytest.mark.parametrize("delta_sync", ["keys", "content"])
+def test_resync_is_idempotent(database, job_dir, delta_sync):
+    connection, cursor, cnx = database
+    first = Processor(cursor, cnx, sql_connection=connection)
+    first.process(job_dir, delta_sync=delta_sync, feature_storage="site", **benchmark.RUN_OPTIONS)
+    assert all(counts['updated'] == counts['unchanged'] == 0 for counts in first.sync_counts.values())
+    stored = stored_tables(cursor)
+    second = Processor(cursor, cnx, sql_connection=connection)
+    second.process(job_dir, delta_sync=delta_sync, feature_storage="site", **benchmark.RUN_OPTIONS)
+    assert all(counts['inserted'] == counts['updated'] == 0 for counts in second.sync_counts.values())
+    assert {table : counts['unchanged'] for table, counts in second.sync_counts.items()} == \
+            {table : len(rows) for table, rows in stored.items()}
+    assert stored_tables(cursor) == stored
+
+def test_resync_updates_changed_rows(database, job_dir):
+    connection, cursor, cnx = database
+    Processor(cursor, cnx, sql_connection=connection).process(job_dir, delta_sync="keys", **benchmark.RUN_OPTIONS)
+    stored = table_rows(cursor, "Variant")
+    cursor.execute("UPDATE Variant SET score = 0 WHERE variant_id = %s", (stored[0][0],))
+    cursor.execute("DELETE FROM Variant WHERE variant_id = %s", (stored[1][0],))
+    cnx.commit()
+    processor = Processor(cursor, cnx, sql_connection=connection)
+    processor.process(job_dir, delta_sync="content", **benchmark.RUN_OPTIONS)
+    assert processor.sync_counts['Variant'] == dict(inserted=1, updated=1, unchanged=len(stored) - 2)
+    assert table_rows(cursor, "Variant") == stored
+
+def test_known_sequences_are_per_database(tmp_path, database, job_dir):
+    connection, cursor, cnx = database
+    processor = Processor(cursor, cnx, sql_connection=connection)
+    processor.process(job_dir, delta_sync="keys", **benchmark.RUN_OPTIONS)
+    seq_hash = table_rows(cursor, "Protein")[0][0]
+    assert seq_hash in known_sequences(connection)
+    assert seq_hash not in known_sequences(SQLiteConnection(tmp_path / "other.db"))
+    assert known_sequences() == set()
+
+def test_existing_rows_match_full_key(database, job_dir):
+    connection, cursor, cnx = database
+    Processor(cursor, cnx).process(job_dir, feature_storage="site", **benchmark.RUN_OPTIONS)
+    sites = [row[:3] for row in table_rows(cursor, "FeatureSite")]
+    seq_hash, position, option_id = sites[0]
+    missing = [(seq_hash, position, option_id + 1), (seq_hash, -1, option_id)]
+    found = existing_rows(cursor, "FeatureSite", sites[:2] + missing, ("dtype",), batch_size=2)
+    assert found == {key : ("float32",) for key in sites[:2]}
+
+def test_failed_write_reports_no_sync_counts(database, job_dir):
+    connection, cursor, cnx = database
+    processor = Processor(cursor, cnx, sql_connection=connection)
+    results = processor.process(job_dir, delta_sync="keys", **benchmark.RUN_OPTIONS)
+    assert JobPipeline.job_stats(processor, results, 1.0, None)['sync'] == processor.sync_counts
+    stats = JobPipeline.job_stats(processor, results, 1.0, "JobDataError: failed")
+    assert stats['rows'] == {} and 'sync' not in stats
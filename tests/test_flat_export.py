@@ -0,0 +1,50 @@
+import numpy as np
+import pandas as pd
+
+from models import benchmark
+from models.flat_export import FLAT_COLUMNS, FLAT_MECHANISMS, export_job, export_parts, job_frames, pivot_mechanisms
+from models.job_processor import Processor
+from models.mechanism import Mechanism
+from models.mechanism_block import NO_REGION_MASK, N_MECHANISMS
+
+def test_pivot_mechanisms_scatters_rows():
+    position_id = next(mechanism_id for mechanism_id, _ in FLAT_MECHANISMS if not NO_REGION_MASK[mechanism_id])
+    columns = pivot_mechanisms(2, np.array([1, 0]), np.array([position_id, position_id]), np.array(["gain", "loss"], dtype=object),
+                                np.array([12.0, np.nan]), np.array([0.25, 0.5]), np.array([0.01, 0.2]))
+    name = Mechanism.mechanism_order[position_id]
+    assert list(columns) == FLAT_COLUMNS[4:]
+    assert columns[f"{name}_position"][1] == 12 and pd.isna(columns[f"{name}_position"][0])
+    assert columns[f"{name}_posterior"].tolist() == [0.5, 0.25]
+    assert columns[f"{name}_pvalue"].tolist() == [0.2, 0.01]
+    assert columns[f"{name}_effect"].tolist() == ["loss", "gain"]
+    other = next(other_name for mechanism_id, other_name in FLAT_MECHANISMS if mechanism_id != position_id)
+    assert np.isnan(columns[f"{other}_posterior"]).all()
+    assert all(effect is None for effect in columns[f"{other}_effect"])
+
+def test_job_frames_match_mechanism_rows(job_dir):
+    results = Processor(None, None).parse(job_dir, **benchmark.RUN_OPTIONS)
+    frame = pd.concat(list(job_frames(results['variants'], results['mechanisms'], chunk_size=7)), ignore_index=True)
+    assert list(frame.columns) == FLAT_COLUMNS
+    assert frame['variant_id'].tolist() == results['variants'].variant_ids.tolist()
+    rows = frame.set_index('variant_id')
+    n_cells = 0
+    for variant_id, mechanism_id, mechanism_type, position, score, pvalue, _ in results['mechanisms'].rows():
+        if mechanism_id == Mechanism.motif_index:
+            continue
+        name = Mechanism.mechanism_order[mechanism_id]
+        row = rows.loc[variant_id]
+        assert row[f"{name}_posterior"] == score
+        assert row[f"{name}_pvalue"] == pvalue
+        assert row[f"{name}_effect"] == mechanism_type
+        if not NO_REGION_MASK[mechanism_id]:
+            assert (pd.isna(row[f"{name}_position"]) if position is None else row[f"{name}_position"] == position)
+        n_cells += 1
+    assert n_cells == len(frame) * (N_MECHANISMS - 1)
+
+def test_export_jobs(tmp_path, job_dir):
+    output_file = tmp_path / "export.tsv.gz"
+    report = export_parts([job_dir, job_dir], export_job, str(output_file), chunk_size=7, **benchmark.RUN_OPTIONS)
+    frame = pd.read_csv(output_file, sep="\t")
+    assert report['rows'] == len(frame) == 60
+    assert list(frame.columns) == FLAT_COLUMNS
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["export.tsv.gz", "job"]
@@ -0,0 +1,147 @@
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+import pytest
+from scipy.io import loadmat, savemat
+
+from models import benchmark
+from models.errors import JobDataError
+from models.feature_block import FEATURE_GROUPS
+from models.feature_codec import N_FEATURES
+from models.feature_sites import FeatureSiteBlock
+from models.job_processor import Processor
+from models.job_runner import process_job, release_worker_resources, share_worker_resources
+from models.parquet_sink import ParquetSink, read_parquet_table
+from models.sql_connection import check_site_mask, feature_set_rows, mechanism_rows, query_feature_vectors, variant_rows
+from models.sqlite_connection import SQLiteConnection
+from models.synthetic_job import write_synthetic_job
+
+from .conftest import table_rows
+
+def shard_arrays(job_dir : str, kind : str, key : str) -> np.ndarray:
+    files = sorted(Path(job_dir).glob(f"output.txt.{kind}_*.mat"), key=lambda path : int(path.stem.rsplit("_", 1)[1]))
+    return np.concatenate([loadmat(path)[key] for path in files])
+
+def stored_features(cursor, cnx, variant_ids) -> np.ndarray:
+    frame = query_feature_vectors(cursor, cnx, variant_ids, 1)
+    return frame.loc[list(variant_ids)].to_numpy()
+
+def test_parse_rows_match_objects(job_dir):
+    results = Processor(None, None).parse(job_dir, **benchmark.RUN_OPTIONS)
+    variants, mechanisms = results['variants'], results['mechanisms']
+    assert list(variants.rows()) == list(variant_rows(list(variants)))
+    assert list(mechanisms.rows()) == list(mechanism_rows(list(mechanisms)))
+    for table in FEATURE_GROUPS:
+        assert list(results[table].rows()) == list(feature_set_rows(list(results[table])))
+
+def test_parse_rows_match_job_arrays(job_dir):
+    results = Processor(None, None).parse(job_dir, **benchmark.RUN_OPTIONS)
+    substitutions = [row[0].item() for row in loadmat(Path(job_dir) / "output.txt.substitutions.mat")['substitutions'][0, 0]]
+    rows = list(results['variants'].rows())
+    assert [f"{row[2]}{row[3]}{row[4]}" for row in rows] == substitutions
+    np.testing.assert_allclose([row[5] for row in rows], shard_arrays(job_dir, "MutPred2Score", "S").ravel())
+    feats = np.hstack([results[table].values for table in FEATURE_GROUPS])
+    np.testing.assert_array_equal(feats, shard_arrays(job_dir, "feats", "feats"))
+    assert len(results['mechanisms']) == len(rows) * shard_arrays(job_dir, "prop_scores_pu", "prop_scores_pu").shape[1]
+
+def test_streaming_writes_the_same_rows(tmp_path, job_dir):
+    stored = []
+    for name, process in [("batched", Processor.process), ("streaming", Processor.process_streaming)]:
+        connection = SQLiteConnection(tmp_path / f"{name}.db")
+        cursor, cnx = connection.open()
+        benchmark.create_standin_tables(cursor, cnx)
+        process(Processor(cursor, cnx), job_dir, write_to_db=True, **benchmark.RUN_OPTIONS)
+        stored.append({table : table_rows(cursor, table) for table in ["Protein", "Variant", "VariantMechanism", *FEATURE_GROUPS]})
+        connection.close(cnx, cursor)
+    assert stored[0] == stored[1]
+
+def test_streaming_to_parquet_writes_row_groups_per_shard(tmp_path, job_dir):
+    stored = []
+    for name, process in [("batched", Processor.process), ("streaming", Processor.process_streaming)]:
+        sink = ParquetSink(tmp_path / name)
+        process(Processor(None, None, sink=sink), job_dir, write_to_db=True, **benchmark.RUN_OPTIONS)
+        stored.append({table : read_parquet_table(tmp_path / name, table).to_pylist() for table in ["Protein", "Variant", "VariantMechanism"]})
+    assert stored[0] == stored[1] and len(stored[1]['Variant']) == 30
+    variant_files = list((tmp_path / "streaming" / "Variant").glob("*/*.parquet"))
+    assert len(variant_files) == 1 and pq.ParquetFile(variant_files[0]).num_row_groups == 3
+    assert not list((tmp_path / "streaming").glob("*/*/.*.tmp"))
+
+@pytest.mark.parametrize("feature_storage", ["packed", "site"])
+def test_feature_round_trip(database, job_dir, feature_storage):
+    _, cursor, cnx = database
+    results = Processor(cursor, cnx).process(job_dir, feature_storage=feature_storage, **benchmark.RUN_OPTIONS)
+    variant_ids = results['variants'].variant_ids.tolist()
+    values = stored_features(cursor, cnx, variant_ids)
+    assert values.shape == (len(variant_ids), N_FEATURES)
+    np.testing.assert_array_equal(values, shard_arrays(job_dir, "feats", "feats").astype(np.float32))
+
+def test_site_features_share_sites(database, tmp_path):
+    _, cursor, cnx = database
+    job_dir = tmp_path / "saturated"
+    write_synthetic_job(job_dir, protein_length=4, n_shards=2, seed=2)
+    feats_files = sorted(job_dir.glob("output.txt.feats_*.mat"))
+    feats = np.concatenate([loadmat(path)['feats'] for path in feats_files])
+    # Every position holds its 19 substitutions: make the first 100 columns depend on the position only
+    feats[:, :100] = np.repeat(np.arange(4), 19)[:, None] + np.arange(100) / 100
+    start = 0
+    for path in feats_files:
+        n = len(loadmat(path)['feats'])
+        savemat(path, {"feats" : feats[start:start + n]})
+        start += n
+    results = Processor(cursor, cnx).process(str(job_dir), feature_storage="site", **benchmark.RUN_OPTIONS)
+    assert results['feature_sites'].mask.sum() == 100
+    assert len(table_rows(cursor, "FeatureSite")) == 4
+    np.testing.assert_array_equal(stored_features(cursor, cnx, results['variants'].variant_ids.tolist()), feats.astype(np.float32))
+
+def test_site_mask_conflict(database, job_dir):
+    _, cursor, cnx = database
+    Processor(cursor, cnx).process(job_dir, feature_storage="site", **benchmark.RUN_OPTIONS)
+    sites = table_rows(cursor, "FeatureSite")
+    processor = Processor(cursor, cnx)
+    results = processor.parse(job_dir, feature_storage="site", **benchmark.RUN_OPTIONS)
+    feature_sites = results['feature_sites']
+    other_mask = feature_sites.mask.copy()
+    other_mask[0] = not other_mask[0]
+    with pytest.raises(JobDataError):
+        check_site_mask(cursor, FeatureSiteBlock(feature_sites.seq_hash, feature_sites.positions, feature_sites.runoption_id,
+                                                    other_mask, feature_sites.values))
+    results['feature_sites'].mask = other_mask
+    with pytest.raises(JobDataError):
+        processor.write_job(results)
+    assert table_rows(cursor, "FeatureSite") == sites
+
+def test_max_rss_aborts_job(database, job_dir):
+    _, cursor, cnx = database
+    with pytest.raises(MemoryError):
+        Processor(cursor, cnx).process_streaming(job_dir, write_to_db=True, max_rss_mb=1, **benchmark.RUN_OPTIONS)
+    assert table_rows(cursor, "Protein") == []
+    assert table_rows(cursor, "Variant") == []
+
+def test_incomplete_job(database, job_dir):
+    connection, cursor, cnx = database
+    (Path(job_dir) / "output.txt.MutPred2Score_2.mat").unlink()
+    with pytest.raises(JobDataError):
+        Processor(None, None).parse(job_dir, **benchmark.RUN_OPTIONS)
+    share_worker_resources(connection, cursor, cnx)
+    try:
+        job, error, stats = process_job(job_dir, None, None, instrument=True, **benchmark.RUN_OPTIONS)
+    finally:
+        release_worker_resources()
+    assert job == job_dir
+    assert "MutPred2Score" in error
+    assert stats['rows'] == {}
+    assert stats['metrics']['error'] == error
+    assert table_rows(cursor, "Variant") == []
+
+def test_scores_from_output_txt(database, job_dir):
+    _, cursor, cnx = database
+    scores = shard_arrays(job_dir, "MutPred2Score", "S").ravel()
+    for path in Path(job_dir).glob("output.txt.MutPred2Score_*.mat"):
+        path.unlink()
+    pd.DataFrame({"MutPred2 score" : scores}).to_csv(Path(job_dir) / "output.txt", index=False)
+    results = Processor(None, None).parse(job_dir, **benchmark.RUN_OPTIONS)
+    np.testing.assert_allclose([row[5] for row in results['variants'].rows()], scores)
+    Processor(cursor, cnx).process_streaming(job_dir, write_to_db=True, **benchmark.RUN_OPTIONS)
+    np.testing.assert_allclose(sorted(row[5] for row in table_rows(cursor, "Variant")), sorted(scores))
@@ -0,0 +1,80 @@
+import os
+import threading
+
+from models.job_queue import LockDirJobQueue, QueueWorker
+from models.synthetic_job import write_synthetic_job
+
+def write_jobs(root, lengths) -> list:
+    job_dirs = []
+    for i, length in enumerate(lengths):
+        write_synthetic_job(root / f"job_{i}", protein_length=length, n_variants=length, n_shards=1, seed=i)
+        job_dirs.append(str(root / f"job_{i}"))
+    return job_dirs
+
+def test_seed_adds_each_job_once(tmp_path):
+    job_dirs = write_jobs(tmp_path, [5, 10, 15])
+    first, second = LockDirJobQueue(tmp_path / "queue"), LockDirJobQueue(tmp_path / "queue")
+    assert first.seed(job_dirs[:2]) == 2
+    assert second.seed(job_dirs) == 1
+    assert first.seed(job_dirs) == 0
+    assert first.counts() == dict(pending=3, claimed=0, done=0, failed=0)
+
+def test_claims_largest_first(tmp_path):
+    job_dirs = write_jobs(tmp_path, [5, 30, 15])
+    queue = LockDirJobQueue(tmp_path / "queue")
+    queue.seed(job_dirs)
+    assert [queue.claim("worker"), queue.claim("worker"), queue.claim("worker"), queue.claim("worker")] == \
+            [job_dirs[1], job_dirs[2], job_dirs[0], None]
+
+def test_concurrent_workers_claim_each_job_once(tmp_path):
+    job_dirs = write_jobs(tmp_path, range(5, 17))
+    LockDirJobQueue(tmp_path / "queue").seed(job_dirs)
+    claimed = {}
+    def work(worker : str) -> None:
+        queue_worker = QueueWorker(LockDirJobQueue(tmp_path / "queue"), worker=worker)
+        claimed[worker] = list(queue_worker.jobs())
+        for job_dir in claimed[worker]:
+            queue_worker.complete(job_dir, None if job_dir != job_dirs[0] else "failed")
+        queue_worker.stop()
+    threads = [threading.Thread(target=work, args=(f"worker_{i}",)) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(job_dir for jobs in claimed.values() for job_dir in jobs) == sorted(job_dirs)
+    assert LockDirJobQueue(tmp_path / "queue").counts() == dict(pending=0, claimed=0, done=len(job_dirs) - 1, failed=1)
+
+def test_stale_claims_are_released(tmp_path):
+    job_dirs = write_jobs(tmp_path, [5])
+    dead, alive = LockDirJobQueue(tmp_path / "queue"), LockDirJobQueue(tmp_path / "queue")
+    dead.seed(job_dirs)
+    assert dead.claim("dead") == job_dirs[0]
+    claimed_file = next((tmp_path / "queue" / "claimed").iterdir())
+    os.utime(claimed_file, (0, 0))
+    assert list(QueueWorker(alive, stale_seconds=60, worker="alive").jobs()) == job_dirs
+    dead.complete(job_dirs[0], "dead")
+    assert alive.counts() == dict(pending=0, claimed=1, done=0, failed=0)
+    alive.complete(job_dirs[0], "alive")
+    assert alive.counts() == dict(pending=0, claimed=0, done=1, failed=0)
+
+def test_claim_starts_with_fresh_heartbeat(tmp_path):
+    job_dirs = write_jobs(tmp_path, [5])
+    queue = LockDirJobQueue(tmp_path / "queue")
+    queue.seed(job_dirs)
+    os.utime(next((tmp_path / "queue" / "pending").iterdir()), (0, 0))
+    assert queue.claim("worker") == job_dirs[0]
+    assert LockDirJobQueue(tmp_path / "queue").release_stale(60) == 0
+    queue.heartbeat(job_dirs + ["unclaimed"], "worker")
+    queue.complete(job_dirs[0], "worker")
+    assert queue.counts() == dict(pending=0, claimed=0, done=1, failed=0)
+
+def test_requeue_failed(tmp_path):
+    job_dirs = write_jobs(tmp_path, [5, 10])
+    queue = LockDirJobQueue(tmp_path / "queue")
+    queue.seed(job_dirs)
+    for job_dir in [queue.claim("worker"), queue.claim("worker")]:
+        queue.complete(job_dir, "worker", None if job_dir == job_dirs[0] else "failed")
+    assert queue.seed(job_dirs) == 0
+    assert queue.requeue_failed() == 1
+    assert queue.claim("worker") == job_dirs[1]
+    assert queue.claim("worker") is None
@@ -0,0 +1,68 @@
+import json
+
+import pytest
+
+import models.job_runner
+import process_job
+from models import benchmark
+from models.job_processor import Processor
+from models.run_config import InstrumentationConfig, ManifestConfig, PipelineConfig, option_config
+from models.sqlite_connection import SQLiteConnection
+from models.synthetic_job import write_synthetic_jobs
+
+from .conftest import table_rows
+
+@pytest.fixture
+def run(tmp_path, database, monkeypatch):
+    """
+    process_job_list on the stand-in database (every SQL_Connection opens it), with a list of 3 synthetic jobs
+    """
+    connection, cursor, _ = database
+    class StandinConnection(SQLiteConnection):
+        def __init__(self, *args, **kwargs):
+            super().__init__(connection.path)
+    monkeypatch.setattr(process_job, "SQL_Connection", StandinConnection)
+    monkeypatch.setattr(models.job_runner, "SQL_Connection", StandinConnection)
+    job_dirs = write_synthetic_jobs(tmp_path / "jobs", 3, protein_length=20, n_variants=10, n_shards=2)
+    job_list_file = tmp_path / "jobs.txt"
+    job_list_file.write_text("\n".join(job_dirs))
+    def run_jobs(**kwargs):
+        try:
+            process_job.process_job_list("standin", "standin.yaml", job_list_file=str(job_list_file), **benchmark.RUN_OPTIONS, **kwargs)
+        finally:
+            models.job_runner.release_worker_resources()
+    return run_jobs, job_dirs, cursor
+
+def test_option_config():
+    assert option_config(PipelineConfig, False) is None
+    assert option_config(PipelineConfig, True).writers == 1
+    assert option_config(PipelineConfig, dict(writers=2)).writers == 2
+    assert option_config(ManifestConfig, "manifest", "path").path == "manifest"
+    with pytest.raises(ValueError):
+        option_config(PipelineConfig, "2")
+    with pytest.raises(TypeError):
+        option_config(PipelineConfig, dict(writer=2))
+    with pytest.raises(ValueError, match="--manifest needs a path"):
+        option_config(ManifestConfig, True, "path", "manifest")
+    assert option_config(InstrumentationConfig, True, "metrics_log", "instrument").metrics_log is None
+
+def test_job_queue_and_manifest(tmp_path, run):
+    run_jobs, job_dirs, cursor = run
+    queue_dir = tmp_path / "queue"
+    run_jobs(job_queue=str(queue_dir), manifest=dict(path=str(tmp_path / "manifest")))
+    assert len(table_rows(cursor, "Protein")) == len(job_dirs)
+    assert sorted(path.read_text() for path in (queue_dir / "done").iterdir()) == sorted(job_dirs)
+    run_jobs(job_queue=dict(location=str(queue_dir)), manifest=str(tmp_path / "manifest"))
+    assert len(list((queue_dir / "done").iterdir())) == len(job_dirs)
+
+def test_failing_run_records_job_metrics(tmp_path, run, monkeypatch):
+    run_jobs, job_dirs, cursor = run
+    def write_job(self, results):
+        raise RuntimeError("disk full")
+    monkeypatch.setattr(Processor, "write_job", write_job)
+    metrics_log = tmp_path / "metrics.jsonl"
+    with pytest.raises(RuntimeError):
+        run_jobs(instrument=str(metrics_log))
+    records = [json.loads(line) for line in metrics_log.read_text().splitlines()]
+    assert [(record['job_dir'], record['error']) for record in records] == [(job_dirs[0], "RuntimeError: disk full")]
+    assert table_rows(cursor, "Variant") == []